@@ -123,5 +123,44 @@ main(void)
     cout << "sec/iter: " << (tt.lap_ms() / float(niters)) << endl;
     cout << "ignore: " << score << endl;
   }
+
+  // scoring one value against every group of a single feature: one
+  // virtual call per group, versus one batched call into a group_array
+  const size_t K = 200;
+  vector<shared_ptr<models::group>> kgroups;
+  for (size_t k = 0; k < K; k++)
+    kgroups.emplace_back(shares[0]->create_group(r));
+  auto karray = shares[0]->create_group_array();
+  for (size_t k = 0; k < K; k++)
+    karray->create_group(*shares[0], r);
+  acc.reset();
+  for (size_t k = 0; k < K; k++) {
+    kgroups[k]->add_value(*shares[0], acc.get(), r);
+    karray->add_value(*shares[0], k, acc.get(), r);
+  }
+  vector<float> scores(K);
+
+  {
+    timer tt;
+    for (size_t n = 0; n < niters; n++) {
+      acc.reset();
+      for (size_t k = 0; k < K; k++)
+        scores[k] = kgroups[k]->score_value(*shares[0], acc.get(), r);
+      score += scores[n % K];
+    }
+    cout << "sec/iter: " << (tt.lap_ms() / float(niters)) << endl;
+    cout << "ignore: " << score << endl;
+  }
+
+  {
+    timer tt;
+    for (size_t n = 0; n < niters; n++) {
+      acc.reset();
+      karray->score_value(*shares[0], acc.get(), scores.data(), r);
+      score += scores[n % K];
+    }
+    cout << "sec/iter: " << (tt.lap_ms() / float(niters)) << endl;
+    cout << "ignore: " << score << endl;
+  }
   return 0;
 }
@@ -0,0 +1,75 @@
+#include <microscopes/common/group_manager.hpp>
+#include <microscopes/common/random_fwd.hpp>
+#include <microscopes/common/timer.hpp>
+
+#include <random>
+#include <iostream>
+
+using namespace std;
+using namespace distributions;
+using namespace microscopes;
+using namespace microscopes::common;
+
+// mimics the group bookkeeping of a collapsed gibbs sweep: each entity is
+// removed, scored against every group (plus one empty group), and re-added
+template <typename GroupManager>
+static void
+bench(const char *name, size_t n, size_t initial_groups, size_t niters)
+{
+  rng_t r(73);
+  GroupManager g(n);
+  // alpha ~ # of groups keeps the number of groups roughly stable
+  g.get_hp_mutator("alpha").template set<float>(initial_groups, 0);
+  for (size_t i = 0; i < initial_groups; i++)
+    g.create_group();
+  for (size_t i = 0; i < n; i++)
+    g.add_value(i % initial_groups, i);
+
+  vector<size_t> gids;
+  vector<float> scores;
+  float ignore = 0.;
+  timer tt;
+  for (size_t it = 0; it < niters; it++) {
+    for (size_t eid = 0; eid < n; eid++) {
+      const size_t gid = g.remove_value(eid).first;
+      if (!g.groupsize(gid))
+        g.delete_group(gid);
+      if (g.empty_groups().empty())
+        g.create_group();
+
+      gids.clear();
+      scores.clear();
+      for (auto &p : g) {
+        gids.push_back(p.first);
+        scores.push_back(g.pseudocount(p.first, p.second));
+      }
+      // re-look up every candidate, as the models' score_value() does
+      float sum = 0.;
+      for (size_t i = 0; i < gids.size(); i++) {
+        scores[i] *= float(1 + (g.group(gids[i]).data_ & 1));
+        sum += scores[i];
+      }
+      float u = uniform_real_distribution<float>(0., sum)(r);
+      size_t choice = 0;
+      while (choice + 1 < gids.size() && (u -= scores[choice]) > 0.)
+        choice++;
+      g.add_value(gids[choice], eid)++;
+      ignore += sum;
+    }
+  }
+  const double ms = tt.lap_ms();
+  cout << name << " (n=" << n << ", groups=" << g.ngroups() << "): "
+       << (ms / float(niters)) << " ms/sweep" << endl;
+  cout << "ignore: " << ignore << endl;
+}
+
+int
+main(void)
+{
+  const size_t niters = 20;
+  for (size_t groups : {10, 100, 1000}) {
+    bench<group_manager<size_t>>("map ", 10000, groups, niters);
+    bench<flat_group_manager<size_t>>("flat", 10000, groups, niters);
+  }
+  return 0;
+}
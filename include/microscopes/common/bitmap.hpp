@@ -0,0 +1,73 @@
+#pragma once
+
+#include <microscopes/common/assert.hpp>
+
+#include <cstdint>
+#include <cstddef>
+#include <cstring>
+
+namespace microscopes {
+namespace common {
+
+/**
+ * Helpers for packed bitmaps, one bit per element. Bits are stored
+ * most-significant first within each byte, which is the layout produced by
+ * numpy.packbits(), so masks can be packed on the python side and read here
+ * without any translation.
+ */
+struct bitmap {
+
+  static inline size_t
+  nbytes(size_t nbits)
+  {
+    return (nbits + 7) / 8;
+  }
+
+  static inline bool
+  test(const uint8_t *bits, size_t idx)
+  {
+    MICROSCOPES_ASSERT(bits);
+    return (bits[idx >> 3] >> (7 - (idx & 7))) & 1;
+  }
+
+  static inline void
+  set(uint8_t *bits, size_t idx, bool value=true)
+  {
+    MICROSCOPES_ASSERT(bits);
+    const uint8_t m = uint8_t(0x80u >> (idx & 7));
+    if (value)
+      bits[idx >> 3] |= m;
+    else
+      bits[idx >> 3] &= uint8_t(~m);
+  }
+
+  // true if any bit in [begin, end) is set
+  static inline bool
+  any(const uint8_t *bits, size_t begin, size_t end)
+  {
+    MICROSCOPES_ASSERT(begin <= end);
+    // bits up to the first byte boundary
+    for (; begin < end && (begin & 7); begin++)
+      if (test(bits, begin))
+        return true;
+    // whole 64-bit words (the bit order within a word does not matter here)
+    for (; begin + 64 <= end; begin += 64) {
+      uint64_t word;
+      std::memcpy(&word, bits + (begin >> 3), sizeof(word));
+      if (word)
+        return true;
+    }
+    // whole bytes
+    for (; begin + 8 <= end; begin += 8)
+      if (bits[begin >> 3])
+        return true;
+    // remaining tail
+    for (; begin < end; begin++)
+      if (test(bits, begin))
+        return true;
+    return false;
+  }
+};
+
+} // namespace common
+} // namespace microscopes
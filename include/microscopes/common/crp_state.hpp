@@ -0,0 +1,198 @@
+#pragma once
+
+#include <microscopes/common/entity_state.hpp>
+#include <microscopes/common/group_manager.hpp>
+#include <microscopes/common/assert.hpp>
+
+#include <distributions/special.hpp>
+
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+namespace microscopes {
+namespace common {
+
+/**
+ * An entity_based_state_object with a CRP clustering and no components, so
+ * the score of an entity in a group is just the (log) CRP pseudocount.
+ *
+ * Useful on its own as a prior-only state, and as the minimal concrete
+ * implementation of the entity_based_state_object interface.
+ */
+class crp_state : public entity_based_state_object {
+public:
+  crp_state(size_t n, float alpha)
+    : groups_(n)
+  {
+    MICROSCOPES_DCHECK(alpha > 0., "alpha must be positive");
+    groups_.get_hp_mutator("alpha").set(alpha);
+  }
+
+  size_t nentities() const override { return groups_.nentities(); }
+  size_t ngroups() const override { return groups_.ngroups(); }
+  size_t ncomponents() const override { return 0; }
+
+  std::vector<ssize_t>
+  assignments() const override
+  {
+    return groups_.assignments();
+  }
+
+  std::vector<size_t>
+  groups() const override
+  {
+    return groups_.groups();
+  }
+
+  size_t
+  groupsize(size_t gid) const override
+  {
+    return groups_.groupsize(gid);
+  }
+
+  const ssize_t *
+  assignments_data() const override
+  {
+    return groups_.assignments().data();
+  }
+
+  void
+  inplace_groups(size_t *gids, size_t *sizes) const override
+  {
+    groups_.inplace_groups(gids, sizes);
+  }
+
+  hyperparam_bag_t
+  get_cluster_hp() const override
+  {
+    return groups_.get_hp();
+  }
+
+  void
+  set_cluster_hp(const hyperparam_bag_t &hp) override
+  {
+    groups_.set_hp(hp);
+  }
+
+  value_mutator
+  get_cluster_hp_mutator(const std::string &key) override
+  {
+    return groups_.get_hp_mutator(key);
+  }
+
+  hyperparam_bag_t
+  get_component_hp(size_t component) const override
+  {
+    throw std::out_of_range("no components");
+  }
+
+  void
+  set_component_hp(size_t component, const hyperparam_bag_t &hp) override
+  {
+    throw std::out_of_range("no components");
+  }
+
+  void
+  set_component_hp(size_t component, const models::hypers &proto) override
+  {
+    throw std::out_of_range("no components");
+  }
+
+  value_mutator
+  get_component_hp_mutator(size_t component, const std::string &key) override
+  {
+    throw std::out_of_range("no components");
+  }
+
+  std::vector<ident_t>
+  suffstats_identifiers(size_t component) const override
+  {
+    throw std::out_of_range("no components");
+  }
+
+  suffstats_bag_t
+  get_suffstats(size_t component, ident_t id) const override
+  {
+    throw std::out_of_range("no components");
+  }
+
+  void
+  set_suffstats(size_t component, ident_t id, const suffstats_bag_t &ss) override
+  {
+    throw std::out_of_range("no components");
+  }
+
+  value_mutator
+  get_suffstats_mutator(size_t component,
+                        ident_t id,
+                        const std::string &key) override
+  {
+    throw std::out_of_range("no components");
+  }
+
+  void
+  add_value(size_t gid, size_t eid, rng_t &rng) override
+  {
+    groups_.add_value(gid, eid);
+  }
+
+  size_t
+  remove_value(size_t eid, rng_t &rng) override
+  {
+    return groups_.remove_value(eid).first;
+  }
+
+  void
+  inplace_score_value(std::pair<std::vector<size_t>, std::vector<float>> &scores,
+                      size_t eid,
+                      rng_t &rng) const override
+  {
+    MICROSCOPES_DCHECK(groups_.assignments().at(eid) == -1,
+                       "entity already assigned");
+    scores.first.clear();
+    scores.second.clear();
+    for (const auto &g : groups_) {
+      scores.first.push_back(g.first);
+      scores.second.push_back(
+          distributions::fast_log(groups_.pseudocount(g.first, g.second)));
+    }
+  }
+
+  float
+  score_assignment() const override
+  {
+    return groups_.score_assignment();
+  }
+
+  float
+  score_likelihood(size_t component, ident_t id, rng_t &rng) const override
+  {
+    throw std::out_of_range("no components");
+  }
+
+  std::vector<size_t>
+  empty_groups() const override
+  {
+    return groups_.empty_groups();
+  }
+
+  size_t
+  create_group(rng_t &rng) override
+  {
+    return groups_.create_group().first;
+  }
+
+  void
+  delete_group(size_t gid) override
+  {
+    groups_.delete_group(gid);
+  }
+
+private:
+  // the group data is unused
+  group_manager<char> groups_;
+};
+
+} // namespace common
+} // namespace microscopes
@@ -4,8 +4,12 @@
 #include <microscopes/common/runtime_type.hpp>
 #include <microscopes/common/runtime_value.hpp>
 #include <microscopes/common/typedefs.hpp>
+#include <microscopes/common/macros.hpp>
+#include <microscopes/common/assert.hpp>
 #include <microscopes/models/base.hpp>
 
+#include <algorithm>
+
 namespace microscopes {
 namespace common {
 
@@ -36,6 +40,31 @@ public:
 
   virtual size_t groupsize(size_t gid) const = 0;
 
+  /**
+   * Pointer to the nentities() assignments, if the implementation keeps
+   * them contiguously (e.g. group_manager::assignments()), or nullptr. The
+   * pointer is valid for the lifetime of the state and reflects subsequent
+   * add_value()/remove_value() calls.
+   */
+  virtual const ssize_t *
+  assignments_data() const
+  {
+    return nullptr;
+  }
+
+  /**
+   * Writes the ngroups() gids and their sizes into the given buffers, in
+   * the order of groups()
+   */
+  virtual void
+  inplace_groups(size_t *gids, size_t *sizes) const
+  {
+    for (auto gid : groups()) {
+      *gids++ = gid;
+      *sizes++ = groupsize(gid);
+    }
+  }
+
   // Routines for manipulating the parameters
 
   virtual hyperparam_bag_t get_cluster_hp() const = 0;
@@ -71,6 +100,39 @@ public:
                       size_t eid,
                       rng_t &rng) const = 0;
 
+  /**
+   * Scores each of the n entities in eids against every group, writing the
+   * scores for eids[i] into scores[i*stride : i*stride + ngroups()]. The
+   * group ids for the columns are written into gids.
+   *
+   * The caller must supply a buffer of at least (n-1)*stride + ngroups()
+   * floats. Implementations are free to override this to avoid the per
+   * entity overhead of inplace_score_value().
+   */
+  virtual void
+  inplace_score_values(const size_t *eids,
+                       size_t n,
+                       std::vector<size_t> &gids,
+                       float *scores,
+                       size_t stride,
+                       rng_t &rng) const
+  {
+    MICROSCOPES_DCHECK(stride >= ngroups(), "stride too small");
+    gids.clear();
+    // reuse one scratch buffer across all the entities
+    std::pair<std::vector<size_t>, std::vector<float>> scratch;
+    for (size_t i = 0; i < n; i++) {
+      inplace_score_value(scratch, eids[i], rng);
+      MICROSCOPES_ASSERT(scratch.first.size() == scratch.second.size());
+      if (!i)
+        gids = scratch.first;
+      else
+        MICROSCOPES_DCHECK(scratch.first == gids, "group order changed");
+      std::copy(scratch.second.begin(), scratch.second.end(), scores);
+      scores += stride;
+    }
+  }
+
   virtual float score_assignment() const = 0;
 
   virtual float score_likelihood(size_t component, ident_t id, rng_t &rng) const = 0;
@@ -14,6 +14,7 @@
 #include <set>
 #include <functional>
 #include <map>
+#include <algorithm>
 #include <memory>
 #include <sstream>
 #include <utility>
@@ -45,33 +46,215 @@ struct gd {
   T data_;
 };
 
+namespace detail {
+
+/**
+ * Group storage backed by an ordered map. Group ids are handed out
+ * monotonically and never reused, and iteration is in gid order.
+ *
+ * Let N = # of groups.
+ *   (a) O(log N) - lookup, create/delete group
+ *   (b) O(N) - iteration
+ */
+template <typename T>
+class map_group_store {
+public:
+  typedef std::map<size_t, gd<T>> map_type;
+  typedef typename map_type::const_iterator const_iterator;
+
+  map_group_store() : gcount_(), groups_() {}
+
+  inline size_t size() const { return groups_.size(); }
+
+  inline const gd<T> *
+  find(size_t gid) const
+  {
+    const auto it = groups_.find(gid);
+    return (it == groups_.end()) ? nullptr : &it->second;
+  }
+
+  inline gd<T> *
+  find(size_t gid)
+  {
+    auto it = groups_.find(gid);
+    return (it == groups_.end()) ? nullptr : &it->second;
+  }
+
+  inline std::pair<size_t, gd<T>&>
+  create()
+  {
+    const size_t gid = gcount_++;
+    return std::pair<size_t, gd<T>&>(gid, groups_[gid]);
+  }
+
+  inline void
+  insert(size_t gid, gd<T> &&g)
+  {
+    MICROSCOPES_DCHECK(!groups_.count(gid), "duplicate gid");
+    groups_[gid] = std::move(g);
+    // gcount_ is 1+max group id seen
+    gcount_ = std::max(gcount_, gid + 1);
+  }
+
+  inline void
+  erase(size_t gid)
+  {
+    auto it = groups_.find(gid);
+    MICROSCOPES_DCHECK(it != groups_.end(), "invalid gid");
+    groups_.erase(it);
+  }
+
+  inline const_iterator begin() const { return groups_.begin(); }
+  inline const_iterator end() const { return groups_.end(); }
+
+private:
+  size_t gcount_;
+  map_type groups_;
+};
+
+/**
+ * Group storage backed by flat arrays. The active groups live packed
+ * together in a vector of (gid, group) pairs, and a slot vector indexed by
+ * gid records each group's position in the packed vector. Deleted gids go
+ * onto a free list and are handed out again by create(), so gids stay
+ * dense. Iteration order is unspecified.
+ *
+ * Unlike map_group_store, references to groups are invalidated by
+ * create()/insert()/erase().
+ *
+ * Let N = # of groups.
+ *   (a) O(1) - lookup, create/delete group (amortized)
+ *   (b) O(N) - iteration, over contiguous memory
+ */
 template <typename T>
+class flat_group_store {
+public:
+  typedef std::vector<std::pair<size_t, gd<T>>> dense_type;
+  typedef typename dense_type::const_iterator const_iterator;
+
+  flat_group_store() : dense_(), slots_(), free_() {}
+
+  inline size_t size() const { return dense_.size(); }
+
+  inline const gd<T> *
+  find(size_t gid) const
+  {
+    if (gid >= slots_.size() || slots_[gid] == npos)
+      return nullptr;
+    return &dense_[slots_[gid]].second;
+  }
+
+  inline gd<T> *
+  find(size_t gid)
+  {
+    if (gid >= slots_.size() || slots_[gid] == npos)
+      return nullptr;
+    return &dense_[slots_[gid]].second;
+  }
+
+  inline std::pair<size_t, gd<T>&>
+  create()
+  {
+    size_t gid = slots_.size();
+    while (!free_.empty()) {
+      const size_t candidate = free_.back();
+      free_.pop_back();
+      // the free list is lazily cleaned, insert() can claim a free slot
+      if (slots_[candidate] == npos) {
+        gid = candidate;
+        break;
+      }
+    }
+    if (gid == slots_.size())
+      slots_.push_back(npos);
+    slots_[gid] = dense_.size();
+    dense_.emplace_back(gid, gd<T>());
+    return std::pair<size_t, gd<T>&>(gid, dense_.back().second);
+  }
+
+  inline void
+  insert(size_t gid, gd<T> &&g)
+  {
+    if (gid >= slots_.size()) {
+      for (size_t i = slots_.size(); i < gid; i++)
+        free_.push_back(i);
+      slots_.resize(gid + 1, npos);
+    }
+    MICROSCOPES_DCHECK(slots_[gid] == npos, "duplicate gid");
+    slots_[gid] = dense_.size();
+    dense_.emplace_back(gid, std::move(g));
+  }
+
+  inline void
+  erase(size_t gid)
+  {
+    MICROSCOPES_DCHECK(
+        gid < slots_.size() && slots_[gid] != npos, "invalid gid");
+    const size_t pos = slots_[gid];
+    if (pos + 1 != dense_.size()) {
+      dense_[pos] = std::move(dense_.back());
+      slots_[dense_[pos].first] = pos;
+    }
+    dense_.pop_back();
+    slots_[gid] = npos;
+    free_.push_back(gid);
+  }
+
+  inline const_iterator begin() const { return dense_.begin(); }
+  inline const_iterator end() const { return dense_.end(); }
+
+private:
+  static constexpr size_t npos = static_cast<size_t>(-1);
+
+  dense_type dense_;
+  std::vector<size_t> slots_;
+  std::vector<size_t> free_;
+};
+
+template <typename T>
+constexpr size_t flat_group_store<T>::npos;
+
+} // namespace detail
+
+/**
+ * The group storage is a policy: detail::map_group_store (the default)
+ * keeps gids monotonic and iterates in gid order, while
+ * detail::flat_group_store (see flat_group_manager) trades those
+ * guarantees for O(1) group lookups in the sampler's inner loop. Both
+ * serialize to the same io::GroupManager message.
+ */
+template <typename T,
+          template <typename> class Store = detail::map_group_store>
 class group_manager {
 public:
   typedef io::CRP message_type;
-  typedef typename std::map<size_t, gd<T>>::const_iterator const_iterator;
+  typedef Store<T> store_type;
+  typedef typename store_type::const_iterator const_iterator;
 
   // for std containers
   group_manager()
     : alpha_(),
-      gcount_(),
       gempty_(),
       assignments_(),
-      groups_()
+      groups_(),
+      nassigned_(),
+      lgamma_counts_()
   {}
 
   group_manager(size_t n)
     : alpha_(),
-      gcount_(),
       gempty_(),
       assignments_(n, -1),
-      groups_()
+      groups_(),
+      nassigned_(),
+      lgamma_counts_()
   {}
 
   group_manager(
       const serialized_t &repr,
       std::function<T(const std::string &)> group_deserializer_fn)
-    : alpha_(), gcount_(), gempty_(), assignments_(), groups_()
+    : alpha_(), gempty_(), assignments_(), groups_(),
+      nassigned_(), lgamma_counts_()
   {
     io::GroupManager m;
     util::protobuf_from_string(m, repr);
@@ -94,14 +277,13 @@ public:
       const auto it = counts.find(g.id());
       const size_t count = (it == counts.end()) ? 0 : it->second;
       gd<T> gdata(count, std::move(group_deserializer_fn(g.data())));
-      groups_[g.id()] = std::move(gdata);
+      groups_.insert(g.id(), std::move(gdata));
       if (!count)
-        gempty_.insert(g.id());
+        mark_empty(g.id());
+      nassigned_ += count;
+      if (count)
+        lgamma_counts_ += std::lgamma(double(count));
     }
-
-    // gcount_ is 1+max group id seen
-    if (!groups_.empty())
-      gcount_ = groups_.crbegin()->first + 1;
   }
 
   inline hyperparam_bag_t
@@ -135,7 +317,8 @@ public:
     return assignments_;
   }
 
-  inline const std::set<size_t> &
+  // the gids of the empty groups, in increasing order
+  inline const std::vector<size_t> &
   empty_groups() const
   {
     return gempty_;
@@ -147,7 +330,7 @@ public:
   inline bool
   isactivegroup(size_t gid) const
   {
-    return groups_.find(gid) != groups_.end();
+    return groups_.find(gid) != nullptr;
   }
 
   inline size_t
@@ -159,17 +342,17 @@ public:
   inline const gd<T> &
   group(size_t gid) const
   {
-    const auto it = groups_.find(gid);
-    MICROSCOPES_DCHECK(it != groups_.end(), "invalid gid");
-    return it->second;
+    const gd<T> *g = groups_.find(gid);
+    MICROSCOPES_DCHECK(g, "invalid gid");
+    return *g;
   }
 
   inline gd<T> &
   group(size_t gid)
   {
-    auto it = groups_.find(gid);
-    MICROSCOPES_DCHECK(it != groups_.end(), "invalid gid");
-    return it->second;
+    gd<T> *g = groups_.find(gid);
+    MICROSCOPES_DCHECK(g, "invalid gid");
+    return *g;
   }
 
   inline std::vector<size_t>
@@ -182,6 +365,19 @@ public:
     return ret;
   }
 
+  /**
+   * Writes the ngroups() active gids and their sizes into the given
+   * buffers in one pass, in iteration order
+   */
+  inline void
+  inplace_groups(size_t *gids, size_t *sizes) const
+  {
+    for (auto &g : groups_) {
+      *gids++ = g.first;
+      *sizes++ = g.second.count_;
+    }
+  }
+
   inline const_iterator
   begin() const
   {
@@ -197,39 +393,39 @@ public:
   inline std::pair<size_t, T&>
   create_group()
   {
-    const size_t gid = gcount_++;
-    auto &g = groups_[gid]; // create the group
-    MICROSCOPES_ASSERT(!gempty_.count(gid));
-    gempty_.insert(gid);
-    return std::pair<size_t, T&>(gid, g.data_);
+    auto p = groups_.create(); // create the group
+    MICROSCOPES_ASSERT(!isempty(p.first));
+    mark_empty(p.first);
+    return std::pair<size_t, T&>(p.first, p.second.data_);
   }
 
   inline void
   delete_group(size_t gid)
   {
-    auto it = groups_.find(gid);
-    MICROSCOPES_DCHECK(it != groups_.end(), "invalid gid");
-    MICROSCOPES_DCHECK(!it->second.count_, "group not empty");
-    MICROSCOPES_ASSERT(gempty_.count(gid));
-    groups_.erase(it);
-    gempty_.erase(gid);
+    MICROSCOPES_DCHECK(!group(gid).count_, "group not empty");
+    MICROSCOPES_ASSERT(isempty(gid));
+    groups_.erase(gid);
+    unmark_empty(gid);
   }
 
   inline T &
   add_value(size_t gid, size_t eid)
   {
     MICROSCOPES_DCHECK(assignments_.at(eid) == -1, "entity already assigned");
-    auto it = groups_.find(gid);
-    MICROSCOPES_DCHECK(it != groups_.end(), "invalid gid");
-    if (!it->second.count_++) {
-      MICROSCOPES_ASSERT(gempty_.count(gid));
-      gempty_.erase(gid);
-      MICROSCOPES_ASSERT(!gempty_.count(gid));
+    gd<T> *g = groups_.find(gid);
+    MICROSCOPES_DCHECK(g, "invalid gid");
+    if (!g->count_++) {
+      MICROSCOPES_ASSERT(isempty(gid));
+      unmark_empty(gid);
+      MICROSCOPES_ASSERT(!isempty(gid));
     } else {
-      MICROSCOPES_ASSERT(!gempty_.count(gid));
+      MICROSCOPES_ASSERT(!isempty(gid));
+      // lgamma(n+1) - lgamma(n) = log(n)
+      lgamma_counts_ += std::log(double(g->count_ - 1));
     }
+    nassigned_++;
     assignments_[eid] = gid;
-    return it->second.data_;
+    return g->data_;
   }
 
   inline std::pair<size_t, T&>
@@ -237,18 +433,58 @@ public:
   {
     MICROSCOPES_DCHECK(assignments_.at(eid) != -1, "entity not assigned");
     const size_t gid = assignments_[eid];
-    auto it = groups_.find(gid);
-    MICROSCOPES_ASSERT(it != groups_.end());
-    MICROSCOPES_ASSERT(!gempty_.count(gid));
-    MICROSCOPES_ASSERT(it->second.count_);
-    if (!--it->second.count_)
-      gempty_.insert(gid);
+    gd<T> *g = groups_.find(gid);
+    MICROSCOPES_ASSERT(g);
+    MICROSCOPES_ASSERT(!isempty(gid));
+    MICROSCOPES_ASSERT(g->count_);
+    if (!--g->count_)
+      mark_empty(gid);
+    else
+      lgamma_counts_ -= std::log(double(g->count_));
+    nassigned_--;
     assignments_[eid] = -1;
-    return std::pair<size_t, T&>(gid, it->second.data_);
+    return std::pair<size_t, T&>(gid, g->data_);
   }
 
+  /**
+   * Log probability of the current assignment under the CRP, which is
+   *
+   *   K log(alpha) + lgamma(alpha) - lgamma(N + alpha) + sum_k lgamma(n_k)
+   *
+   * for K non-empty groups of sizes n_k, with N = sum_k n_k. The sum is
+   * maintained by add_value()/remove_value(), so this is O(1).
+   */
   inline float
   score_assignment() const
+  {
+    using distributions::fast_log;
+    using distributions::fast_lgamma;
+    MICROSCOPES_DCHECK(nassigned_ == nentities(), "not assigned");
+    const size_t k = ngroups() - gempty_.size();
+    const float score =
+      float(k) * fast_log(alpha_) +
+      fast_lgamma(alpha_) -
+      fast_lgamma(float(nassigned_) + alpha_) +
+      float(lgamma_counts_);
+#ifdef DEBUG_MODE
+    // sum_k lgamma(n_k) is kept in double precision, so a recomputation
+    // matches it up to rounding, and a single missed update of a group of
+    // size >= 2 (at least log(2)) stands out even on large states
+    double expected = 0.;
+    for (const auto &g : groups_)
+      if (g.second.count_)
+        expected += std::lgamma(double(g.second.count_));
+    MICROSCOPES_DCHECK(
+        std::fabs(lgamma_counts_ - expected) <=
+          1e-9 * double(std::max(size_t(1), nentities())),
+        "incremental CRP score out of sync");
+#endif
+    return score;
+  }
+
+  // O(N) sequential evaluation of score_assignment(), kept as a reference
+  inline float
+  score_assignment_from_scratch() const
   {
     using distributions::fast_log;
     std::map<size_t, size_t> counts;
@@ -298,13 +534,49 @@ public:
   }
 
 protected:
+  inline bool
+  isempty(size_t gid) const
+  {
+    return std::binary_search(gempty_.begin(), gempty_.end(), gid);
+  }
+
+  inline void
+  mark_empty(size_t gid)
+  {
+    const auto it = std::lower_bound(gempty_.begin(), gempty_.end(), gid);
+    MICROSCOPES_ASSERT(it == gempty_.end() || *it != gid);
+    gempty_.insert(it, gid);
+  }
+
+  inline void
+  unmark_empty(size_t gid)
+  {
+    const auto it = std::lower_bound(gempty_.begin(), gempty_.end(), gid);
+    MICROSCOPES_ASSERT(it != gempty_.end() && *it == gid);
+    gempty_.erase(it);
+  }
+
   float alpha_;
-  size_t gcount_;
-  std::set<size_t> gempty_;
+
+  // sorted. there are few empty groups at a time, so a vector is cheaper
+  // than a set, and unlike one does not allocate on every create/delete
+  std::vector<size_t> gempty_;
   std::vector<ssize_t> assignments_;
-  std::map<size_t, gd<T>> groups_;
+  store_type groups_;
+
+  // # of assigned entities and sum_k lgamma(n_k) over non-empty groups,
+  // for score_assignment()
+  size_t nassigned_;
+  double lgamma_counts_;
 };
 
+/**
+ * A group_manager with O(1) group lookups, at the cost of reusing deleted
+ * gids and unordered iteration (see detail::flat_group_store).
+ */
+template <typename T>
+using flat_group_manager = group_manager<T, detail::flat_group_store>;
+
 /**
  * Manages groups and nothing else.
  *
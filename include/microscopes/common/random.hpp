@@ -10,6 +10,7 @@
 #include <cmath>
 #include <random>
 #include <utility>
+#include <tuple>
 #include <iostream>
 
 namespace microscopes {
@@ -70,23 +71,177 @@ struct random {
     return X * X.transpose();
   }
 
+  /**
+   * Returns the (lower) Cholesky factor of a draw from IW(nu, psi), given
+   * psi_chol, the Cholesky factor of psi.
+   *
+   * With B the upper triangular Bartlett factor of a W(nu, I) draw,
+   * psi_chol^{-T} B B^T psi_chol^{-1} is a draw from W(nu, psi^{-1}). Its
+   * inverse is T T^T, for the lower triangular T = psi_chol B^{-T}, which
+   * takes a single triangular solve (and no explicit inverses)
+   */
+  static inline Eigen::MatrixXf
+  sample_inverse_wishart_cholesky(
+      float nu, const Eigen::MatrixXf &psi_chol, rng_t &rng)
+  {
+    MICROSCOPES_ASSERT(psi_chol.rows() == psi_chol.cols());
+    const unsigned d = psi_chol.rows();
+
+    Eigen::MatrixXf B = Eigen::MatrixXf::Zero(d, d);
+    for (unsigned i = 0; i < d; i++)
+      B(i, i) = sqrt(
+          std::chi_squared_distribution<float>(nu - float(d - 1 - i))(rng));
+
+    std::normal_distribution<float> norm;
+    for (unsigned i = 0; i < d; i++)
+      for (unsigned j = i + 1; j < d; j++)
+        B(i, j) = norm(rng);
+
+    // T^T = B^{-1} psi_chol^T
+    Eigen::MatrixXf Tt = psi_chol.transpose();
+    B.triangularView<Eigen::Upper>().solveInPlace(Tt);
+    return Tt.transpose();
+  }
+
   static inline Eigen::MatrixXf
   sample_inverse_wishart(float nu, const Eigen::MatrixXf &psi, rng_t &rng)
   {
-    // XXX: horrible
-    Eigen::MatrixXf psi_inv = psi.inverse();
-    Eigen::MatrixXf sigma_inv = sample_wishart(nu, psi_inv, rng);
-    //std::cout << "psi_inv: " << psi_inv << std::endl;
-    //std::cout << "sigma_inv: " << sigma_inv << std::endl;
-    return sigma_inv.inverse();
+    MICROSCOPES_ASSERT(psi.rows() == psi.cols());
+    Eigen::LLT<Eigen::MatrixXf> llt(psi);
+    MICROSCOPES_ASSERT(llt.info() == Eigen::Success);
+    const Eigen::MatrixXf T =
+      sample_inverse_wishart_cholesky(nu, llt.matrixL(), rng);
+    return T * T.transpose();
+  }
+
+  /**
+   * Returns (mu, cov, chol(cov)), for cov ~ IW(nu, psi)/lambda and
+   * mu ~ N(mu0, cov), given psi_chol, the Cholesky factor of psi. The
+   * factor of cov comes straight from the Bartlett decomposition, so cov is
+   * never factored (or inverted)
+   */
+  static inline std::tuple<Eigen::VectorXf, Eigen::MatrixXf, Eigen::MatrixXf>
+  sample_normal_inverse_wishart_cholesky(
+      const Eigen::VectorXf &mu0,
+      float lambda,
+      const Eigen::MatrixXf &psi_chol,
+      float nu,
+      rng_t &rng)
+  {
+    MICROSCOPES_ASSERT(mu0.size() == psi_chol.rows());
+    const Eigen::MatrixXf cov_chol =
+      sample_inverse_wishart_cholesky(nu, psi_chol, rng) / sqrt(lambda);
+
+    Eigen::VectorXf z(mu0.size());
+    std::normal_distribution<float> norm;
+    for (unsigned i = 0; i < mu0.size(); i++)
+      z(i) = norm(rng);
+
+    Eigen::VectorXf mu = mu0;
+    mu.noalias() += cov_chol.triangularView<Eigen::Lower>() * z;
+    Eigen::MatrixXf cov = cov_chol * cov_chol.transpose();
+    return std::make_tuple(mu, cov, cov_chol);
   }
 
   static inline std::pair<Eigen::VectorXf, Eigen::MatrixXf>
   sample_normal_inverse_wishart(const Eigen::VectorXf &mu0, float lambda, const Eigen::MatrixXf &psi, float nu, rng_t &rng)
   {
-    Eigen::MatrixXf cov = 1./lambda * sample_inverse_wishart(nu, psi, rng);
-    Eigen::VectorXf mu = sample_multivariate_normal(mu0, cov, rng);
-    return std::make_pair(mu, cov);
+    Eigen::LLT<Eigen::MatrixXf> llt(psi);
+    MICROSCOPES_ASSERT(llt.info() == Eigen::Success);
+    const auto sample = sample_normal_inverse_wishart_cholesky(
+        mu0, lambda, llt.matrixL(), nu, rng);
+    return std::make_pair(std::get<0>(sample), std::get<1>(sample));
+  }
+
+  // The samplers below read their inputs from, and write their outputs to,
+  // caller owned buffers (eg numpy arrays), which are mapped rather than
+  // copied element by element. Matrices are row-major, dim x dim
+
+  typedef Eigen::Matrix<
+    float, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor> row_major_matrixf;
+  typedef Eigen::Map<const Eigen::VectorXf> const_vectorf_map;
+  typedef Eigen::Map<const row_major_matrixf> const_matrixf_map;
+  typedef Eigen::Map<row_major_matrixf> matrixf_map;
+
+  /**
+   * Writes n draws, one per row of out (n x dim), with the Cholesky
+   * factorization of sigma computed once for all of them. For n=1, the
+   * draw is the same as the one returned by the Eigen overload
+   */
+  static inline void
+  sample_multivariate_normal(
+      const float *mu,
+      const float *sigma,
+      size_t dim,
+      size_t n,
+      float *out,
+      rng_t &rng)
+  {
+    const const_vectorf_map mu_m(mu, dim);
+    const Eigen::MatrixXf sigma_m = const_matrixf_map(sigma, dim, dim);
+    MICROSCOPES_ASSERT(util::is_symmetric_positive_definite(sigma_m));
+
+    Eigen::LLT<Eigen::MatrixXf> llt(sigma_m);
+    MICROSCOPES_ASSERT(llt.info() == Eigen::Success);
+
+    // the i-th draw is column i of Z, drawn in the same order as above
+    Eigen::MatrixXf Z(dim, n);
+    std::normal_distribution<float> norm;
+    for (size_t i = 0; i < n; i++)
+      for (size_t j = 0; j < dim; j++)
+        Z(j, i) = norm(rng);
+
+    // out, as a row-major n x dim matrix, is a column-major dim x n one
+    Eigen::Map<Eigen::MatrixXf> out_m(out, dim, n);
+    out_m.noalias() = llt.matrixL() * Z;
+    out_m.colwise() += mu_m;
+  }
+
+  static inline void
+  sample_wishart(
+      float nu,
+      const float *scale,
+      size_t dim,
+      float *out,
+      rng_t &rng)
+  {
+    matrixf_map(out, dim, dim) =
+      sample_wishart(nu, const_matrixf_map(scale, dim, dim), rng);
+  }
+
+  static inline void
+  sample_inverse_wishart(
+      float nu,
+      const float *psi,
+      size_t dim,
+      float *out,
+      rng_t &rng)
+  {
+    matrixf_map(out, dim, dim) =
+      sample_inverse_wishart(nu, const_matrixf_map(psi, dim, dim), rng);
+  }
+
+  // out_chol, if not null, gets the (lower) Cholesky factor of the cov
+  static inline void
+  sample_normal_inverse_wishart(
+      const float *mu0,
+      float lambda,
+      const float *psi,
+      float nu,
+      size_t dim,
+      float *out_mu,
+      float *out_cov,
+      float *out_chol,
+      rng_t &rng)
+  {
+    Eigen::LLT<Eigen::MatrixXf> llt(const_matrixf_map(psi, dim, dim));
+    MICROSCOPES_ASSERT(llt.info() == Eigen::Success);
+    const auto sample = sample_normal_inverse_wishart_cholesky(
+        const_vectorf_map(mu0, dim), lambda, llt.matrixL(), nu, rng);
+    Eigen::Map<Eigen::VectorXf>(out_mu, dim) = std::get<0>(sample);
+    matrixf_map(out_cov, dim, dim) = std::get<1>(sample);
+    if (out_chol)
+      matrixf_map(out_chol, dim, dim) = std::get<2>(sample);
   }
 };
 
@@ -5,8 +5,10 @@
 #include <microscopes/common/random_fwd.hpp>
 #include <microscopes/common/macros.hpp>
 #include <microscopes/common/assert.hpp>
+#include <microscopes/common/bitmap.hpp>
 
 #include <vector>
+#include <memory>
 #include <cstring>
 #include <iostream>
 
@@ -18,13 +20,29 @@ class row_accessor {
   friend class row_mutator;
 public:
   row_accessor()
-    : data_(), mask_(), types_(),
-      cursor_(), mask_cursor_(), pos_() {}
+    : data_(), mask_(), maskbits_(), bitoffset_(), types_(),
+      cursor_(), mask_cursor_(), bitcursor_(), pos_() {}
+
+  // mask, if not null, has one bool per element of the row
   row_accessor(const uint8_t *data,
                const bool *mask,
                const std::vector<runtime_type> *types)
-    : data_(data), mask_(mask), types_(types),
-      cursor_(data), mask_cursor_(mask), pos_()
+    : data_(data), mask_(mask), maskbits_(), bitoffset_(), types_(types),
+      cursor_(data), mask_cursor_(mask), bitcursor_(), pos_()
+  {
+    MICROSCOPES_ASSERT(data);
+    MICROSCOPES_ASSERT(types);
+  }
+
+  // maskbits, if not null, is a packed bitmap (see bitmap.hpp) whose bits
+  // starting at bitoffset hold the masks of the row's elements
+  row_accessor(const uint8_t *data,
+               const uint8_t *maskbits,
+               size_t bitoffset,
+               const std::vector<runtime_type> *types)
+    : data_(data), mask_(), maskbits_(maskbits), bitoffset_(bitoffset),
+      types_(types), cursor_(data), mask_cursor_(),
+      bitcursor_(bitoffset), pos_()
   {
     MICROSCOPES_ASSERT(data);
     MICROSCOPES_ASSERT(types);
@@ -36,7 +54,13 @@ public:
   inline const runtime_type & curtype() const { return (*types_)[pos_]; }
   inline unsigned curshape() const { return curtype().n(); }
 
-  inline value_accessor get() const { return value_accessor(cursor_, mask_cursor_, curtype()); }
+  inline value_accessor
+  get() const
+  {
+    if (maskbits_)
+      return value_accessor(cursor_, maskbits_, bitcursor_, curtype());
+    return value_accessor(cursor_, mask_cursor_, curtype());
+  }
 
   inline bool
   ismasked(size_t idx) const
@@ -51,6 +75,11 @@ public:
     return get().anymasked();
   }
 
+  // true if the row has no mask at all, in which case callers can skip
+  // the per-value ismasked() tests. the dataviews hand out accessors
+  // without a mask for rows which have no masked values
+  inline bool clean() const { return !mask_ && !maskbits_; }
+
   inline void
   bump()
   {
@@ -58,6 +87,7 @@ public:
     cursor_ += curtype().size();
     if (mask_)
       mask_cursor_ += curtype().n();
+    bitcursor_ += curtype().n();
     pos_++;
   }
 
@@ -68,6 +98,7 @@ public:
   {
     cursor_ = data_;
     mask_cursor_ = mask_;
+    bitcursor_ = bitoffset_;
     pos_ = 0;
   }
 
@@ -79,10 +110,13 @@ protected:
 private:
   const uint8_t *data_;
   const bool *mask_;
+  const uint8_t *maskbits_;
+  size_t bitoffset_;
   const std::vector<runtime_type> *types_;
 
   const uint8_t *cursor_;
   const bool *mask_cursor_;
+  size_t bitcursor_;
   size_t pos_;
 };
 
@@ -179,6 +213,16 @@ public:
   // non-iterator API; warning-- possibly inefficient (seeking)
   virtual row_accessor get(size_t idx) const = 0;
 
+  /**
+   * Bulk copy of the rows at iteration positions [begin, begin+n) (so
+   * respecting any permutation) into data, as n packed rows of the
+   * row_major_dataview layout. If mask is not null, the masks are copied
+   * into it in the same way. Returns true if any of the copied values are
+   * masked.
+   */
+  virtual bool copy_rows(size_t begin, size_t n,
+                         uint8_t *data, bool *mask) const = 0;
+
   inline size_t size() const { return n_; }
   inline const std::vector<runtime_type> & types() const { return types_; }
 
@@ -191,12 +235,25 @@ private:
   size_t maskrowsize_;
 };
 
+/**
+ * n packed rows (see runtime_type::GetOffsetsAndSize()), with an optional
+ * mask, given either as one bool per element, or as a packed bitmap (see
+ * bitmap.hpp) with maskrowsize() bits per row, so that row i's masks start
+ * at bit i * maskrowsize(). The latter is np.packbits() of the former.
+ *
+ * Rows without any masked values are found once, at construction, and get()
+ * returns accessors without a mask (row_accessor::clean()) for them.
+ */
 class row_major_dataview : public dataview {
 public:
   row_major_dataview(const uint8_t *data,
                      const bool *mask,
                      size_t n,
                      const std::vector<runtime_type> &types);
+  row_major_dataview(const uint8_t *data,
+                     size_t n,
+                     const std::vector<runtime_type> &types,
+                     const uint8_t *maskbits);
   row_accessor get() const override;
   size_t index() const override;
   void next() override;
@@ -205,15 +262,163 @@ public:
 
   row_accessor get(size_t idx) const override;
 
+  bool copy_rows(size_t begin, size_t n,
+                 uint8_t *data, bool *mask) const override;
+
   inline void reset_permutation() { pi_.clear(); }
   void permute(rng_t &rng);
 
+  // true if any value in the row at (actual) position idx is masked
+  inline bool
+  anymasked(size_t idx) const
+  {
+    MICROSCOPES_ASSERT(idx < size());
+    return !masked_rows_.empty() && bitmap::test(masked_rows_.data(), idx);
+  }
+
 private:
+  void init_masked_rows();
+  row_accessor accessor(size_t actual_pos) const;
+
   const uint8_t *data_;
   const bool *mask_;
+  const uint8_t *maskbits_;
   size_t pos_;
 
   std::vector<size_t> pi_;
+
+  // bitmap of the rows with any masked values; empty if there are none
+  std::vector<uint8_t> masked_rows_;
+};
+
+/**
+ * A typed, read-only view of one feature of a column_major_dataview.
+ * Entity i's value for the feature occupies elements
+ * [i*shape(), (i+1)*shape()) of data().
+ */
+template <typename T>
+class column_span {
+public:
+  column_span() : data_(), mask_(), n_(), shape_() {}
+  column_span(const T *data, const uint8_t *mask, size_t n, unsigned shape)
+    : data_(data), mask_(mask), n_(n), shape_(shape) {}
+
+  inline const T * data() const { return data_; }
+  inline const uint8_t * mask() const { return mask_; }
+
+  // # of entities
+  inline size_t size() const { return n_; }
+  inline unsigned shape() const { return shape_; }
+
+  inline const T &
+  operator[](size_t idx) const
+  {
+    MICROSCOPES_ASSERT(idx < n_);
+    return data_[idx * shape_];
+  }
+
+  inline const T &
+  at(size_t idx, unsigned elem) const
+  {
+    MICROSCOPES_ASSERT(idx < n_);
+    MICROSCOPES_ASSERT(elem < shape_);
+    return data_[idx * shape_ + elem];
+  }
+
+  inline bool
+  ismasked(size_t idx, unsigned elem=0) const
+  {
+    MICROSCOPES_ASSERT(idx < n_);
+    MICROSCOPES_ASSERT(elem < shape_);
+    return mask_ && bitmap::test(mask_, idx * shape_ + elem);
+  }
+
+  inline bool
+  anymasked() const
+  {
+    return mask_ && bitmap::any(mask_, 0, n_ * shape_);
+  }
+
+private:
+  const T *data_;
+  const uint8_t *mask_;
+  size_t n_;
+  unsigned shape_;
+};
+
+/**
+ * Stores each feature as its own contiguous column: column f holds
+ * size()*types[f].n() values of primitive type types[f].t(), and optionally
+ * a packed bitmap (see bitmap.hpp) with one bit per value, set if masked.
+ * The dataview does not own the column or mask buffers.
+ *
+ * Kernels which handle one feature at a time should use column<T>(), which
+ * avoids all runtime type dispatch. The row_accessor API is provided for
+ * compatibility: each get() gathers the row into a scratch buffer, which
+ * is only valid until the next call to get().
+ */
+class column_major_dataview : public dataview {
+public:
+  column_major_dataview(const std::vector<const uint8_t *> &columns,
+                        const std::vector<const uint8_t *> &masks,
+                        size_t n,
+                        const std::vector<runtime_type> &types);
+  row_accessor get() const override;
+  size_t index() const override;
+  void next() override;
+  void reset() override;
+  bool end() const override;
+
+  row_accessor get(size_t idx) const override;
+
+  bool copy_rows(size_t begin, size_t n,
+                 uint8_t *data, bool *mask) const override;
+
+  inline void reset_permutation() { pi_.clear(); }
+  void permute(rng_t &rng);
+
+  inline size_t nfeatures() const { return columns_.size(); }
+
+  inline const uint8_t *
+  column_data(size_t f) const
+  {
+    MICROSCOPES_ASSERT(f < nfeatures());
+    return columns_[f];
+  }
+
+  // nullptr if the column has no masked values
+  inline const uint8_t *
+  column_mask(size_t f) const
+  {
+    MICROSCOPES_ASSERT(f < nfeatures());
+    return masks_[f];
+  }
+
+  template <typename T>
+  inline column_span<T>
+  column(size_t f) const
+  {
+    MICROSCOPES_ASSERT(f < nfeatures());
+    const runtime_type &type = types()[f];
+    MICROSCOPES_DCHECK(
+        static_type_to_primitive_type<T>::value == type.t(),
+        "column type mismatch");
+    return column_span<T>(
+        reinterpret_cast<const T *>(columns_[f]), masks_[f], size(), type.n());
+  }
+
+private:
+  // returns true if any value in the row is masked
+  bool gather(size_t actual_pos, uint8_t *row, bool *rowmask) const;
+
+  std::vector<const uint8_t *> columns_;
+  std::vector<const uint8_t *> masks_;
+  size_t pos_;
+  std::vector<size_t> pi_;
+
+  // scratch space for get()
+  std::unique_ptr<uint8_t[]> row_;
+  std::unique_ptr<bool[]> rowmask_;
 };
 
 } // namespace recarray
@@ -4,10 +4,12 @@
 #include <microscopes/common/runtime_value.hpp>
 #include <microscopes/common/macros.hpp>
 #include <microscopes/common/util.hpp>
+#include <microscopes/common/bitmap.hpp>
 
 #include <algorithm>
 #include <iterator>
 #include <memory>
+#include <limits>
 
 namespace microscopes {
 namespace common {
@@ -32,6 +34,7 @@ public:
   // XXX(stephentu): this interface sucks
   //   (A) causes implementations to be needlessly inefficient, and
   //   (B) it feels too java like
+  // performance sensitive callers should use slice_into() instead
   class slice_iterator_impl {
   public:
     virtual ~slice_iterator_impl() {}
@@ -131,6 +134,73 @@ public:
     slice_iterator end_;
   };
 
+  /**
+   * A batch of the (non-masked) entries of one slice, filled by
+   * slice_into(). Entry k is at position(k), a pointer to dims() indices,
+   * and has value(k).
+   *
+   * Values are not copied: raw_value(k) points into the dataview's own
+   * storage. The buffer's storage is reused across calls to slice_into(),
+   * so after warming up a sweep over slices does no allocation.
+   */
+  class slice_buffer {
+  public:
+    slice_buffer() : dims_(), type_(), positions_(), values_() {}
+
+    inline size_t size() const { return values_.size(); }
+    inline bool empty() const { return values_.empty(); }
+    inline size_t dims() const { return dims_; }
+    inline const runtime_type & type() const { return type_; }
+
+    inline const size_t *
+    position(size_t k) const
+    {
+      MICROSCOPES_ASSERT(k < size());
+      return &positions_[k * dims_];
+    }
+
+    inline const uint8_t *
+    raw_value(size_t k) const
+    {
+      MICROSCOPES_ASSERT(k < size());
+      return values_[k];
+    }
+
+    inline value_accessor
+    value(size_t k) const
+    {
+      return value_accessor(raw_value(k), nullptr, type_);
+    }
+
+    // for dataview implementations
+
+    inline void
+    reset(size_t dims, const runtime_type &type, size_t nhint=0)
+    {
+      dims_ = dims;
+      type_ = type;
+      positions_.clear();
+      values_.clear();
+      positions_.reserve(nhint * dims);
+      values_.reserve(nhint);
+    }
+
+    // returns the dims() indices to fill in for the new entry
+    inline size_t *
+    push_back(const uint8_t *value)
+    {
+      values_.push_back(value);
+      positions_.resize(positions_.size() + dims_);
+      return &positions_[positions_.size() - dims_];
+    }
+
+  private:
+    size_t dims_;
+    runtime_type type_;
+    std::vector<size_t> positions_;
+    std::vector<const uint8_t *> values_;
+  };
+
   dataview(const std::vector<size_t> &shape, const runtime_type &type)
     : shape_(shape), type_(type)
   {
@@ -153,6 +223,33 @@ public:
   virtual value_accessor get(const std::vector<size_t> &indices) const = 0;
   virtual slice_iterable slice(size_t dim, size_t idx) const = 0;
 
+  /**
+   * Fills buf with the same entries, in the same order, as slice(dim, idx)
+   * yields. The default implementation walks slice(); implementations
+   * should override it to avoid the per-element virtual calls.
+   */
+  virtual void
+  slice_into(size_t dim, size_t idx, slice_buffer &buf) const
+  {
+    buf.reset(dims(), type());
+    for (const auto &p : slice(dim, idx)) {
+      // accessors from slice() always point into the dataview's storage
+      size_t *pos = buf.push_back(p.second.data());
+      std::copy(p.first.begin(), p.first.end(), pos);
+    }
+  }
+
+  /**
+   * False only if no entry of slice (dim, idx) is masked (missing), ie
+   * slice(dim, idx) yields every position of the slice. The default is the
+   * conservative answer.
+   */
+  virtual bool
+  slice_anymasked(size_t dim, size_t idx) const
+  {
+    return true;
+  }
+
 protected:
   std::vector<size_t> shape_;
   runtime_type type_;
@@ -261,6 +358,12 @@ private:
 /**
  * This implementation is used when a dense numpy.ndarray is used to represent
  * the data.
+ *
+ * The optional mask is given either as one bool per entry, or as a packed
+ * bitmap (see bitmap.hpp) with type().n() bits per entry in row-major order,
+ * which is np.packbits() of the former. The slices with masked entries are
+ * found once, at construction, so that slicing a slice without any can skip
+ * the per-entry mask tests (see slice_anymasked()).
  */
 class row_major_dense_dataview : public dataview {
 public:
@@ -269,18 +372,19 @@ public:
                            const std::vector<size_t> &shape,
                            const runtime_type &type)
     : dataview(shape, type), data_(data), dataend_(),
-      mask_(mask), stepsize_(type.size())
+      mask_(mask), maskbits_(), stepsize_(type.size())
   {
-    MICROSCOPES_DCHECK(data, "data cannot be null");
-    multipliers_.push_back(1);
-    auto rit = shape.rbegin();
-    for (size_t i = 0; i < shape.size() - 1; ++i, ++rit)
-      multipliers_.push_back(multipliers_.back() * (*rit));
-    std::reverse(multipliers_.begin(), multipliers_.end());
-    size_t nelems = 1;
-    for (auto s : shape)
-      nelems *= s;
-    dataend_ = data + nelems * stepsize_;
+    init();
+  }
+
+  row_major_dense_dataview(const uint8_t *data,
+                           const std::vector<size_t> &shape,
+                           const runtime_type &type,
+                           const uint8_t *maskbits)
+    : dataview(shape, type), data_(data), dataend_(),
+      mask_(), maskbits_(maskbits), stepsize_(type.size())
+  {
+    init();
   }
 
   value_accessor
@@ -289,18 +393,19 @@ public:
     MICROSCOPES_DCHECK(dims() == indices.size(), "invalid # of indices");
     for (size_t i = 0; i < dims(); i++)
       MICROSCOPES_DCHECK(indices[i] < shape_[i], "index out of bounds");
-    return accessor(indices);
+    return accessor(indices, masked_slices_.empty());
   }
 
   class slice_iterator_impl : public dataview::slice_iterator_impl {
     friend class row_major_dense_dataview;
   protected:
     slice_iterator_impl(const row_major_dense_dataview *px,
-                        const detail::product &iter)
-      : px_(px), iter_(iter)
+                        const detail::product &iter,
+                        bool clean)
+      : px_(px), iter_(iter), clean_(clean)
     {
       for (;;) {
-        if (iter_.end() || !px->accessor(iter_.value()).anymasked())
+        if (iter_.end() || clean_ || !px->masked(iter_.value()))
           break;
         iter_.next();
       }
@@ -328,7 +433,7 @@ public:
     {
       for (;;) {
         iter_.next();
-        if (iter_.end() || !px_->accessor(iter_.value()).anymasked())
+        if (iter_.end() || clean_ || !px_->masked(iter_.value()))
           break;
       }
     }
@@ -340,13 +445,15 @@ public:
       const_cast<slice_iterator_impl *>(this)->storage_.first =
         iter_.value();
       const_cast<slice_iterator_impl *>(this)->storage_.second =
-        px_->accessor(iter_.value());
+        px_->accessor(iter_.value(), clean_);
       return storage_;
     }
 
   private:
     const row_major_dense_dataview *px_;
     detail::product iter_;
+    // the slice has no masked entries
+    bool clean_;
     value_with_position_t storage_;
   };
 
@@ -366,25 +473,135 @@ public:
     detail::product begin_iter(is), end_iter(is);
     end_iter.setEnd();
 
+    const bool clean = !slice_anymasked(dim, idx);
     std::unique_ptr<dataview::slice_iterator_impl> begin(
         new slice_iterator_impl(
-          this, begin_iter));
+          this, begin_iter, clean));
 
     std::unique_ptr<dataview::slice_iterator_impl> end(
         new slice_iterator_impl(
-          this, end_iter));
+          this, end_iter, clean));
 
     return slice_iterable(std::move(begin), std::move(end));
   }
 
+  void
+  slice_into(size_t dim, size_t idx, slice_buffer &buf) const override
+  {
+    MICROSCOPES_DCHECK(dim < dims(), "invalid dimension");
+    MICROSCOPES_DCHECK(idx < shape_[dim], "invalid index");
+    size_t n = 1;
+    for (size_t i = 0; i < dims(); i++)
+      if (i != dim)
+        n *= shape_[i];
+    const bool check = slice_anymasked(dim, idx);
+    buf.reset(dims(), type(), check ? 0 : n);
+
+    // odometer over the non-fixed dimensions, in the same (row-major) order
+    // as detail::product
+    std::vector<size_t> cur(dims(), 0);
+    cur[dim] = idx;
+    size_t off = idx * multipliers_[dim];
+    for (size_t k = 0; k < n; k++) {
+      if (!check || !masked(off))
+        std::copy(cur.begin(), cur.end(), buf.push_back(data_ + stepsize_ * off));
+      for (ssize_t i = dims() - 1; i >= 0; i--) {
+        if (size_t(i) == dim)
+          continue;
+        if (++cur[i] < shape_[i]) {
+          off += multipliers_[i];
+          break;
+        }
+        off -= (shape_[i] - 1) * multipliers_[i];
+        cur[i] = 0;
+      }
+    }
+  }
+
+  bool
+  slice_anymasked(size_t dim, size_t idx) const override
+  {
+    MICROSCOPES_DCHECK(dim < dims(), "invalid dimension");
+    MICROSCOPES_DCHECK(idx < shape_[dim], "invalid index");
+    return !masked_slices_.empty() &&
+      bitmap::test(masked_slices_[dim].data(), idx);
+  }
+
 private:
 
+  void
+  init()
+  {
+    MICROSCOPES_DCHECK(data_, "data cannot be null");
+    multipliers_.push_back(1);
+    auto rit = shape_.rbegin();
+    for (size_t i = 0; i < shape_.size() - 1; ++i, ++rit)
+      multipliers_.push_back(multipliers_.back() * (*rit));
+    std::reverse(multipliers_.begin(), multipliers_.end());
+    size_t nelems = 1;
+    for (auto s : shape_)
+      nelems *= s;
+    dataend_ = data_ + nelems * stepsize_;
+
+    if (!mask_ && !maskbits_)
+      return;
+    std::vector<std::vector<uint8_t>> masked_slices(dims());
+    for (size_t i = 0; i < dims(); i++)
+      masked_slices[i].resize(bitmap::nbytes(shape_[i]));
+    bool any = false;
+    const auto mark = [&](size_t off) {
+      any = true;
+      for (size_t i = 0; i < dims(); i++)
+        bitmap::set(masked_slices[i].data(),
+                    (off / multipliers_[i]) % shape_[i]);
+    };
+    if (mask_) {
+      for (size_t off = 0; off < nelems; off++)
+        if (masked(off))
+          mark(off);
+    } else {
+      // mostly-observed data is mostly zero words, which we skip
+      const size_t n = type().n(), nbits = nelems * n;
+      for (size_t bit = 0; bit < nbits; bit += 64) {
+        const size_t end = std::min(bit + 64, nbits);
+        if (!bitmap::any(maskbits_, bit, end))
+          continue;
+        for (size_t b = bit; b < end; b++)
+          if (bitmap::test(maskbits_, b))
+            mark(b / n);
+      }
+    }
+    if (any)
+      masked_slices_.swap(masked_slices);
+  }
+
+  // is the entry at (flat) offset off masked
+  inline bool
+  masked(size_t off) const
+  {
+    if (maskbits_)
+      return bitmap::any(
+          maskbits_, off * type().n(), (off + 1) * type().n());
+    return mask_ && value_accessor(nullptr, mask_ + off, type()).anymasked();
+  }
+
+  inline bool
+  masked(const std::vector<size_t> &indices) const
+  {
+    return masked(offset(indices));
+  }
+
+  // clean: the caller knows the entry is not masked
   inline value_accessor
-  accessor(const std::vector<size_t> &indices) const
+  accessor(const std::vector<size_t> &indices, bool clean) const
   {
     const size_t off = offset(indices);
     const uint8_t *px = data_ + stepsize_ * off;
     MICROSCOPES_ASSERT(px < dataend_);
+    if (clean)
+      return value_accessor(px, nullptr, type());
+    if (maskbits_)
+      return value_accessor(px, maskbits_, off * type().n(), type());
     return value_accessor(
         px, mask_ ? (mask_ + off) : nullptr, type());
   }
@@ -402,61 +619,176 @@ private:
   const uint8_t *data_;
   const uint8_t *dataend_;
   const bool *mask_;
+  const uint8_t *maskbits_;
   size_t stepsize_;
   std::vector<size_t> multipliers_;
+
+  // per dimension, a bitmap of the slices with any masked entries; empty if
+  // nothing is masked
+  std::vector<std::vector<uint8_t>> masked_slices_;
 };
 
+/**
+ * Builds the column-major (CSC) index of a CSR matrix, as a permutation
+ * over the CSR entries rather than a copy of the values. On return, the
+ * entries of column j are the CSR entries csc_perm[csc_indptr[j] :
+ * csc_indptr[j+1]], in increasing row order, and csc_indices holds their
+ * rows. The outputs are caller-owned buffers of nnz, cols+1 and nnz
+ * elements respectively.
+ */
+template <typename Index>
+static inline void
+build_csc_index(size_t rows,
+                size_t cols,
+                const Index *csr_indices,
+                const Index *csr_indptr,
+                Index *csc_indices,
+                Index *csc_indptr,
+                Index *csc_perm)
+{
+  const size_t nnz = csr_indptr[rows];
+  std::fill(csc_indptr, csc_indptr + cols + 1, Index(0));
+  for (size_t k = 0; k < nnz; k++) {
+    MICROSCOPES_ASSERT(csr_indices[k] < cols);
+    csc_indptr[csr_indices[k] + 1]++;
+  }
+  for (size_t j = 0; j < cols; j++)
+    csc_indptr[j + 1] += csc_indptr[j];
+  // the running insertion point of each column
+  std::vector<Index> cursor(csc_indptr, csc_indptr + cols);
+  for (size_t i = 0; i < rows; i++) {
+    for (Index k = csr_indptr[i]; k < csr_indptr[i + 1]; k++) {
+      const Index pos = cursor[csr_indices[k]]++;
+      csc_indices[pos] = i;
+      csc_perm[pos] = k;
+    }
+  }
+}
+
 /**
  * both scipy.sparse.csc_matrix and scipy.sparse.csr_matrix are represented
- * with this implementation
+ * with this implementation, for 32-bit (compressed_2darray) or 64-bit
+ * (compressed_2darray_t<uint64_t>) indices
  *
- * the storage cost is 2X the storage cost for an individual cs{c,r}_matrix,
- * but a slice operation is exactly linear in the number of non-zero entries
- * along the slice (row/col in the 2D case)
+ * the CSR arrays are the primary representation. the CSC side is either a
+ * second full copy (csc_data), or, preferably, just an index permuting the
+ * CSR values (see build_csc_index()), which avoids storing the values twice.
+ * either way, a slice operation is exactly linear in the number of non-zero
+ * entries along the slice (row/col in the 2D case)
  *
  * we trade off this space for time; otherwise, a slice along the non-dominant
  * dimension would be linear in the number of **total** non-zero entries
  *
- * XXX(stephentu): Implementation limitation:
- * Note that currently, the zero (sparse) elements are treated as **missing**
- * data, rather than 0-valued data. that is, the data is equivalent to the
- * dense represetation **plus** masking all the zero (sparse) entries.
+ * the stored entries are the observed data, and positions with no stored
+ * entry are treated as **missing** data, rather than 0-valued data. (an
+ * explicitly stored zero is an observation.) get() of a missing position
+ * returns a masked accessor. get() assumes the indices within each CSR row
+ * are sorted.
  */
-class compressed_2darray : public dataview {
+template <typename Index>
+class compressed_2darray_t : public dataview {
 public:
 
   // we assume the inputs are consistent with each other
   // without making any effort to validate
-  compressed_2darray(const uint8_t *csr_data,
-                     const uint32_t *csr_indices,
-                     const uint32_t *csr_indptr,
-                     const uint8_t *csc_data,
-                     const uint32_t *csc_indices,
-                     const uint32_t *csc_indptr,
-                     size_t rows,
-                     size_t cols,
-                     const runtime_type &type)
+  compressed_2darray_t(const uint8_t *csr_data,
+                       const Index *csr_indices,
+                       const Index *csr_indptr,
+                       const uint8_t *csc_data,
+                       const Index *csc_indices,
+                       const Index *csc_indptr,
+                       size_t rows,
+                       size_t cols,
+                       const runtime_type &type)
     : dataview({rows, cols}, type),
       csr_data_(csr_data),
       csr_indices_(csr_indices),
       csr_indptr_(csr_indptr),
       csc_data_(csc_data),
       csc_indices_(csc_indices),
-      csc_indptr_(csc_indptr)
+      csc_indptr_(csc_indptr),
+      csc_perm_(nullptr),
+      masked_(new bool[type.n()])
+  {
+    std::fill(masked_.get(), masked_.get() + type.n(), true);
+  }
+
+  // CSC side as a permutation over the CSR values
+  compressed_2darray_t(const uint8_t *csr_data,
+                       const Index *csr_indices,
+                       const Index *csr_indptr,
+                       const Index *csc_indices,
+                       const Index *csc_indptr,
+                       const Index *csc_perm,
+                       size_t rows,
+                       size_t cols,
+                       const runtime_type &type)
+    : dataview({rows, cols}, type),
+      csr_data_(csr_data),
+      csr_indices_(csr_indices),
+      csr_indptr_(csr_indptr),
+      csc_data_(nullptr),
+      csc_indices_(csc_indices),
+      csc_indptr_(csc_indptr),
+      csc_perm_(csc_perm),
+      masked_(new bool[type.n()])
+  {
+    MICROSCOPES_DCHECK(csc_perm, "csc_perm cannot be null");
+    std::fill(masked_.get(), masked_.get() + type.n(), true);
+  }
+
+  /**
+   * The stored entries of row idx (dim=0) or column idx (dim=1): entry k
+   * has column (resp. row) indices_[k] and its value at value(k)
+   */
+  struct span {
+    const Index *indices_;
+    const uint8_t *data_;
+    // non-null when the values are reached through a permutation
+    const Index *perm_;
+    size_t size_;
+    size_t stride_;
+
+    inline const uint8_t *
+    value(size_t k) const
+    {
+      MICROSCOPES_ASSERT(k < size_);
+      return data_ + stride_ * (perm_ ? size_t(perm_[k]) : k);
+    }
+  };
+
+  inline span
+  slice_span(size_t dim, size_t idx) const
   {
+    MICROSCOPES_DCHECK(dim < dims(), "invalid dimension");
+    MICROSCOPES_DCHECK(idx < shape_[dim], "invalid index");
+    const size_t sz = type().size();
+    if (dim == 0) {
+      const Index begin = csr_indptr_[idx];
+      return span{csr_indices_ + begin, csr_data_ + sz * begin, nullptr,
+                  size_t(csr_indptr_[idx + 1] - begin), sz};
+    }
+    const Index begin = csc_indptr_[idx];
+    const size_t n = csc_indptr_[idx + 1] - begin;
+    if (csc_perm_)
+      return span{csc_indices_ + begin, csr_data_, csc_perm_ + begin, n, sz};
+    return span{csc_indices_ + begin, csc_data_ + sz * begin, nullptr, n, sz};
   }
 
+  inline span row(size_t i) const { return slice_span(0, i); }
+  inline span col(size_t j) const { return slice_span(1, j); }
+
   template <bool IsRowFixed>
   class slice_iterator_impl : public dataview::slice_iterator_impl {
-    friend class compressed_2darray;
+    friend class compressed_2darray_t;
   protected:
-    slice_iterator_impl(unsigned fixed_idx,
-                        const uint32_t *indices,
-                        const uint8_t *data,
+    slice_iterator_impl(size_t fixed_idx,
+                        const span &sp,
+                        size_t pos,
                         const runtime_type *type)
       : fixed_idx_(fixed_idx),
-        indices_(indices),
-        data_(data),
+        span_(sp),
+        pos_(pos),
         type_(type)
     {
     }
@@ -476,14 +808,13 @@ public:
     {
       const auto &o =
         static_cast<const slice_iterator_impl<IsRowFixed> &>(that);
-      return indices_ == o.indices_;
+      return pos_ == o.pos_;
     }
 
     void
     next() override
     {
-      indices_++;
-      data_ += type_->size();
+      pos_++;
     }
 
     const value_with_position_t &
@@ -501,17 +832,17 @@ public:
       storage_.first.resize(2);
       if (IsRowFixed) {
         storage_.first[0] = fixed_idx_;
-        storage_.first[1] = *indices_;
+        storage_.first[1] = span_.indices_[pos_];
       } else {
-        storage_.first[0] = *indices_;
+        storage_.first[0] = span_.indices_[pos_];
         storage_.first[1] = fixed_idx_;
       }
-      storage_.second = value_accessor(data_, nullptr, *type_);
+      storage_.second = value_accessor(span_.value(pos_), nullptr, *type_);
     }
 
-    unsigned fixed_idx_;
-    const uint32_t *indices_;
-    const uint8_t *data_;
+    size_t fixed_idx_;
+    span span_;
+    size_t pos_;
     const runtime_type *type_;
     value_with_position_t storage_;
   };
@@ -520,66 +851,308 @@ public:
   get(const std::vector<size_t> &indices) const override
   {
     MICROSCOPES_DCHECK(indices.size() == 2, "bad size given");
-    // XXX(stephentu): don't be lazy
-    MICROSCOPES_UNIMPLEMENTED();
-  }
-
-  template <bool IsRowFixed>
-  inline std::unique_ptr<dataview::slice_iterator_impl>
-  construct(size_t idx,
-            const uint32_t *indices,
-            const uint8_t *data) const
-  {
-    std::unique_ptr<dataview::slice_iterator_impl> ptr(
-        new slice_iterator_impl<IsRowFixed>(
-          idx, indices, data, &type()));
-    return std::move(ptr);
+    MICROSCOPES_DCHECK(indices[0] < rows(), "row out of bounds");
+    MICROSCOPES_DCHECK(indices[1] < cols(), "col out of bounds");
+    const span sp = row(indices[0]);
+    const Index *end = sp.indices_ + sp.size_;
+    const Index *it = std::lower_bound(sp.indices_, end, Index(indices[1]));
+    if (it == end || *it != indices[1])
+      return value_accessor(csr_data_, masked_.get(), type());
+    return value_accessor(sp.value(it - sp.indices_), nullptr, type());
   }
 
   slice_iterable
   slice(size_t dim, size_t idx) const override
   {
-    //std::cout << "slice(" << dim << ", " << idx << ")" << std::endl;
-    MICROSCOPES_DCHECK(dim < dims(), "invalid dimension");
-    MICROSCOPES_DCHECK(idx < shape_[dim], "invalid index");
-
-    const bool row_fixed = (dim == 0);
-    const uint32_t *indptr = row_fixed ? csr_indptr_ : csc_indptr_;
-    const uint32_t *indices = row_fixed ? csr_indices_ : csc_indices_;
-    const uint8_t *data = row_fixed ? csr_data_ : csc_data_;
-    const size_t sz = type().size();
-
-    const uint32_t *begin_indices = &indices[indptr[idx]];
-    const uint32_t *end_indices = &indices[indptr[idx+1]];
-    const uint8_t *begin_data = &data[sz*indptr[idx]];
-    const uint8_t *end_data = &data[sz*indptr[idx+1]];
-
-    if (row_fixed) {
-      auto begin = construct<true>(idx, begin_indices, begin_data);
-      auto end = construct<true>(idx, end_indices, end_data);
+    const span sp = slice_span(dim, idx);
+    if (dim == 0) {
+      std::unique_ptr<dataview::slice_iterator_impl> begin(
+          new slice_iterator_impl<true>(idx, sp, 0, &type()));
+      std::unique_ptr<dataview::slice_iterator_impl> end(
+          new slice_iterator_impl<true>(idx, sp, sp.size_, &type()));
       return slice_iterable(std::move(begin), std::move(end));
     } else {
-      auto begin = construct<false>(idx, begin_indices, begin_data);
-      auto end = construct<false>(idx, end_indices, end_data);
+      std::unique_ptr<dataview::slice_iterator_impl> begin(
+          new slice_iterator_impl<false>(idx, sp, 0, &type()));
+      std::unique_ptr<dataview::slice_iterator_impl> end(
+          new slice_iterator_impl<false>(idx, sp, sp.size_, &type()));
       return slice_iterable(std::move(begin), std::move(end));
     }
   }
 
+  void
+  slice_into(size_t dim, size_t idx, slice_buffer &buf) const override
+  {
+    const span sp = slice_span(dim, idx);
+    buf.reset(2, type(), sp.size_);
+    for (size_t k = 0; k < sp.size_; k++) {
+      size_t *pos = buf.push_back(sp.value(k));
+      pos[dim] = idx;
+      pos[1 - dim] = sp.indices_[k];
+    }
+  }
+
   inline size_t rows() const { return shape()[0]; }
   inline size_t cols() const { return shape()[1]; }
+  inline size_t nnz() const { return csr_indptr_[rows()]; }
 
 private:
   const uint8_t *csr_data_;
-  const uint32_t *csr_indices_;
-  const uint32_t *csr_indptr_;
+  const Index *csr_indices_;
+  const Index *csr_indptr_;
   const uint8_t *csc_data_;
-  const uint32_t *csc_indices_;
-  const uint32_t *csc_indptr_;
+  const Index *csc_indices_;
+  const Index *csc_indptr_;
+  const Index *csc_perm_;
+
+  std::unique_ptr<bool[]> masked_;
 };
 
-// XXX(stephentu): we need a good implementation for sparse n-ary relations
-// (when n > 2). we'll most likely use something like an (indices, data)
-// representation
+typedef compressed_2darray_t<uint32_t> compressed_2darray;
+
+/**
+ * The number of elements of the indptr buffer for build_sparse_nd_index(),
+ * sum_d (shape[d] + 1)
+ */
+static inline size_t
+sparse_nd_indptr_size(const std::vector<size_t> &shape)
+{
+  size_t n = 0;
+  for (auto s : shape)
+    n += s + 1;
+  return n;
+}
+
+/**
+ * Builds, with a counting sort, the per dimension index of a sparse_ndarray
+ * over nnz entries at the given (entry-major) positions. For each dimension
+ * d, the entries with coordinate i along d are
+ *
+ *   order[d*nnz + indptr_d[i] : d*nnz + indptr_d[i+1]]
+ *
+ * in input order, where indptr_d starts at element sum_{e<d} (shape[e] + 1)
+ * of indptr. The outputs are caller-owned buffers of dims*nnz and
+ * sparse_nd_indptr_size(shape) elements respectively.
+ */
+static inline void
+build_sparse_nd_index(const uint32_t *indices,
+                      size_t nnz,
+                      const std::vector<size_t> &shape,
+                      uint32_t *order,
+                      uint32_t *indptr)
+{
+  MICROSCOPES_DCHECK(
+      nnz <= std::numeric_limits<uint32_t>::max(), "too many entries");
+  const size_t d = shape.size();
+  for (size_t dim = 0; dim < d; dim++) {
+    std::fill(indptr, indptr + shape[dim] + 1, uint32_t(0));
+    for (size_t k = 0; k < nnz; k++) {
+      MICROSCOPES_ASSERT(indices[k * d + dim] < shape[dim]);
+      indptr[indices[k * d + dim] + 1]++;
+    }
+    for (size_t i = 0; i < shape[dim]; i++)
+      indptr[i + 1] += indptr[i];
+    // the running insertion point of each coordinate
+    std::vector<uint32_t> cursor(indptr, indptr + shape[dim]);
+    for (size_t k = 0; k < nnz; k++)
+      order[cursor[indices[k * d + dim]]++] = k;
+    order += nnz;
+    indptr += shape[dim] + 1;
+  }
+}
+
+/**
+ * A sparse n-dimensional relation in coordinate (COO) format: entry k has
+ * position indices[k*dims() : (k+1)*dims()] and value data + k*type().size().
+ * As with compressed_2darray, positions without an entry are missing data.
+ *
+ * For each dimension d there is an index of the entries ordered by their
+ * d-th coordinate (see build_sparse_nd_index()), so slice(d, idx) is linear
+ * in the number of entries in the slice. Within a slice, entries keep their
+ * input order. This costs dims() * (nnz + shape[d]) extra words.
+ *
+ * The dataview does not own the indices, data, or a given index. Positions
+ * are assumed to be in bounds and unique.
+ */
+class sparse_ndarray : public dataview {
+public:
+  // builds (and owns) the index
+  sparse_ndarray(const uint8_t *data,
+                 const uint32_t *indices,
+                 size_t nnz,
+                 const std::vector<size_t> &shape,
+                 const runtime_type &type)
+    : sparse_ndarray(data, indices, nnz, nullptr, nullptr, shape, type)
+  {
+    owned_order_.resize(dims() * nnz);
+    owned_indptr_.resize(sparse_nd_indptr_size(shape));
+    build_sparse_nd_index(
+        indices, nnz, shape, owned_order_.data(), owned_indptr_.data());
+    set_index(owned_order_.data(), owned_indptr_.data());
+  }
+
+  // uses an index previously built by build_sparse_nd_index(), as is
+  sparse_ndarray(const uint8_t *data,
+                 const uint32_t *indices,
+                 size_t nnz,
+                 const uint32_t *order,
+                 const uint32_t *indptr,
+                 const std::vector<size_t> &shape,
+                 const runtime_type &type)
+    : dataview(shape, type),
+      data_(data),
+      indices_(indices),
+      nnz_(nnz),
+      order_(shape.size()),
+      indptr_(shape.size()),
+      masked_(new bool[type.n()])
+  {
+    MICROSCOPES_DCHECK(
+        nnz <= std::numeric_limits<uint32_t>::max(), "too many entries");
+    std::fill(masked_.get(), masked_.get() + type.n(), true);
+    if (order)
+      set_index(order, indptr);
+  }
+
+  class slice_iterator_impl : public dataview::slice_iterator_impl {
+    friend class sparse_ndarray;
+  protected:
+    slice_iterator_impl(const sparse_ndarray *px, const uint32_t *order)
+      : px_(px), order_(order) {}
+
+  public:
+    std::unique_ptr<dataview::slice_iterator_impl>
+    clone() const override
+    {
+      return std::unique_ptr<slice_iterator_impl>(
+          new slice_iterator_impl(*this));
+    }
+
+    // false positives possible if not same view or not same slice
+    bool
+    equals(const dataview::slice_iterator_impl &that) const override
+    {
+      const auto &o = static_cast<const slice_iterator_impl &>(that);
+      return order_ == o.order_;
+    }
+
+    void
+    next() override
+    {
+      order_++;
+    }
+
+    const value_with_position_t &
+    value() const override
+    {
+      // XXX: const_cast so we can mutate the storage
+      auto &storage = const_cast<slice_iterator_impl *>(this)->storage_;
+      const uint32_t *pos = px_->position(*order_);
+      storage.first.assign(pos, pos + px_->dims());
+      storage.second = px_->value(*order_);
+      return storage_;
+    }
+
+  private:
+    const sparse_ndarray *px_;
+    const uint32_t *order_;
+    value_with_position_t storage_;
+  };
+
+  // missing positions come back fully masked
+  value_accessor
+  get(const std::vector<size_t> &indices) const override
+  {
+    MICROSCOPES_DCHECK(dims() == indices.size(), "invalid # of indices");
+    for (size_t i = 0; i < dims(); i++)
+      MICROSCOPES_DCHECK(indices[i] < shape_[i], "index out of bounds");
+    const uint32_t *indptr = indptr_[0];
+    const uint32_t *order = order_[0];
+    for (size_t i = indptr[indices[0]]; i < indptr[indices[0] + 1]; i++) {
+      const uint32_t *pos = position(order[i]);
+      if (std::equal(indices.begin(), indices.end(), pos))
+        return value(order[i]);
+    }
+    return value_accessor(data_, masked_.get(), type());
+  }
+
+  slice_iterable
+  slice(size_t dim, size_t idx) const override
+  {
+    MICROSCOPES_DCHECK(dim < dims(), "invalid dimension");
+    MICROSCOPES_DCHECK(idx < shape_[dim], "invalid index");
+    const uint32_t *order = order_[dim];
+    const uint32_t *indptr = indptr_[dim];
+    std::unique_ptr<dataview::slice_iterator_impl> begin(
+        new slice_iterator_impl(this, order + indptr[idx]));
+    std::unique_ptr<dataview::slice_iterator_impl> end(
+        new slice_iterator_impl(this, order + indptr[idx + 1]));
+    return slice_iterable(std::move(begin), std::move(end));
+  }
+
+  void
+  slice_into(size_t dim, size_t idx, slice_buffer &buf) const override
+  {
+    MICROSCOPES_DCHECK(dim < dims(), "invalid dimension");
+    MICROSCOPES_DCHECK(idx < shape_[dim], "invalid index");
+    const uint32_t *order = order_[dim];
+    const uint32_t *indptr = indptr_[dim];
+    buf.reset(dims(), type(), indptr[idx + 1] - indptr[idx]);
+    for (size_t i = indptr[idx]; i < indptr[idx + 1]; i++) {
+      const uint32_t *pos = position(order[i]);
+      std::copy(pos, pos + dims(), buf.push_back(raw_value(order[i])));
+    }
+  }
+
+  inline size_t nnz() const { return nnz_; }
+
+  inline const uint32_t *
+  position(size_t k) const
+  {
+    MICROSCOPES_ASSERT(k < nnz_);
+    return indices_ + k * dims();
+  }
+
+  inline const uint8_t *
+  raw_value(size_t k) const
+  {
+    MICROSCOPES_ASSERT(k < nnz_);
+    return data_ + k * type().size();
+  }
+
+  inline value_accessor
+  value(size_t k) const
+  {
+    return value_accessor(raw_value(k), nullptr, type());
+  }
+
+private:
+  void
+  set_index(const uint32_t *order, const uint32_t *indptr)
+  {
+    for (size_t dim = 0; dim < dims(); dim++) {
+      order_[dim] = order;
+      indptr_[dim] = indptr;
+      order += nnz_;
+      indptr += shape_[dim] + 1;
+    }
+  }
+
+  const uint8_t *data_;
+  const uint32_t *indices_;
+  size_t nnz_;
+
+  // for each dimension, the entries ordered by their coordinate along that
+  // dimension, in CSR style (order[indptr[i]:indptr[i+1]] have coordinate i)
+  std::vector<const uint32_t *> order_;
+  std::vector<const uint32_t *> indptr_;
+
+  // the index, if built by the constructor
+  std::vector<uint32_t> owned_order_;
+  std::vector<uint32_t> owned_indptr_;
+
+  std::unique_ptr<bool[]> masked_;
+};
 
 } // namespace relation
 } // namespace common
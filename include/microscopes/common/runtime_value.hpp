@@ -2,45 +2,62 @@
 
 #include <microscopes/common/runtime_type.hpp>
 #include <microscopes/common/assert.hpp>
+#include <microscopes/common/bitmap.hpp>
+
+#include <algorithm>
 
 namespace microscopes {
 namespace common {
 
 class value_accessor {
 public:
-  value_accessor() : data_(), mask_(), type_() {}
+  value_accessor() : data_(), mask_(), maskbits_(), bitoffset_(), type_() {}
 
   template <typename T>
   value_accessor(const T *data)
     : data_(reinterpret_cast<const uint8_t *>(data)),
       mask_(nullptr),
+      maskbits_(nullptr),
+      bitoffset_(),
       type_(runtime_type(static_type_to_primitive_type<T>::value)) {}
 
+  // mask, if not null, has one bool per element
   value_accessor(const uint8_t *data,
                  const bool *mask,
                  const runtime_type &type)
-    : data_(data), mask_(mask), type_(type) {}
+    : data_(data), mask_(mask), maskbits_(nullptr), bitoffset_(),
+      type_(type) {}
+
+  // maskbits, if not null, is a packed bitmap (see bitmap.hpp) holding the
+  // element masks at bits [bitoffset, bitoffset + type.n())
+  value_accessor(const uint8_t *data,
+                 const uint8_t *maskbits,
+                 size_t bitoffset,
+                 const runtime_type &type)
+    : data_(data), mask_(nullptr), maskbits_(maskbits),
+      bitoffset_(bitoffset), type_(type) {}
 
   inline const runtime_type & type() const { return type_; }
   inline unsigned shape() const { return type_.n(); }
+  inline const uint8_t * data() const { return data_; }
 
   inline bool
   ismasked(size_t idx) const
   {
     MICROSCOPES_ASSERT(idx < shape());
+    if (maskbits_)
+      return bitmap::test(maskbits_, bitoffset_ + idx);
     return !mask_ ? false : mask_[idx];
   }
 
   inline bool
   anymasked() const
   {
+    if (maskbits_)
+      return bitmap::any(maskbits_, bitoffset_, bitoffset_ + shape());
     if (!mask_)
       return false;
-    // XXX: more efficient ways to do this!
-    for (size_t i = 0; i < shape(); i++)
-      if (ismasked(i))
-        return true;
-    return false;
+    return std::find(mask_, mask_ + shape(), true) != mask_ + shape();
   }
 
   template <typename T>
@@ -58,6 +75,8 @@ public:
 private:
   const uint8_t *data_;
   const bool *mask_;
+  const uint8_t *maskbits_;
+  size_t bitoffset_;
   runtime_type type_;
 };
 
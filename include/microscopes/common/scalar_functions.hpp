@@ -4,6 +4,8 @@
 #include <distributions/special.hpp> // for M_PIf and fast_log()
 #include <limits>
 #include <cmath>
+#include <algorithm>
+#include <functional>
 #include <vector>
 
 namespace microscopes {
@@ -11,10 +13,18 @@ namespace common {
 
 class scalar_fn {
 public:
-  scalar_fn() : fn_(), input_dim_() {}
-  scalar_fn(std::function<float(const std::vector<float> &)> fn,
-            size_t input_dim)
-    : fn_(fn), input_dim_(input_dim)
+  typedef std::function<float(const std::vector<float> &)> fn_t;
+
+  // evaluates the function at each of n points, read row-major from
+  // points (n x input_dim()), into out[0, n)
+  typedef std::function<void(const float *, size_t, float *)> batch_fn_t;
+
+  scalar_fn() : fn_(), batch_fn_(), input_dim_() {}
+  scalar_fn(fn_t fn, size_t input_dim)
+    : fn_(fn), batch_fn_(), input_dim_(input_dim)
+  {}
+  scalar_fn(fn_t fn, batch_fn_t batch_fn, size_t input_dim)
+    : fn_(fn), batch_fn_(batch_fn), input_dim_(input_dim)
   {}
 
   inline float
@@ -24,20 +34,59 @@ public:
     return fn_(args);
   }
 
+  // the batched counterpart to operator(): one call for all n points
+  // rather than one call (and one argument vector) per point
+  inline void
+  eval(const float *points, size_t n, float *out)
+  {
+    if (batch_fn_) {
+      batch_fn_(points, n, out);
+      return;
+    }
+    std::vector<float> args(input_dim_);
+    for (size_t i = 0; i < n; i++) {
+      std::copy(points, points + input_dim_, args.begin());
+      out[i] = fn_(args);
+      points += input_dim_;
+    }
+  }
+
   inline size_t input_dim() const { return input_dim_; }
 
 private:
-  std::function<float(const std::vector<float> &)> fn_;
+  fn_t fn_;
+  batch_fn_t batch_fn_;
   size_t input_dim_;
 };
 
+namespace detail {
+
+// builds both the pointwise and the batched function from one kernel
+// f(const float *args), so that the batched loop inlines f
+template <typename F>
+static inline scalar_fn
+make_scalar_fn(F f, size_t input_dim)
+{
+  return scalar_fn(
+      [f](const std::vector<float> &args) {
+        return f(args.data());
+      },
+      [f, input_dim](const float *points, size_t n, float *out) {
+        for (size_t i = 0; i < n; i++, points += input_dim)
+          out[i] = f(points);
+      },
+      input_dim);
+}
+
+} // namespace detail
+
 static inline scalar_fn
 log_exponential(float lambda)
 {
   const float log_lambda = logf(lambda);
-  return scalar_fn(
-      [lambda, log_lambda](const std::vector<float> &args) {
-        const float x = args.front();
+  return detail::make_scalar_fn(
+      [lambda, log_lambda](const float *args) {
+        const float x = args[0];
         if (x < 0)
           return -std::numeric_limits<float>::infinity();
         return log_lambda - lambda * x;
@@ -50,9 +99,9 @@ log_normal(float mu, float sigma2)
   MICROSCOPES_DCHECK(sigma2 > 0., "sigma2 cannot be zero");
   const float lgC = -0.5 * logf(2.*M_PIf*sigma2);
   const float one_half_inv_sigma2 = 0.5 * 1./sigma2;
-  return scalar_fn(
-      [mu, sigma2, lgC, one_half_inv_sigma2](const std::vector<float> &args) {
-        const float x = args.front();
+  return detail::make_scalar_fn(
+      [mu, lgC, one_half_inv_sigma2](const float *args) {
+        const float x = args[0];
         const float diff = x - mu;
         return lgC - one_half_inv_sigma2 * diff * diff;
       }, 1);
@@ -63,8 +112,8 @@ log_noninformative_beta_prior()
 {
   // a non-informative (proper) prior for the beta distribution
   // http://iacs-courses.seas.harvard.edu/courses/am207/blog/lecture-9.html
-  return scalar_fn(
-      [](const std::vector<float> &args) {
+  return detail::make_scalar_fn(
+      [](const float *args) {
         const float alpha = args[0];
         const float beta = args[1];
         if (alpha <= 0.0 || beta <= 0.0)
@@ -36,6 +36,14 @@ public:
     return value_accessor(data_ + off, nullptr, type());
   }
 
+  // the whole row as a single value, of n() elements
+  inline value_accessor
+  values() const
+  {
+    return value_accessor(
+        data_, nullptr, runtime_type(type().t(), n() * type().n()));
+  }
+
   std::string debug_str() const;
 
 private:
@@ -113,6 +121,50 @@ private:
   std::vector<unsigned> ns_;
 };
 
+/**
+ * All the rows' values back to back in one buffer, CSR style: row i is
+ * values [offsets[i], offsets[i+1]). There are n+1 offsets, and
+ * offsets[0] = 0. Neither buffer is copied, so both must outlive the
+ * dataview
+ */
+class flat_dataview : public dataview {
+public:
+  flat_dataview(const uint8_t *data,
+                const uint64_t *offsets,
+                size_t n,
+                const runtime_type &type)
+    : dataview(n, type), data_(data), offsets_(offsets)
+  {
+    MICROSCOPES_ASSERT(data);
+    MICROSCOPES_ASSERT(offsets);
+    MICROSCOPES_DCHECK(!offsets[0], "offsets must start at 0");
+#ifdef DEBUG_MODE
+    for (size_t i = 0; i < n; i++)
+      MICROSCOPES_DCHECK(offsets[i] <= offsets[i + 1],
+          "offsets must be non-decreasing");
+#endif
+  }
+
+  row_accessor
+  get(size_t i) const override
+  {
+    MICROSCOPES_DCHECK(i < size(), "invalid i");
+    return row_accessor(
+        data_ + offsets_[i] * type().size(), &type(), rowsize(i));
+  }
+
+  size_t
+  rowsize(size_t i) const override
+  {
+    MICROSCOPES_DCHECK(i < size(), "invalid i");
+    return offsets_[i + 1] - offsets_[i];
+  }
+
+private:
+  const uint8_t *data_;
+  const uint64_t *offsets_;
+};
+
 } // namespace variadic
 } // namespace common
 } // namespace microscopes
@@ -4,8 +4,10 @@
 #include <microscopes/common/runtime_value.hpp>
 #include <microscopes/common/random_fwd.hpp>
 #include <microscopes/common/typedefs.hpp>
+#include <microscopes/common/macros.hpp>
 
 #include <memory>
+#include <vector>
 
 /**
  * The terminology here is borrowed from distributions
@@ -36,6 +38,37 @@ public:
   virtual std::string debug_str() const = 0;
 };
 
+/**
+ * All the groups of one component model, stored together. Groups are
+ * addressed by their index in [0, size()): create_group() appends a group,
+ * and remove_group(i) moves the last group into index i.
+ *
+ * The point of this interface is the batched score_value(), which scores a
+ * value against every group for the cost of a single virtual call (and a
+ * single decoding of the value)
+ */
+class group_array {
+public:
+  virtual ~group_array() {}
+
+  virtual size_t size() const = 0;
+  virtual size_t create_group(const hypers &m, common::rng_t &rng) = 0;
+  virtual void remove_group(size_t i) = 0;
+
+  virtual void add_value(const hypers &m, size_t i, const common::value_accessor &value, common::rng_t &rng) = 0;
+  virtual void remove_value(const hypers &m, size_t i, const common::value_accessor &value, common::rng_t &rng) = 0;
+  virtual float score_value(const hypers &m, size_t i, const common::value_accessor &value, common::rng_t &rng) const = 0;
+
+  // scores[i] = score_value(m, i, value, rng), for every group i. scores
+  // must have room for size() floats
+  virtual void score_value(const hypers &m, const common::value_accessor &value, float *scores, common::rng_t &rng) const = 0;
+
+  virtual float score_data(const hypers &m, size_t i, common::rng_t &rng) const = 0;
+
+  virtual common::suffstats_bag_t get_ss(size_t i) const = 0;
+  virtual void set_ss(size_t i, const common::suffstats_bag_t &ss) = 0;
+};
+
 // abstract hyper parameters
 class hypers {
 public:
@@ -48,9 +81,90 @@ public:
 
   virtual std::shared_ptr<group> create_group(common::rng_t &rng) const = 0;
 
+  // models with a specialized array override this; by default, the array
+  // holds groups made by create_group()
+  virtual std::shared_ptr<group_array> create_group_array() const;
+
   virtual std::string debug_str() const = 0;
 };
 
+/**
+ * A group_array of groups made by hypers::create_group(), for models with
+ * no specialized array. Scoring still goes through each group's virtual
+ * score_value()
+ */
+class group_ptr_array : public group_array {
+public:
+  size_t size() const override { return groups_.size(); }
+
+  size_t
+  create_group(const hypers &m, common::rng_t &rng) override
+  {
+    groups_.emplace_back(m.create_group(rng));
+    return groups_.size() - 1;
+  }
+
+  void
+  remove_group(size_t i) override
+  {
+    MICROSCOPES_DCHECK(i < size(), "invalid group");
+    groups_[i] = std::move(groups_.back());
+    groups_.pop_back();
+  }
+
+  void
+  add_value(const hypers &m, size_t i, const common::value_accessor &value, common::rng_t &rng) override
+  {
+    groups_[i]->add_value(m, value, rng);
+  }
+
+  void
+  remove_value(const hypers &m, size_t i, const common::value_accessor &value, common::rng_t &rng) override
+  {
+    groups_[i]->remove_value(m, value, rng);
+  }
+
+  float
+  score_value(const hypers &m, size_t i, const common::value_accessor &value, common::rng_t &rng) const override
+  {
+    return groups_[i]->score_value(m, value, rng);
+  }
+
+  void
+  score_value(const hypers &m, const common::value_accessor &value, float *scores, common::rng_t &rng) const override
+  {
+    for (size_t i = 0; i < groups_.size(); i++)
+      scores[i] = groups_[i]->score_value(m, value, rng);
+  }
+
+  float
+  score_data(const hypers &m, size_t i, common::rng_t &rng) const override
+  {
+    return groups_[i]->score_data(m, rng);
+  }
+
+  common::suffstats_bag_t
+  get_ss(size_t i) const override
+  {
+    return groups_[i]->get_ss();
+  }
+
+  void
+  set_ss(size_t i, const common::suffstats_bag_t &ss) override
+  {
+    groups_[i]->set_ss(ss);
+  }
+
+private:
+  std::vector<std::shared_ptr<group>> groups_;
+};
+
+inline std::shared_ptr<group_array>
+hypers::create_group_array() const
+{
+  return std::make_shared<group_ptr_array>();
+}
+
 // abstract model
 class model {
 public:
@@ -65,6 +179,8 @@ public:
 typedef group* group_raw_ptr;
 typedef std::shared_ptr<group> group_shared_ptr;
 
+typedef std::shared_ptr<group_array> group_array_shared_ptr;
+
 typedef hypers* hypers_raw_ptr;
 typedef std::shared_ptr<hypers> hypers_shared_ptr;
 
@@ -337,6 +337,100 @@ public:
   typename T::Group repr_;
 };
 
+/**
+ * All the groups of one distributions model, stored by value in one
+ * vector. The calls are resolved at compile time, and the batched
+ * score_value() converts the value to T::Value once for all the groups
+ */
+template <typename T>
+class distributions_group_array : public group_array {
+private:
+
+  static inline const typename T::Shared &
+  shared_repr(const hypers &h);
+
+  static inline ALWAYS_INLINE typename T::Value
+  get_value(const common::value_accessor &value)
+  {
+    MICROSCOPES_ASSERT(!value.anymasked());
+    return detail::value_getter<typename T::Value>::get(value);
+  }
+
+public:
+  typedef typename distribution_types<T>::group_message_type message_type;
+
+  size_t size() const override { return groups_.size(); }
+
+  size_t
+  create_group(const hypers &m, common::rng_t &rng) override
+  {
+    groups_.emplace_back();
+    groups_.back().init(shared_repr(m), rng);
+    return groups_.size() - 1;
+  }
+
+  void
+  remove_group(size_t i) override
+  {
+    MICROSCOPES_DCHECK(i < size(), "invalid group");
+    if (i != groups_.size() - 1)
+      groups_[i] = std::move(groups_.back());
+    groups_.pop_back();
+  }
+
+  void
+  add_value(const hypers &m, size_t i, const common::value_accessor &value, common::rng_t &rng) override
+  {
+    groups_[i].add_value(shared_repr(m), get_value(value), rng);
+  }
+
+  void
+  remove_value(const hypers &m, size_t i, const common::value_accessor &value, common::rng_t &rng) override
+  {
+    groups_[i].remove_value(shared_repr(m), get_value(value), rng);
+  }
+
+  float
+  score_value(const hypers &m, size_t i, const common::value_accessor &value, common::rng_t &rng) const override
+  {
+    return groups_[i].score_value(shared_repr(m), get_value(value), rng);
+  }
+
+  void
+  score_value(const hypers &m, const common::value_accessor &value, float *scores, common::rng_t &rng) const override
+  {
+    const auto &shared = shared_repr(m);
+    const auto v = get_value(value);
+    const size_t n = groups_.size();
+    for (size_t i = 0; i < n; i++)
+      scores[i] = groups_[i].score_value(shared, v, rng);
+  }
+
+  float
+  score_data(const hypers &m, size_t i, common::rng_t &rng) const override
+  {
+    return groups_[i].score_data(shared_repr(m), rng);
+  }
+
+  common::suffstats_bag_t
+  get_ss(size_t i) const override
+  {
+    message_type m;
+    groups_[i].protobuf_dump(m);
+    return common::util::protobuf_to_string(m);
+  }
+
+  void
+  set_ss(size_t i, const common::suffstats_bag_t &ss) override
+  {
+    message_type m;
+    common::util::protobuf_from_string(m, ss);
+    groups_[i].protobuf_load(m);
+  }
+
+  std::vector<typename T::Group> groups_;
+};
+
 namespace detail {
 
 template <typename T>
@@ -352,6 +446,12 @@ public:
     return p;
   }
 
+  std::shared_ptr<group_array>
+  create_group_array() const override
+  {
+    return std::make_shared<distributions_group_array<T>>();
+  }
+
   common::hyperparam_bag_t
   get_hp() const override
   {
@@ -515,6 +615,7 @@ typedef distributions_model<distributions::NormalInverseWishartV> distributions_
 // explicitly instantiate C++ templates
 #define DISTRIB_EXPLICIT_INSTANTIATE(name) \
   extern template class distributions_group< distributions::name >; \
+  extern template class distributions_group_array< distributions::name >; \
   extern template class distributions_hypers< distributions::name >; \
   extern template class distributions_model< distributions::name >;
 DISTRIB_FOR_EACH_DISTRIBUTION(DISTRIB_EXPLICIT_INSTANTIATE)
@@ -527,5 +628,12 @@ distributions_group<T>::shared_repr(const hypers &h)
   return static_cast<const distributions_hypers<T> &>(h).repr_;
 }
 
+template <typename T>
+inline const typename T::Shared &
+distributions_group_array<T>::shared_repr(const hypers &h)
+{
+  return static_cast<const distributions_hypers<T> &>(h).repr_;
+}
+
 } // namespace models
 } // namespace microscopes
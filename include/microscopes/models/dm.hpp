@@ -7,6 +7,7 @@
 #include <microscopes/io/schema.pb.h>
 
 #include <distributions/io/protobuf.hpp>
+#include <atomic>
 #include <vector>
 
 /**
@@ -15,12 +16,30 @@
 namespace microscopes {
 namespace models {
 
+class dm_hypers;
+
+/**
+ * Values are either dense, one count per category, or sparse, a list of
+ * (category, count) pairs of int32s laid out back to back (see
+ * dm_hypers::sparse()). In a sparse value the categories must be distinct.
+ *
+ * Besides the counts, a group keeps their sum and, per category, the
+ * lgamma(alpha + count) term of the score. These are updated as values are
+ * added and removed, so scoring a value only computes lgamma() for the
+ * categories where the value is non-zero.
+ *
+ * The lgamma terms depend on the hyper-parameters. Adding or removing a
+ * value recomputes them if the hypers have changed (see
+ * dm_hypers::version()). Scoring never writes to the group: while the terms
+ * are stale, it computes the ones it needs on the fly
+ */
 class dm_group : public group {
 public:
   typedef microscopes::io::DirichletMultinomial_Group message_type;
 
   dm_group(unsigned categories)
-    : counts_(categories), ratio_() {}
+    : counts_(categories), count_sum_(), ratio_(),
+      lgammas_(categories), version_() {}
 
   void add_value(const hypers &m, const common::value_accessor &value, common::rng_t &rng) override;
   void remove_value(const hypers &m, const common::value_accessor &value, common::rng_t &rng) override;
@@ -47,10 +66,13 @@ public:
         (size_t)m.counts_size() == categories(),
         "# categories mismatch");
     MICROSCOPES_DCHECK(m.ratio() >= 0., "negative partition");
+    count_sum_ = 0;
     for (size_t i = 0; i < categories(); i++) {
       counts_[i] = m.counts(i);
+      count_sum_ += counts_[i];
     }
     ratio_ = m.ratio();
+    version_ = 0;
   }
 
   void
@@ -83,16 +105,35 @@ public:
   }
 
 private:
+  // recomputes lgammas_ if the hypers have changed since they were
+  // computed, which is O(categories) once per change of the hypers and O(1)
+  // otherwise. returns false if the hypers have no version, in which case
+  // lgammas_ is left stale
+  bool refresh(const dm_hypers &h);
+
+  // lgamma(alphas[i] + counts_[i]), from lgammas_ if it is up to date
+  float lgamma_term(const dm_hypers &h, uint64_t version, size_t i) const;
+
   std::vector<unsigned> counts_;
+  unsigned count_sum_;
   float ratio_;
+
+  // lgammas_[i] = lgamma(alphas[i] + counts_[i]), computed for the hypers
+  // with version_ (0 means never)
+  std::vector<float> lgammas_;
+  uint64_t version_;
 };
 
 class dm_hypers : public hypers {
 public:
   typedef microscopes::io::DirichletMultinomial_Shared message_type;
 
-  dm_hypers(unsigned categories)
-    : alphas_(categories) {}
+  dm_hypers(unsigned categories, bool sparse=false)
+    : alphas_(categories), sparse_(sparse),
+      alpha_sum_(), lgamma_alpha_sum_(), version_()
+  {
+    commit();
+  }
 
   std::shared_ptr<group>
   create_group(common::rng_t &rng) const override
@@ -122,6 +163,7 @@ public:
           "alphas need to be positive reals");
       alphas_[i] = m.alphas(i);
     }
+    commit();
   }
 
   void
@@ -130,18 +172,26 @@ public:
     const auto &h = static_cast<const dm_hypers &>(m);
     MICROSCOPES_DCHECK(categories() == h.categories(),
         "# categories mismatch");
+    MICROSCOPES_DCHECK(sparse() == h.sparse(), "value layout mismatch");
     *this = h;
+    commit();
   }
 
   common::value_mutator
   get_hp_mutator(const std::string &key) override
   {
-    if (key == "alphas")
+    if (key == "alphas") {
+      // XXX: we cannot see writes through the mutator, so once it is
+      // handed out nothing derived from the alphas is cached until they
+      // are next set with set_hp(). writes through a mutator which is
+      // still held after that are not seen
+      version_ = 0;
       return common::value_mutator(
           reinterpret_cast<uint8_t *>(&alphas_[0]),
           common::runtime_type(
             common::static_type_to_primitive_type<float>::value,
             categories()));
+    }
     throw std::runtime_error("unknown key: " + key);
   }
 
@@ -157,6 +207,29 @@ public:
     return alphas_;
   }
 
+  // are values (category, count) pairs?
+  inline bool
+  sparse() const
+  {
+    return sparse_;
+  }
+
+  // sum of the alphas
+  float alpha_sum() const;
+
+  // sum of lgamma(alpha) over the alphas
+  float lgamma_alpha_sum() const;
+
+  // identifies the alphas, unique across all dm_hypers, so groups can tell
+  // when their cached terms are stale. 0 if a mutator has been handed out
+  // since the alphas were last set, in which case nothing derived from
+  // them may be cached
+  inline uint64_t
+  version() const
+  {
+    return version_;
+  }
+
   std::string
   debug_str() const override
   {
@@ -166,13 +239,29 @@ public:
   }
 
 private:
+  static inline uint64_t
+  next_version()
+  {
+    static std::atomic<uint64_t> version(1);
+    return version++;
+  }
+
+  // recomputes the sums, with a new version, for the current alphas
+  void commit();
+
   std::vector<float> alphas_;
+  bool sparse_;
+
+  // computed from the alphas by commit(), valid while version_ != 0
+  float alpha_sum_;
+  float lgamma_alpha_sum_;
+  uint64_t version_;
 };
 
 class dm_model : public model {
 public:
-  dm_model(unsigned categories)
-    : categories_(categories)
+  dm_model(unsigned categories, bool sparse=false)
+    : categories_(categories), sparse_(sparse)
   {
     MICROSCOPES_DCHECK(categories >= 2, "need at least two outcomes");
   }
@@ -180,12 +269,16 @@ public:
   std::shared_ptr<hypers>
   create_hypers() const override
   {
-    return std::make_shared<dm_hypers>(categories_);
+    return std::make_shared<dm_hypers>(categories_, sparse_);
   }
 
+  // sparse values have no fixed shape: the type is that of the elements of
+  // the pairs, which come from a variadic dataview's rows
   common::runtime_type
   get_runtime_type() const override
   {
+    if (sparse_)
+      return common::runtime_type(TYPE_I32);
     return common::runtime_type(TYPE_I32, categories());
   }
 
@@ -195,8 +288,15 @@ public:
     return categories_;
   }
 
+  inline bool
+  sparse() const
+  {
+    return sparse_;
+  }
+
 private:
   unsigned categories_;
+  bool sparse_;
 };
 
 } // namespace models
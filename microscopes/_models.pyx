@@ -48,5 +48,5 @@ cdef class _bbnc(_base):
         self._thisptr.reset(new c_bbnc())
 
 cdef class _dm(_base):
-    def __cinit__(self, int categories):
-        self._thisptr.reset(new c_dm(categories))
+    def __cinit__(self, int categories, bint sparse=False):
+        self._thisptr.reset(new c_dm(categories, sparse))
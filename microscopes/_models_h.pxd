@@ -1,3 +1,4 @@
+from libcpp cimport bool as cbool
 from libcpp.vector cimport vector
 from libc.stddef import size_t
 
@@ -67,4 +68,4 @@ cdef extern from "microscopes/models/bbnc.hpp" namespace "microscopes::models":
 
 cdef extern from "microscopes/models/dm.hpp" namespace "microscopes::models":
     cdef cppclass dm_model:
-        dm_model(unsigned) except +
+        dm_model(unsigned, cbool) except +
@@ -0,0 +1,7 @@
+from libc.stddef cimport size_t
+
+from microscopes.common._entity_state_h cimport entity_based_state_object
+
+cdef extern from "microscopes/common/crp_state.hpp" namespace "microscopes::common":
+    cdef cppclass crp_state(entity_based_state_object):
+        crp_state(size_t, float) except +
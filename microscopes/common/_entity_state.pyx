@@ -2,7 +2,11 @@
 
 
 from microscopes.models import model_descriptor
+from microscopes.common import validator
 import numpy as np
+cimport numpy as np
+
+np.import_array()
 
 cdef class entity_based_state_object:
     def __init__(self, models):
@@ -17,6 +21,43 @@ cdef class entity_based_state_object:
     def assignments(self):
         return list(self._thisptr.get().assignments())
 
+    def assignments_view(self):
+        """Read-only intp array of the assignments, -1 if unassigned.
+
+        When the state stores its assignments contiguously, this is a
+        zero-copy view which reflects subsequent calls to add_value() and
+        remove_value(), and which keeps the state alive. Otherwise it is a
+        copy.
+
+        """
+        cdef const ssize_t *px = self._thisptr.get().assignments_data()
+        cdef np.npy_intp n = self._thisptr.get().nentities()
+        cdef np.ndarray view
+        if px is NULL:
+            view = np.array(self.assignments(), dtype=np.intp)
+        else:
+            view = np.PyArray_SimpleNewFromData(
+                1, &n, np.NPY_INTP, <void *> px)
+            np.set_array_base(view, self)
+        view.flags.writeable = False
+        return view
+
+    def groupsizes(self):
+        """Returns (gids, sizes) as two intp arrays, in groups() order"""
+        cdef size_t ngroups = self._thisptr.get().ngroups()
+        cdef np.ndarray gids = np.empty(ngroups, dtype=np.uintp)
+        cdef np.ndarray sizes = np.empty(ngroups, dtype=np.uintp)
+        if ngroups:
+            self._thisptr.get().inplace_groups(
+                <size_t *> gids.data, <size_t *> sizes.data)
+        return gids.view(np.intp), sizes.view(np.intp)
+
+    def groups(self):
+        return list(self._thisptr.get().groups())
+
+    def groupsize(self, int gid):
+        return self._thisptr.get().groupsize(gid)
+
     def nentities(self):
         return self._thisptr.get().nentities()
 
@@ -38,6 +79,66 @@ cdef class entity_based_state_object:
             np.array([x for x in ret.second], dtype=np.float)
         )
 
+    def score_values(self, eids, rng r, out=None):
+        """Score a block of entities against every group.
+
+        Parameters
+        ----------
+        eids : 1-D array-like of entity ids
+        r : rng
+        out : float32 ndarray of shape (len(eids), ngroups()), optional
+            Written in place if given. Rows may be strided (e.g. a slice of
+            a larger buffer), but each row must be contiguous.
+
+        Returns
+        -------
+        gids : ndarray
+            The group id of each column.
+        scores : ndarray of shape (len(eids), ngroups())
+            ``scores[i, j]`` is the score of ``eids[i]`` in group ``gids[j]``.
+
+        """
+        eids = np.asarray(eids)
+        if eids.ndim != 1:
+            raise ValueError("eids must be 1-D")
+        if eids.shape[0] and not np.issubdtype(eids.dtype, np.integer):
+            raise ValueError("eids must be integers")
+        cdef size_t n = eids.shape[0]
+        cdef size_t ngroups = self._thisptr.get().ngroups()
+        if n and (eids.min() < 0 or
+                  eids.max() >= self._thisptr.get().nentities()):
+            raise ValueError("invalid eid")
+        cdef np.ndarray c_eids = np.ascontiguousarray(eids, dtype=np.uintp)
+
+        if out is None:
+            out = np.empty((n, ngroups), dtype=np.float32)
+        else:
+            validator.validate_type(out, np.ndarray, "out")
+            if out.dtype != np.float32:
+                raise ValueError("out must be float32")
+            if out.ndim != 2 or out.shape[0] != n or out.shape[1] != ngroups:
+                raise ValueError(
+                    "out must have shape {}".format((n, ngroups)))
+            if ngroups > 1 and out.strides[1] != out.itemsize:
+                raise ValueError("rows of out must be contiguous")
+            if n > 1 and (out.strides[0] % out.itemsize or
+                          out.strides[0] < ngroups * out.itemsize):
+                raise ValueError("rows of out must not overlap")
+            if not out.flags.writeable:
+                raise ValueError("out is read-only")
+        cdef np.ndarray c_out = out
+        cdef size_t stride = (
+            c_out.strides[0] // c_out.itemsize if n > 1 else ngroups)
+
+        cdef vector[size_t] gids
+        if n:
+            self._thisptr.get().inplace_score_values(
+                <const size_t *> c_eids.data, n, gids,
+                <float *> c_out.data, stride, r._thisptr[0])
+        else:
+            gids = self._thisptr.get().groups()
+        return np.array(gids, dtype=np.intp), out
+
     cdef c_entity_based_state_object * raw_px(self):
         return <c_entity_based_state_object *> self._thisptr.get()
 
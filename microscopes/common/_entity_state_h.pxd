@@ -10,10 +10,17 @@ cdef extern from "microscopes/common/entity_state.hpp" namespace "microscopes::c
         vector[ssize_t] assignments() except +
         size_t nentities()
         size_t ngroups()
+        vector[size_t] groups() except +
+        size_t groupsize(size_t) except +
+        const ssize_t * assignments_data()
+        void inplace_groups(size_t *, size_t *) except +
 
         void add_value(size_t, size_t, rng_t &) except +
         size_t remove_value(size_t, rng_t &) except +
         pair[vector[size_t], vector[float]] score_value(size_t, rng_t &) except +
+        void inplace_score_values(
+            const size_t *, size_t, vector[size_t] &,
+            float *, size_t, rng_t &) except +
 
         vector[size_t] empty_groups() except +
         size_t create_group(rng_t &) except +
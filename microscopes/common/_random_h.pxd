@@ -1,4 +1,5 @@
 from libcpp.utility cimport pair
+from libc.stddef cimport size_t
 from microscopes._eigen_h cimport VectorXf, MatrixXf
 from microscopes.common._random_fwd_h cimport rng_t
 
@@ -7,3 +8,9 @@ cdef extern from "microscopes/common/random.hpp" namespace "microscopes::common:
     MatrixXf sample_wishart(float, const MatrixXf &, rng_t &) except +
     MatrixXf sample_inverse_wishart(float, const MatrixXf &, rng_t &) except +
     pair[VectorXf, MatrixXf] sample_normal_inverse_wishart(const VectorXf &, float, const MatrixXf &, float, rng_t &) except +
+
+    # row-major buffer versions
+    void sample_multivariate_normal(const float *, const float *, size_t, size_t, float *, rng_t &) except +
+    void sample_wishart(float, const float *, size_t, float *, rng_t &) except +
+    void sample_inverse_wishart(float, const float *, size_t, float *, rng_t &) except +
+    void sample_normal_inverse_wishart(const float *, float, const float *, float, size_t, float *, float *, float *, rng_t &) except +
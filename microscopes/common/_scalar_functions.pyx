@@ -1,6 +1,10 @@
 # cython: embedsignature=True
 
 
+import numpy as np
+cimport numpy as np
+
+
 cdef class scalar_function:
     def __call__(self, *args):
         cdef vector[float] c_args
@@ -8,5 +12,33 @@ cdef class scalar_function:
             c_args.push_back(float(arg))
         return self._func(c_args)
 
+    def eval(self, points):
+        """Evaluate the function at many points in one call
+
+        Parameters
+        ----------
+        points : (npoints, input_dim) array
+            One point per row. A 1D array is taken as npoints points when
+            input_dim is 1
+
+        Returns
+        -------
+        values : (npoints,) float32 array
+
+        """
+        cdef size_t input_dim = self._func.input_dim()
+        points = np.ascontiguousarray(points, dtype=np.float32)
+        if points.ndim == 1 and input_dim == 1:
+            points = points.reshape(-1, 1)
+        if points.ndim != 2 or points.shape[1] != input_dim:
+            raise ValueError(
+                "expected an (npoints, {}) array".format(input_dim))
+        cdef size_t n = points.shape[0]
+        cdef np.ndarray c_points = points
+        cdef np.ndarray c_out = np.empty(n, dtype=np.float32)
+        self._func.eval(
+            <const float *> c_points.data, n, <float *> c_out.data)
+        return c_out
+
     def input_dim(self):
         return self._func.input_dim()
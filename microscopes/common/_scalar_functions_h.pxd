@@ -4,6 +4,7 @@ from libc.stddef cimport size_t
 cdef extern from "microscopes/common/scalar_functions.hpp" namespace "microscopes::common":
     cdef cppclass scalar_fn:
         float operator()(const vector[float] &) except +
+        void eval(const float *, size_t, float *) except +
         size_t input_dim() 
 
     scalar_fn log_exponential(float)
@@ -0,0 +1,30 @@
+# cython: embedsignature=True
+
+
+from microscopes.common._entity_state cimport entity_based_state_object
+from microscopes.common._crp_state_h cimport crp_state as c_crp_state
+
+
+cdef class state(entity_based_state_object):
+    """A CRP clustering of n entities with no components.
+
+    Each entity scores log(n_k) against a group of size n_k, and
+    log(alpha / #empty groups) against each empty group. All entities start
+    out unassigned, and there are no groups.
+
+    Parameters
+    ----------
+    n : int
+        The number of entities.
+    alpha : float, optional
+        The CRP concentration parameter, must be positive.
+
+    """
+
+    def __init__(self, int n, float alpha=1.):
+        if n <= 0:
+            raise ValueError("need at least one entity")
+        if alpha <= 0.:
+            raise ValueError("alpha must be positive")
+        super(state, self).__init__([])
+        self._thisptr.reset(new c_crp_state(n, alpha))
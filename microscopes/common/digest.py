@@ -0,0 +1,144 @@
+"""Chunked, parallel digests of large arrays
+
+Dataview digests are tree hashes: the bytes of each array are split into
+chunks of about `CHUNK_SIZE` bytes, each chunk is hashed with sha1 on a
+thread pool, and the chunk hashes are then hashed together in order.
+hashlib releases the GIL while hashing a large buffer (as numpy does while
+zeroing masked values), so the chunks really are hashed in parallel.
+
+"""
+
+import hashlib
+import multiprocessing
+import numpy as np
+import os
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+CHUNK_SIZE = 1 << 22
+
+# thread pools by size, created on first use and reused by every digest. a
+# forked child cannot use its parent's threads, so each pool is tagged with
+# the pid which created it
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(nthreads):
+    pid = os.getpid()
+    with _pools_lock:
+        entry = _pools.get(nthreads)
+        if entry is None or entry[0] != pid:
+            entry = (pid, ThreadPool(nthreads))
+            _pools[nthreads] = entry
+        return entry[1]
+
+
+def _hash_chunk(chunk):
+    return hashlib.sha1(chunk()).digest()
+
+
+def tree_digest(chunks, nthreads=None):
+    """The sha1 digest of the sha1 digests of `chunks`
+
+    Parameters
+    ----------
+    chunks : list of callables
+        Each returns a (C-contiguous) buffer; see `array_chunks()`
+    nthreads : int, optional
+        Defaults to the number of CPUs. The pool of that many threads is
+        created on first use, and kept for later calls
+
+    Returns
+    -------
+    digest : bytes
+
+    """
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    if nthreads <= 1 or len(chunks) <= 1:
+        hashes = map(_hash_chunk, chunks)
+    else:
+        hashes = _get_pool(nthreads).map(_hash_chunk, chunks)
+    h = hashlib.sha1()
+    h.update(str(len(chunks)))
+    for x in hashes:
+        h.update(x)
+    return h.digest()
+
+
+def value_of_byte(dtype):
+    """Which value each byte of an element of `dtype` belongs to
+
+    Scalar dtypes hold one value; each field of a structured dtype holds one
+    value per element of its subarray (as in ma.make_mask_descr()).
+
+    """
+    dtype = np.dtype(dtype)
+    if dtype.names is None:
+        return np.zeros(dtype.itemsize, dtype=np.intp)
+    widths = []
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        if field.subdtype is None:
+            widths.append(field.itemsize)
+        else:
+            base, shape = field.subdtype
+            widths.extend([base.itemsize] * int(np.prod(shape)))
+    return np.repeat(np.arange(len(widths)), widths)
+
+
+def _chunk(rows, begin, end):
+    return lambda: rows[begin:end]
+
+
+def _masked_chunk(rows, maskbits, byte_values, begin, end):
+    nvalues = byte_values[-1] + 1
+
+    def chunk():
+        # chunks start on a multiple of 8 rows, so on a byte of maskbits
+        mask = np.unpackbits(
+            maskbits[begin * nvalues // 8:(end * nvalues + 7) // 8])
+        mask = mask[:(end - begin) * nvalues].reshape(end - begin, nvalues)
+        if not mask.any():
+            return rows[begin:end]
+        return np.where(
+            mask[:, byte_values].view(np.bool_), np.uint8(0),
+            rows[begin:end])
+    return chunk
+
+
+def array_chunks(data, maskbits=None, byte_values=None,
+                 chunk_size=CHUNK_SIZE):
+    """Split the bytes of `data` into chunks for `tree_digest()`
+
+    Masked values read as zero, so views whose data differs only under the
+    mask get the same chunks. The data is never modified.
+
+    Parameters
+    ----------
+    data : C-contiguous ndarray
+        Its first axis indexes rows
+    maskbits : uint8 ndarray, optional
+        The mask of the row-major values of `data`, packed with np.packbits
+    byte_values : int ndarray, optional
+        Which of a row's values each byte of the row belongs to (see
+        `value_of_byte()`). Required with `maskbits`
+
+    """
+    if not data.size:
+        return []
+    rows = data.view(np.uint8).reshape(data.shape[0], -1)
+    nrows, rowsize = rows.shape
+    # a multiple of 8 rows per chunk
+    step = max(1, chunk_size // (8 * rowsize)) * 8
+    if maskbits is None:
+        return [_chunk(rows, i, min(i + step, nrows))
+                for i in xrange(0, nrows, step)]
+    byte_values = np.asarray(byte_values, dtype=np.intp)
+    if byte_values.shape != (rowsize,):
+        raise ValueError("expected one value index per byte of a row")
+    return [_masked_chunk(rows, maskbits, byte_values,
+                          i, min(i + step, nrows))
+            for i in xrange(0, nrows, step)]
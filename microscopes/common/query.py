@@ -4,14 +4,62 @@ Note you should generally be calling the model-specific query interfaces.
 
 """
 
-import scipy.cluster
 import numpy as np
 import itertools as it
 
+from microscopes.common import validator
+
+# scipy is slow to import, and most users of this module only need a few of
+# its functions, so it is imported by the functions which use it
+
 # Terminology used in this module:
 # avec: a single assignment vector
 # assignments: a list of avecs
 
+# the # of elements of the (avecs, non-zeros) temporaries which
+# consensus_assignment() builds at once
+_CONSENSUS_BLOCK_SIZE = 1 << 20
+
+
+def groups_csr(avec, sort=False):
+    """Turn an assignment vector into a clustering, in compressed (CSR-like)
+    form.
+
+    This only uses a handful of vectorized passes (a stable sort plus a
+    bincount), so it is suitable for very large assignment vectors.
+
+    Parameters
+    ----------
+    avec : (N,) array-like of integer group ids
+    sort : bool, default False
+        Whether or not the order of the clusters should be sorted by descending
+        size (largest groups first). Otherwise clusters are ordered by gid.
+
+    Returns
+    -------
+    offsets : (K+1,) ndarray
+    members : (N,) ndarray
+        The k-th cluster consists of the (ascending) entity ids
+        ``members[offsets[k]:offsets[k+1]]``
+
+    """
+    avec = np.asarray(avec)
+    if len(avec.shape) != 1:
+        raise ValueError("expected a 1-D assignment vector")
+    _, inverse = np.unique(avec, return_inverse=True)
+    inverse = inverse.ravel()
+    sizes = np.bincount(inverse)
+    if sort:
+        cluster_order = np.argsort(-sizes, kind='mergesort')
+        rank = np.empty_like(cluster_order)
+        rank[cluster_order] = np.arange(cluster_order.shape[0])
+        inverse = rank[inverse]
+        sizes = sizes[cluster_order]
+    members = np.argsort(inverse, kind='mergesort')
+    offsets = np.zeros(sizes.shape[0] + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    return offsets, members
+
 
 def groups(avec, sort=False):
     """Turn an assignment vector in a clustering.
@@ -28,35 +76,384 @@ def groups(avec, sort=False):
     clustering : a list of lists
         Note that ``len(clustering) == len(np.unique(avec))``
 
+    See Also
+    --------
+    groups_csr
+
     """
-    cluster_map = {}
-    for idx, gid in enumerate(avec):
-        lst = cluster_map.get(gid, [])
-        lst.append(idx)
-        cluster_map[gid] = lst
-    if sort:
-        return list(sorted(cluster_map.values(), key=len, reverse=True))
-    else:
-        return list(cluster_map.values())
+    offsets, members = groups_csr(avec, sort=sort)
+    return [members[beg:end].tolist()
+            for beg, end in zip(offsets[:-1], offsets[1:])]
 
 
-def zmatrix(assignments):
-    if not len(assignments):
+def _assignment_matrix(assignments):
+    """Coerce `assignments` into a 2-D integer ndarray (one avec per row)"""
+    assignments = np.asarray(assignments)
+    if not assignments.size:
         raise ValueError("empty assignments list")
-    if len(set(map(len, assignments))) != 1:
+    if len(assignments.shape) != 2:
         raise ValueError("assignment vectors should all be same size")
+    if not np.issubdtype(assignments.dtype, np.integer):
+        raise ValueError("assignment vectors should contain integer group ids")
+    return assignments
 
-    # XXX(stephentu): should support sparse z-matrices for large n
 
-    n = len(assignments[0])
-    zmat = np.zeros((n, n), dtype=np.float32)
-    for avec in assignments:
-        clusters = groups(avec)
-        for cluster in clusters:
-            for i, j in it.product(cluster, repeat=2):
-                zmat[i, j] += 1
-    zmat /= float(len(assignments))
-    return zmat
+def _sample_keys(assignments):
+    """Maps each (sample, gid) pair of a 2-D assignment matrix to an int64 key
+    which is unique across the whole matrix. Keys are ordered by sample first.
+
+    Returns the flattened keys, along with the # of keys per sample
+
+    """
+    lo = assignments.min()
+    span = np.int64(assignments.max()) - lo + 1
+    keys = (np.arange(assignments.shape[0], dtype=np.int64)[:, np.newaxis] *
+            span + (assignments - lo))
+    return keys.ravel(), span
+
+
+def _cooccurrence_counts(assignments):
+    """Returns a (N, N) ``scipy.sparse.csr_matrix`` whose (i, j)-th entry
+    counts the number of avecs in which entities i and j share a group.
+
+    Let H be the (N, sum_s K_s) indicator matrix which has a one at (i, c)
+    iff entity i belongs to the c-th (sample, group) pair. Then the counts are
+    exactly H H^T, which we compute with a single sparse matrix product.
+
+    """
+    import scipy.sparse
+    nsamples, n = assignments.shape
+
+    # relabel every (sample, gid) pair into a contiguous column id of H, in
+    # one vectorized pass over the chunk
+    keys, _ = _sample_keys(assignments)
+    _, cols = np.unique(keys, return_inverse=True)
+    cols = cols.ravel()
+    rows = np.tile(np.arange(n), nsamples)
+
+    H = scipy.sparse.csr_matrix(
+        (np.ones(cols.shape[0], dtype=np.float32), (rows, cols)),
+        shape=(n, cols.max() + 1))
+    return H.dot(H.T).tocsr()
+
+
+def _iter_chunks(assignments, chunksize):
+    """Yields 2-D integer ndarrays of (at most) `chunksize` avecs taken from
+    `assignments`, which can be any iterable of avecs
+
+    """
+    if chunksize is None:
+        yield _assignment_matrix(assignments)
+        return
+    if chunksize <= 0:
+        raise ValueError("chunksize must be positive")
+    assignments = iter(assignments)
+    while True:
+        chunk = list(it.islice(assignments, chunksize))
+        if not chunk:
+            return
+        yield _assignment_matrix(chunk)
+
+
+def _normalize(counts, nsamples, threshold):
+    """Turns co-occurrence `counts` into a z-matrix (in place)"""
+    import scipy.sparse
+    counts /= float(nsamples)
+    if scipy.sparse.issparse(counts) and threshold > 0.:
+        counts.data[counts.data < threshold] = 0.
+        counts.eliminate_zeros()
+    return counts
+
+
+class ZMatrixAccumulator(object):
+    """Incrementally estimates the z-matrix of a stream of assignment vectors.
+
+    Only the (N, N) co-occurrence counts and a small buffer of at most
+    `chunksize` pending avecs are kept in memory, so a sampler can fold in
+    each avec as it is produced instead of holding on to all of them.
+
+    Accumulators are picklable (which is how to checkpoint and resume them),
+    and accumulators from independent chains can be combined with
+    :meth:`merge`.
+
+    Parameters
+    ----------
+    n : int
+        The number of entities
+    sparse : bool, default False
+        Whether or not to store the counts in a ``scipy.sparse.csr_matrix``
+    chunksize : int, default 100
+        The number of avecs buffered before they are folded into the counts
+
+    """
+
+    def __init__(self, n, sparse=False, chunksize=100):
+        validator.validate_positive(n, param_name='n')
+        validator.validate_positive(chunksize, param_name='chunksize')
+        self._n = n
+        self._sparse = sparse
+        self._chunksize = chunksize
+        if sparse:
+            import scipy.sparse
+            self._counts = scipy.sparse.csr_matrix((n, n), dtype=np.float32)
+        else:
+            self._counts = np.zeros((n, n), dtype=np.float32)
+        self._nsamples = 0
+        self._pending = []
+
+    def n(self):
+        return self._n
+
+    def nsamples(self):
+        return self._nsamples + len(self._pending)
+
+    def update(self, avec):
+        """Fold a single assignment vector into the estimate"""
+        avec = np.asarray(avec)
+        if avec.shape != (self._n,):
+            raise ValueError(
+                "expected assignment vector of size {}".format(self._n))
+        if not np.issubdtype(avec.dtype, np.integer):
+            raise ValueError(
+                "assignment vectors should contain integer group ids")
+        self._pending.append(avec)
+        if len(self._pending) >= self._chunksize:
+            self._flush()
+        return self
+
+    def merge(self, that):
+        """Fold the samples seen by accumulator `that` into this one
+
+        The accumulators need not both be sparse (or dense): this one keeps
+        its representation.
+
+        """
+        validator.validate_type(that, ZMatrixAccumulator, param_name='that')
+        if that._n != self._n:
+            raise ValueError("accumulators have a different # of entities")
+        self._flush()
+        that._flush()
+        if self._sparse:
+            import scipy.sparse
+            self._counts = self._counts + scipy.sparse.csr_matrix(
+                that._counts, dtype=np.float32)
+        elif that._sparse:
+            self._counts += that._counts.toarray()
+        else:
+            self._counts += that._counts
+        self._nsamples += that._nsamples
+        return self
+
+    def zmatrix(self, threshold=0.):
+        """Returns the current z-matrix estimate
+
+        Parameters
+        ----------
+        threshold : float, default 0.
+            Only used for sparse accumulators: entries strictly smaller than
+            `threshold` are dropped from the result.
+
+        Returns
+        -------
+        zmat : (N, N) float32 ndarray or ``scipy.sparse.csr_matrix``
+
+        """
+        self._flush()
+        if not self._nsamples:
+            raise ValueError("no assignment vectors seen")
+        return _normalize(self._counts.copy(), self._nsamples, threshold)
+
+    def _add_chunk(self, chunk):
+        counts = _cooccurrence_counts(chunk)
+        if self._sparse:
+            self._counts = self._counts + counts
+        else:
+            counts = counts.tocoo()
+            self._counts[counts.row, counts.col] += counts.data
+        self._nsamples += chunk.shape[0]
+
+    def _flush(self):
+        if not self._pending:
+            return
+        chunk = np.vstack(self._pending)
+        self._pending = []
+        self._add_chunk(chunk)
+
+    def __getstate__(self):
+        self._flush()
+        return self.__dict__.copy()
+
+
+def zmatrix(assignments, sparse=False, threshold=0., chunksize=None):
+    """Compute the z-matrix (co-clustering matrix) of a set of assignment
+    vectors.
+
+    The (i, j)-th entry is the fraction of assignment vectors in which
+    entities i and j are clustered together.
+
+    Parameters
+    ----------
+    assignments : (S, N) array-like of integer group ids
+        One assignment vector per row. If `chunksize` is given, this can be
+        any iterable (e.g. a generator) of assignment vectors.
+    sparse : bool, default False
+        Whether or not to return a ``scipy.sparse.csr_matrix`` instead of a
+        dense ndarray.
+    threshold : float, default 0.
+        Only used when `sparse` is True: entries strictly smaller than
+        `threshold` are dropped from the result.
+    chunksize : int, optional
+        If given, only `chunksize` assignment vectors are materialized at a
+        time, so that memory is bounded by the size of the result.
+
+    Returns
+    -------
+    zmat : (N, N) float32 ndarray or ``scipy.sparse.csr_matrix``
+
+    See Also
+    --------
+    ZMatrixAccumulator
+
+    """
+    acc = None
+    for chunk in _iter_chunks(assignments, chunksize):
+        if acc is None:
+            acc = ZMatrixAccumulator(chunk.shape[1], sparse=sparse)
+        elif chunk.shape[1] != acc.n():
+            raise ValueError("assignment vectors should all be same size")
+        acc._add_chunk(chunk)
+    if acc is None:
+        raise ValueError("empty assignments list")
+    # the accumulator is private, so normalize its counts in place
+    return _normalize(acc._counts, acc._nsamples, threshold)
+
+
+def canonicalize(assignments):
+    """Relabel assignment vectors so that group ids are assigned in order of
+    first appearance (so ``[5, 5, 2, 7, 2]`` becomes ``[0, 0, 1, 2, 1]``).
+
+    Two avecs describe the same clustering iff their canonical forms are
+    equal. All avecs are relabeled at once with vectorized operations.
+
+    Parameters
+    ----------
+    assignments : (N,) or (S, N) array-like of integer group ids
+
+    Returns
+    -------
+    canonical : ndarray of the same shape as `assignments`
+
+    """
+    assignments = np.asarray(assignments)
+    shape = assignments.shape
+    assignments = _assignment_matrix(np.atleast_2d(assignments))
+    keys, span = _sample_keys(assignments)
+    uniq, first, inverse = np.unique(
+        keys, return_index=True, return_inverse=True)
+
+    # order the (sample, gid) pairs by sample, then by first appearance;
+    # a pair's canonical label is then its rank within its sample
+    samples = uniq // span
+    order = np.lexsort((first, samples))
+    sorted_samples = samples[order]
+    labels = np.empty(uniq.shape[0], dtype=np.int64)
+    labels[order] = (np.arange(uniq.shape[0]) -
+                     np.searchsorted(sorted_samples, sorted_samples))
+    return labels[inverse.ravel()].reshape(shape)
+
+
+def map_assignment(assignments, scores=None):
+    """Point estimate of the clustering from a set of assignment vectors.
+
+    Parameters
+    ----------
+    assignments : (S, N) array-like of integer group ids
+    scores : (S,) array-like, optional
+        The (unnormalized) log-probability of each avec. If given, the
+        highest scoring avec is returned. Otherwise, the most frequently
+        occurring clustering (the mode) is returned.
+
+    Returns
+    -------
+    avec : (N,) ndarray
+        The canonical form (see :func:`canonicalize`) of the estimate
+
+    """
+    canonical = canonicalize(_assignment_matrix(assignments))
+    if scores is not None:
+        scores = np.asarray(scores)
+        if scores.shape != (canonical.shape[0],):
+            raise ValueError("expected one score per assignment vector")
+        return canonical[np.argmax(scores)]
+
+    # view each canonical avec as a single opaque value, so that np.unique()
+    # can count duplicate rows
+    canonical = np.ascontiguousarray(canonical)
+    rows = canonical.view(
+        np.dtype((np.void, canonical.dtype.itemsize * canonical.shape[1])))
+    _, idxs, counts = np.unique(
+        rows.ravel(), return_index=True, return_counts=True)
+    return canonical[idxs[np.argmax(counts)]]
+
+
+def consensus_assignment(assignments, zmat=None, chunksize=100):
+    """Least-squares consensus clustering of a set of assignment vectors.
+
+    Returns the avec whose co-clustering matrix is closest (in Frobenius
+    norm) to the z-matrix of all the avecs; see Dahl (2006), "Model-based
+    clustering for expression data via a Dirichlet process mixture model".
+    The cost is linear in the # of avecs times the # of non-zeros of the
+    z-matrix.
+
+    Parameters
+    ----------
+    assignments : (S, N) array-like of integer group ids
+    zmat : (N, N) ndarray or ``scipy.sparse`` matrix, optional
+        The z-matrix of `assignments`, if already computed
+    chunksize : int, default 100
+        The # of avecs which are scored at once. Each is compared against
+        the non-zeros of the z-matrix in blocks, so memory use does not
+        grow with the density of the z-matrix
+
+    Returns
+    -------
+    avec : (N,) ndarray
+        The canonical form (see :func:`canonicalize`) of the estimate
+
+    """
+    import scipy.sparse
+    assignments = _assignment_matrix(assignments)
+    validator.validate_positive(chunksize, param_name='chunksize')
+    if zmat is None:
+        zmat = zmatrix(assignments, sparse=True)
+    zmat = scipy.sparse.coo_matrix(zmat)
+    nsamples, n = assignments.shape
+    if zmat.shape != (n, n):
+        raise ValueError("zmat does not match assignments")
+
+    # || delta - zmat ||^2 = sum(delta) - 2 <delta, zmat> + sum(zmat^2),
+    # where delta is the co-clustering matrix of a single avec. the last
+    # term is the same for every avec, so we drop it
+    losses = np.empty(nsamples)
+    for beg in xrange(0, nsamples, chunksize):
+        chunk = assignments[beg:beg + chunksize]
+        keys, span = _sample_keys(chunk)
+        uniq, sizes = np.unique(keys, return_counts=True)
+        sizes = sizes.astype(np.float64)
+        # <delta, zmat>, a block of the non-zeros at a time, so the
+        # temporaries stay bounded however dense zmat is
+        inner = np.zeros(chunk.shape[0])
+        step = max(1, _CONSENSUS_BLOCK_SIZE // chunk.shape[0])
+        for nzbeg in xrange(0, zmat.nnz, step):
+            rows = zmat.row[nzbeg:nzbeg + step]
+            cols = zmat.col[nzbeg:nzbeg + step]
+            same = chunk[:, rows] == chunk[:, cols]
+            inner += np.dot(same, zmat.data[nzbeg:nzbeg + step])
+        losses[beg:beg + chunk.shape[0]] = (
+            np.bincount(uniq // span, weights=sizes * sizes,
+                        minlength=chunk.shape[0]) -
+            2. * inner)
+    return canonicalize(assignments[np.argmin(losses)])
 
 
 def _is_square_ndarray(n):
@@ -119,8 +516,96 @@ def zmatrix_heuristic_block_ordering(zmat):
     if not _is_square_ndarray(zmat):
         raise ValueError("not a zmat")
 
+    import scipy.cluster.hierarchy
     n = zmat.shape[0]
     zmat = np.array(zmat[np.triu_indices(n, k=1)])
     zmat = 1. - zmat
     l = scipy.cluster.hierarchy.linkage(zmat)
     return np.array(scipy.cluster.hierarchy.leaves_list(l))
+
+
+def zmatrix_block_ordering(zmat, threshold=0.5, return_blocks=False):
+    """Generate a block-diagonal ordering of the axes of `zmat` in time
+    roughly linear in the number of non-zero entries of `zmat`.
+
+    Unlike :func:`zmatrix_heuristic_block_ordering`, this does not perform a
+    hierarchical clustering; instead, the consensus clustering is taken to be
+    the connected components of the graph which links entities co-clustered
+    with probability at least `threshold`. Blocks are ordered by descending
+    size, and the entities within each block by descending total
+    co-clustering probability with the rest of their block.
+
+    Parameters
+    ----------
+    zmat : (N, N) ndarray or ``scipy.sparse`` matrix
+    threshold : float, default 0.5
+    return_blocks : bool, default False
+        Whether or not to also return the block boundaries
+
+    Returns
+    -------
+    order : (N,) ndarray
+        A permutation on :math:`[N]`
+    blocks : (B+1,) ndarray
+        Only returned if `return_blocks` is True. The b-th block consists of
+        the entities ``order[blocks[b]:blocks[b+1]]``.
+
+    """
+    if not _is_square_ndarray(zmat):
+        raise ValueError("not a zmat")
+
+    import scipy.sparse
+    import scipy.sparse.csgraph
+    n = zmat.shape[0]
+    zmat = scipy.sparse.coo_matrix(zmat)
+    linked = zmat.data >= threshold
+    adj = scipy.sparse.coo_matrix(
+        (zmat.data[linked], (zmat.row[linked], zmat.col[linked])),
+        shape=(n, n))
+    nblocks, labels = scipy.sparse.csgraph.connected_components(
+        adj, directed=False)
+
+    same = labels[zmat.row] == labels[zmat.col]
+    cohesion = np.bincount(
+        zmat.row[same], weights=zmat.data[same], minlength=n)
+    sizes = np.bincount(labels, minlength=nblocks)
+
+    # np.lexsort() is stable, so ties are broken by the original index
+    block_order = np.lexsort((-sizes,))
+    block_rank = np.empty(nblocks, dtype=np.int64)
+    block_rank[block_order] = np.arange(nblocks)
+    order = np.lexsort((-cohesion, block_rank[labels]))
+
+    if not return_blocks:
+        return order
+    blocks = np.zeros(nblocks + 1, dtype=np.int64)
+    np.cumsum(sizes[block_order], out=blocks[1:])
+    return order, blocks
+
+
+def assignments_block_ordering(assignments,
+                               threshold=0.5,
+                               return_blocks=False,
+                               chunksize=None):
+    """Generate a block-diagonal ordering directly from assignment vectors,
+    without ever materializing a dense z-matrix.
+
+    Parameters
+    ----------
+    assignments : (S, N) array-like of integer group ids
+    threshold : float, default 0.5
+    return_blocks : bool, default False
+    chunksize : int, optional
+        See :func:`zmatrix`
+
+    Returns
+    -------
+    See :func:`zmatrix_block_ordering`
+
+    """
+    zmat = zmatrix(assignments,
+                   sparse=True,
+                   threshold=threshold,
+                   chunksize=chunksize)
+    return zmatrix_block_ordering(
+        zmat, threshold=threshold, return_blocks=return_blocks)
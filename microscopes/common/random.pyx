@@ -1,86 +1,152 @@
 # cython: embedsignature=True
 
 
-from libcpp.utility cimport pair
 from microscopes.common._random_h cimport \
     sample_multivariate_normal as c_sample_multivariate_normal, \
     sample_wishart as c_sample_wishart, \
     sample_inverse_wishart as c_sample_inverse_wishart, \
     sample_normal_inverse_wishart as c_sample_normal_inverse_wishart
 from microscopes.common._rng cimport rng
-from microscopes.common._util_h cimport \
-    set as c_eigen_matf_set, \
-    get as c_eigen_matf_get
-from microscopes._eigen_h cimport VectorXf, MatrixXf
+from microscopes.common import validator
 
 cimport numpy as np
 
-from distributions.dbg.random import sample_discrete, sample_discrete_log
 import numpy as np
 
 
-cdef VectorXf to_eigen_vecf(x):
-    assert len(x.shape) == 1
-    cdef VectorXf v = VectorXf(x.shape[0])
-    for i, e in enumerate(x):
-        v[i] = float(e)
-    return v
+# re-exported from distributions.dbg.random, which is imported on first use
+# since it is slow to import
 
+def sample_discrete(*args, **kwargs):
+    from distributions.dbg.random import sample_discrete as impl
+    return impl(*args, **kwargs)
 
-cdef MatrixXf to_eigen_matf(x):
-    assert len(x.shape) == 2
-    cdef MatrixXf m = MatrixXf(x.shape[0], x.shape[1])
-    for i, a in enumerate(x):
-        for j, b in enumerate(a):
-            c_eigen_matf_set(m, i, j, b)
-    return m
 
+def sample_discrete_log(*args, **kwargs):
+    from distributions.dbg.random import sample_discrete_log as impl
+    return impl(*args, **kwargs)
 
-cdef np.ndarray to_np_1darray(const VectorXf &x):
-    cdef np.ndarray v = np.zeros(x.size())
-    for i in xrange(x.size()):
-        v[i] = x[i]
-    return v
 
+# the C++ samplers read and write numpy buffers in place (see random.hpp),
+# so arrays only need to be converted to contiguous float32 ones, which is a
+# no-op for arrays that already are. the samples are returned as float64
 
-cdef np.ndarray to_np_2darray(const MatrixXf &x):
-    cdef np.ndarray m = np.zeros((x.rows(), x.cols()))
-    for i in xrange(x.rows()):
-        for j in xrange(x.cols()):
-            m[i, j] = c_eigen_matf_get(x, i, j)
-    return m
 
+cdef np.ndarray _as_vecf(x, name):
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    if x.ndim != 1:
+        raise ValueError("{} must be a vector".format(name))
+    return x
 
-def sample_multivariate_normal(np.ndarray mu, np.ndarray cov, rng r):
-    cdef VectorXf sample = c_sample_multivariate_normal(
-        to_eigen_vecf(mu),
-        to_eigen_matf(cov),
+
+cdef np.ndarray _as_square_matf(x, size_t dim, name):
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    if x.shape != (dim, dim):
+        raise ValueError("{} must be {}x{}".format(name, dim, dim))
+    return x
+
+
+def sample_multivariate_normal(mu, cov, rng r, size=None):
+    """Sample from N(mu, cov)
+
+    Parameters
+    ----------
+    mu : (D,) array
+    cov : (D, D) symmetric positive definite array
+    r : rng
+    size : int, optional
+        The number of draws, which share a single Cholesky factorization of
+        `cov`
+
+    Returns
+    -------
+    sample : (D,) array, or (size, D) if `size` is given
+
+    """
+    cdef np.ndarray c_mu = _as_vecf(mu, "mu")
+    cdef size_t dim = c_mu.shape[0]
+    cdef np.ndarray c_cov = _as_square_matf(cov, dim, "cov")
+    if size is not None:
+        validator.validate_positive(size, "size")
+    cdef size_t n = 1 if size is None else size
+    cdef np.ndarray out = np.empty((n, dim), dtype=np.float32)
+    c_sample_multivariate_normal(
+        <const float *> c_mu.data,
+        <const float *> c_cov.data,
+        dim,
+        n,
+        <float *> out.data,
         r._thisptr[0])
-    return to_np_1darray(sample)
+    out = out.astype(np.float64)
+    return out[0] if size is None else out
 
 
-def sample_wishart(float nu, np.ndarray scale, rng r):
-    cdef MatrixXf sample = c_sample_wishart(
-        nu,
-        to_eigen_matf(scale),
+def sample_wishart(float nu, scale, rng r):
+    cdef np.ndarray c_scale = _as_square_matf(scale, len(scale), "scale")
+    cdef size_t dim = c_scale.shape[0]
+    cdef np.ndarray out = np.empty((dim, dim), dtype=np.float32)
+    c_sample_wishart(
+        nu, <const float *> c_scale.data, dim, <float *> out.data,
         r._thisptr[0])
-    return to_np_2darray(sample)
+    return out.astype(np.float64)
 
 
-def sample_inverse_wishart(float nu, np.ndarray scale, rng r):
-    cdef MatrixXf sample = c_sample_inverse_wishart(
-        nu,
-        to_eigen_matf(scale),
+def sample_inverse_wishart(float nu, scale, rng r):
+    cdef np.ndarray c_scale = _as_square_matf(scale, len(scale), "scale")
+    cdef size_t dim = c_scale.shape[0]
+    cdef np.ndarray out = np.empty((dim, dim), dtype=np.float32)
+    c_sample_inverse_wishart(
+        nu, <const float *> c_scale.data, dim, <float *> out.data,
         r._thisptr[0])
-    return to_np_2darray(sample)
+    return out.astype(np.float64)
 
 
 def sample_normal_inverse_wishart(
-        np.ndarray mu0, float lam, np.ndarray psi, float nu, rng r):
-    cdef pair[VectorXf, MatrixXf] sample = c_sample_normal_inverse_wishart(
-        to_eigen_vecf(mu0),
+        mu0, float lam, psi, float nu, rng r, return_chol=False):
+    """Sample cov ~ IW(nu, psi)/lam, then mu ~ N(mu0, cov)
+
+    The covariance is sampled through its Cholesky factor (see random.hpp),
+    so nothing is inverted.
+
+    Parameters
+    ----------
+    mu0 : (D,) array
+    lam : float
+    psi : (D, D) symmetric positive definite array
+    nu : float
+    r : rng
+    return_chol : bool, optional
+        Whether to also return the (lower) Cholesky factor of cov, for
+        scoring or sampling from N(mu, cov) without factoring cov again
+
+    Returns
+    -------
+    mu : (D,) array
+    cov : (D, D) array
+    chol : (D, D) array
+        Only returned if `return_chol` is True
+
+    """
+    cdef np.ndarray c_mu0 = _as_vecf(mu0, "mu0")
+    cdef size_t dim = c_mu0.shape[0]
+    cdef np.ndarray c_psi = _as_square_matf(psi, dim, "psi")
+    cdef np.ndarray out_mu = np.empty(dim, dtype=np.float32)
+    cdef np.ndarray out_cov = np.empty((dim, dim), dtype=np.float32)
+    cdef np.ndarray out_chol = None
+    if return_chol:
+        out_chol = np.empty((dim, dim), dtype=np.float32)
+    c_sample_normal_inverse_wishart(
+        <const float *> c_mu0.data,
         lam,
-        to_eigen_matf(psi),
+        <const float *> c_psi.data,
         nu,
+        dim,
+        <float *> out_mu.data,
+        <float *> out_cov.data,
+        <float *> out_chol.data if out_chol is not None else NULL,
         r._thisptr[0])
-    return to_np_1darray(sample.first), to_np_2darray(sample.second)
+    if not return_chol:
+        return out_mu.astype(np.float64), out_cov.astype(np.float64)
+    return (out_mu.astype(np.float64),
+            out_cov.astype(np.float64),
+            out_chol.astype(np.float64))
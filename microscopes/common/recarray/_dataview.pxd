@@ -19,9 +19,12 @@ cimport numpy as np
 
 cdef class abstract_dataview:
     cdef shared_ptr[dataview] _thisptr
+    cdef bytes _cached_digest  # set by digest()
+    cdef object _dtype  # cached by _get_np_dtype()
+    cdef bint _copy_rows(self, size_t, size_t, np.ndarray, np.ndarray) except *
 
 
 cdef class numpy_dataview(abstract_dataview):
     cdef readonly int _n
     cdef readonly np.ndarray _data
-    cdef readonly np.ndarray _mask
+    cdef readonly np.ndarray _maskbits  # np.packbits() of the mask
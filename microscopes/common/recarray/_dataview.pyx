@@ -1,9 +1,10 @@
 # cython: embedsignature=True
 
 
+import hashlib
 import numpy as np
 import numpy.ma as ma
-from microscopes.common import validator
+from microscopes.common import digest, validator
 
 
 cdef class abstract_dataview:
@@ -16,12 +17,15 @@ cdef class abstract_dataview:
             raise StopIteration
         cdef row_accessor acc = self._thisptr.get().get()
         cdef const vector[runtime_type] *types = &self._thisptr.get().types()
-        dtypes = []
-        for i in xrange(types.size()):
-            dtypes.append(('', get_np_type(types[0][i])))
-        cdef np.ndarray array = np.zeros(1, dtype=dtypes)
+        cdef np.ndarray array = np.zeros(1, dtype=self._get_np_dtype())
         self._thisptr.get().next()
         cdef row_mutator mut = row_mutator(<uint8_t *> array.data, types)
+        if acc.clean():
+            for i in xrange(types.size()):
+                mut.set(acc)
+                mut.bump()
+                acc.bump()
+            return array[0]
         masks = []
         has_any_masks = [False]
 
@@ -44,6 +48,53 @@ cdef class abstract_dataview:
         masks = tuple(masks)  # this seems to matter
         return ma.array(array, mask=[masks])[0]
 
+    def _get_np_dtype(self):
+        cdef const vector[runtime_type] *types = &self._thisptr.get().types()
+        if self._dtype is None:
+            self._dtype = np.dtype([
+                ('', get_np_type(types[0][i])) for i in xrange(types.size())])
+        return self._dtype
+
+    def _has_mask(self):
+        return False
+
+    cdef bint _copy_rows(self, size_t begin, size_t n,
+                         np.ndarray data, np.ndarray mask) except *:
+        return self._thisptr.get().copy_rows(
+            begin, n,
+            <uint8_t *> data.data,
+            <cbool *> mask.data if mask is not None else NULL)
+
+    def iter_batches(self, batch_size):
+        """Iterate over the rows `batch_size` at a time.
+
+        Rows are visited in the same order as iterating over the dataview
+        (so respecting `permute()`), and each batch is copied out in a single
+        pass. Batches are structured arrays with the same fields as the rows
+        returned by iteration, and are masked arrays if (and only if) any
+        of their values are masked.
+
+        Parameters
+        ----------
+        batch_size : int
+            The last batch may be smaller
+
+        """
+        validator.validate_positive(batch_size, "batch_size")
+        dtype = self._get_np_dtype()
+        mask_dtype = ma.make_mask_descr(dtype) if self._has_mask() else None
+        n = self._thisptr.get().size()
+        for begin in xrange(0, n, batch_size):
+            count = min(batch_size, n - begin)
+            data = np.empty(count, dtype=dtype)
+            mask = None
+            if mask_dtype is not None:
+                mask = np.empty(count, dtype=mask_dtype)
+            if self._copy_rows(begin, count, data, mask):
+                yield ma.array(data, mask=mask)
+            else:
+                yield data
+
     def digest(self, h):
 
         # two different object types should not collide
@@ -51,14 +102,20 @@ cdef class abstract_dataview:
         fqn = typ.__module__ + '.' + typ.__name__
         h.update(fqn)
 
-        # implementations now fill out the details
-        self._digest(h)
+        # implementations now fill out the details. the (potentially
+        # expensive) digest of the data is computed once and cached, so the
+        # data must not be modified in place afterwards
+        if self._cached_digest is None:
+            inner = hashlib.sha1()
+            self._digest(inner)
+            self._cached_digest = inner.digest()
+        h.update(self._cached_digest)
 
         return h
 
 
 cdef class numpy_dataview(abstract_dataview):
-    def __cinit__(self, npd):
+    def __cinit__(self, npd, maskbits=None):
         validator.validate_not_none(npd, "npd")
         if len(npd.shape) != 1:
             raise ValueError("1D (structural) arrays only")
@@ -69,21 +126,41 @@ cdef class numpy_dataview(abstract_dataview):
             # checking for this
             raise ValueError("structural arrays only")
 
+        # the C++ dataview reads the mask as a packed bitmap, one bit per
+        # value (see bitmap.hpp)
+        mask = getattr(npd, 'mask', ma.nomask)
+        if maskbits is not None:
+            if mask is not ma.nomask:
+                raise ValueError("cannot give both a mask and maskbits")
+            nbits = self._n * ma.make_mask_descr(dtype).itemsize
+            maskbits = np.ascontiguousarray(maskbits, dtype=np.uint8)
+            if maskbits.shape != ((nbits + 7) // 8,):
+                raise ValueError(
+                    "expected {} bytes of maskbits".format((nbits + 7) // 8))
+            self._maskbits = maskbits
+        elif mask is not ma.nomask:
+            self._maskbits = np.packbits(
+                np.ascontiguousarray(mask).view(np.bool_))
+            if not self._maskbits.any():
+                # an all-False mask (which numpy makes for structured
+                # arrays) reads the same as no mask, minus the mask tests
+                self._maskbits = None
+        else:
+            self._maskbits = None
+
         if hasattr(npd, 'mask'):
             self._data = np.ascontiguousarray(npd.data)
-            self._mask = np.ascontiguousarray(npd.mask)
         else:
             self._data = np.ascontiguousarray(npd)
-            self._mask = None
 
         cdef vector[runtime_type] ctypes = get_c_types(dtype)
 
-        if self._mask is not None:
+        if self._maskbits is not None:
             self._thisptr.reset(new row_major_dataview(
                 <uint8_t *> self._data.data,
-                <cbool *> self._mask.data,
                 self._n,
-                ctypes))
+                ctypes,
+                <uint8_t *> self._maskbits.data))
         else:
             self._thisptr.reset(new row_major_dataview(
                 <uint8_t *> self._data.data,
@@ -91,6 +168,26 @@ cdef class numpy_dataview(abstract_dataview):
                 self._n,
                 ctypes))
 
+    property _mask:
+        """The mask, unpacked, or None"""
+        def __get__(self):
+            if self._maskbits is None:
+                return None
+            mask_dtype = ma.make_mask_descr(self._data.dtype)
+            nbits = self._n * mask_dtype.itemsize
+            return np.unpackbits(self._maskbits)[:nbits].view(
+                np.bool_).view(mask_dtype)
+
+    def _has_mask(self):
+        return self._maskbits is not None
+
+    def permute(self, rng r):
+        """Randomly permute the iteration order (including `iter_batches()`)"""
+        (<row_major_dataview *> self._thisptr.get()).permute(r._thisptr[0])
+
+    def reset_permutation(self):
+        (<row_major_dataview *> self._thisptr.get()).reset_permutation()
+
     def size(self):
         return self._n
 
@@ -98,15 +195,16 @@ cdef class numpy_dataview(abstract_dataview):
         return self.size()
 
     def _digest(self, h):
-        if self._mask is not None:
-            # XXX(stephentu): implement me
-            raise NotImplementedError(
-                "masked arrays digest not implemented")
-
         # use the str repr for dtype
         h.update(str(self._data.dtype))
 
-        # now take a memory view of the data (since we already know it is
-        # contiguous in row-major order, we don't have to worry about column
-        # major arrays)
-        h.update(self._data.view(np.uint8))
+        if self._maskbits is None:
+            chunks = digest.array_chunks(self._data)
+        else:
+            # masked values are hashed as zeros, and the mask itself is
+            # hashed after the data
+            chunks = digest.array_chunks(
+                self._data, self._maskbits,
+                digest.value_of_byte(self._data.dtype))
+            chunks += digest.array_chunks(self._maskbits)
+        h.update(digest.tree_digest(chunks))
@@ -4,12 +4,14 @@ from libc.stdint cimport uint8_t
 from libc.stddef cimport size_t
 
 from microscopes.common._runtime_type_h cimport runtime_type
+from microscopes.common._random_fwd_h cimport rng_t
 
 cdef extern from "microscopes/common/recarray/dataview.hpp" namespace "microscopes::common::recarray":
     cdef cppclass row_accessor:
         row_accessor()
         row_accessor(uint8_t *, cbool *, vector[runtime_type] *)
         cbool ismasked(size_t)
+        cbool clean()
         const runtime_type & curtype()
         unsigned curshape()
         void bump()
@@ -26,6 +28,11 @@ cdef extern from "microscopes/common/recarray/dataview.hpp" namespace "microscop
         void next()
         void reset()
         cbool end()
+        size_t size()
+        cbool copy_rows(size_t, size_t, uint8_t *, cbool *) except +
 
     cdef cppclass row_major_dataview(dataview):
         row_major_dataview(uint8_t *, cbool *, size_t, vector[runtime_type] &) except +
+        row_major_dataview(uint8_t *, size_t, vector[runtime_type] &, uint8_t *) except +
+        void permute(rng_t &)
+        void reset_permutation()
@@ -15,19 +15,24 @@ import numpy.ma as ma
 
 
 class numpy_dataview(_numpy_dataview):
-    """numpy_dataview(npd)
+    """numpy_dataview(npd, maskbits=None)
 
     A dataview around a numpy recarray. Supports masked arrays.
 
     Parameters
     ----------
     npd : array
+    maskbits : array of uint8, optional
+        The mask of an unmasked `npd`, packed with ``np.packbits()``, one bit
+        per value. Masks are kept packed in any case; this just avoids
+        building, and then packing, a masked array.
 
 
     """
 
     def __reduce__(self):
-        return (_reconstruct_numpy_dataview, (self._data, self._mask,))
+        return (_reconstruct_numpy_dataview_packed,
+                (self._data, self._maskbits,))
 
 
 def _reconstruct_numpy_dataview(data, mask):
@@ -35,3 +40,7 @@ def _reconstruct_numpy_dataview(data, mask):
         return numpy_dataview(data)
     else:
         return numpy_dataview(ma.array(data, mask=mask))
+
+
+def _reconstruct_numpy_dataview_packed(data, maskbits):
+    return numpy_dataview(data, maskbits=maskbits)
@@ -1,12 +1,16 @@
 from libcpp.vector cimport vector
 from libcpp cimport bool as cbool
-from libc.stdint cimport uint8_t, uint32_t
+from libc.stdint cimport uint8_t, uint32_t, uint64_t
 
 from microscopes._shared_ptr_h cimport shared_ptr
 from microscopes.common.relation._dataview_h cimport (
     dataview,
     row_major_dense_dataview,
-    compressed_2darray,
+    compressed_2darray_t,
+    build_csc_index,
+    sparse_nd_indptr_size,
+    build_sparse_nd_index,
+    sparse_ndarray,
 )
 from microscopes.common._dataview cimport get_c_type
 from microscopes.common._runtime_type_h cimport runtime_type
@@ -15,18 +19,26 @@ cimport numpy as np
 
 cdef class abstract_dataview:
     cdef shared_ptr[dataview] _thisptr
+    cdef bytes _cached_digest  # set by digest()
 
 cdef class numpy_dataview(abstract_dataview):
-    cdef np.ndarray _data
-    cdef np.ndarray _mask
+    cdef readonly np.ndarray _data
+    cdef readonly np.ndarray _maskbits  # np.packbits() of the mask
     cdef tuple _shape
 
 cdef class sparse_2d_dataview(abstract_dataview):
     cdef np.ndarray _csr_data
     cdef np.ndarray _csr_indices
     cdef np.ndarray _csr_indptr
-    cdef np.ndarray _csc_data
     cdef np.ndarray _csc_indices
     cdef np.ndarray _csc_indptr
+    cdef np.ndarray _csc_perm
     cdef int _rows
     cdef int _cols
+
+cdef class sparse_nd_dataview(abstract_dataview):
+    cdef np.ndarray _indices
+    cdef np.ndarray _data
+    cdef np.ndarray _order
+    cdef np.ndarray _indptr
+    cdef tuple _shape
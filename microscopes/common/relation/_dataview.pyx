@@ -1,13 +1,14 @@
 # cython: embedsignature=True
 
 
+import hashlib
 import numpy as np
 import numpy.ma as ma
 from scipy.sparse import (
     csr_matrix,
     csc_matrix,
 )
-from microscopes.common import validator
+from microscopes.common import digest, validator
 
 
 cdef class abstract_dataview:
@@ -19,15 +20,21 @@ cdef class abstract_dataview:
         fqn = typ.__module__ + '.' + typ.__name__
         h.update(fqn)
 
-        # implementations now fill out the details
-        self._digest(h)
+        # implementations now fill out the details. the (potentially
+        # expensive) digest of the data is computed once and cached, so the
+        # data must not be modified in place afterwards
+        if self._cached_digest is None:
+            inner = hashlib.sha1()
+            self._digest(inner)
+            self._cached_digest = inner.digest()
+        h.update(self._cached_digest)
 
         return h
 
 
 cdef class numpy_dataview(abstract_dataview):
 
-    def __cinit__(self, npd):
+    def __cinit__(self, npd, maskbits=None):
         validator.validate_not_none(npd, "npd")
         if len(npd.shape) <= 1:
             raise ValueError("dim must be >= 2")
@@ -38,23 +45,61 @@ cdef class numpy_dataview(abstract_dataview):
         for d in npd.shape:
             cshape.push_back(d)
         cdef runtime_type ctype = get_c_type(npd.dtype)
+
+        # the C++ dataview reads the mask as a packed bitmap, one bit per
+        # entry (see bitmap.hpp)
+        mask = getattr(npd, 'mask', ma.nomask)
+        if maskbits is not None:
+            if mask is not ma.nomask:
+                raise ValueError("cannot give both a mask and maskbits")
+            nbytes = (int(np.prod(npd.shape)) + 7) // 8
+            maskbits = np.ascontiguousarray(maskbits, dtype=np.uint8)
+            if maskbits.shape != (nbytes,):
+                raise ValueError(
+                    "expected {} bytes of maskbits".format(nbytes))
+            self._maskbits = maskbits
+        elif mask is not ma.nomask:
+            self._maskbits = np.packbits(
+                np.ascontiguousarray(mask, dtype=np.bool_))
+            if not self._maskbits.any():
+                # an all-False mask (which numpy makes for structured
+                # arrays) reads the same as no mask, minus the mask tests
+                self._maskbits = None
+        else:
+            self._maskbits = None
+
         if hasattr(npd, 'mask'):
             self._data = np.ascontiguousarray(npd.data)
-            self._mask = np.ascontiguousarray(npd.mask)
         else:
             self._data = np.ascontiguousarray(npd)
-            self._mask = None
-        self._thisptr.reset(new row_major_dense_dataview(
-            <uint8_t *> self._data.data,
-            <cbool *> self._mask.data if self._mask is not None else NULL,
-            cshape,
-            ctype))
+
+        if self._maskbits is not None:
+            self._thisptr.reset(new row_major_dense_dataview(
+                <uint8_t *> self._data.data,
+                cshape,
+                ctype,
+                <uint8_t *> self._maskbits.data))
+        else:
+            self._thisptr.reset(new row_major_dense_dataview(
+                <uint8_t *> self._data.data,
+                NULL,
+                cshape,
+                ctype))
+
+    property _mask:
+        """The mask, unpacked, or None"""
+        def __get__(self):
+            if self._maskbits is None:
+                return None
+            n = int(np.prod(self._shape))
+            return np.unpackbits(self._maskbits)[:n].view(
+                np.bool_).reshape(self._shape)
 
     def shape(self):
         return self._shape
 
     def toarray(self):
-        if self._mask is None:
+        if self._maskbits is None:
             return self._data
         else:
             return ma.array(self._data, mask=self._mask)
@@ -62,76 +107,164 @@ cdef class numpy_dataview(abstract_dataview):
     def _digest(self, h):
         # use the str repr for dtype
         h.update(str(self._data.dtype))
+        h.update(str(self.shape()))
 
-        if self._mask is None:
-            # fast implementation
-            h.update(self._data.view(np.uint8))
+        data = self._data.reshape(-1)
+        if self._maskbits is None:
+            chunks = digest.array_chunks(data)
         else:
-            h.update(self._mask.view(np.uint8))
+            # masked values are hashed as zeros (without touching the data,
+            # which may be read-only), and the mask itself after the data
+            chunks = digest.array_chunks(
+                data, self._maskbits, digest.value_of_byte(data.dtype))
+            chunks += digest.array_chunks(self._maskbits)
+        h.update(digest.tree_digest(chunks))
 
-            # slow implementation-- we have to ensure the masked values have
-            # the same value
-            data, mask = np.ravel(self._data), np.ravel(self._mask)
-            data[mask] = 0  # XXX(stephentu): what if zero is not valid
 
-            h.update(data.view(np.uint8))
+def _as_index(a, itype):
+    # a contiguous itype array, reinterpreting (rather than copying) the
+    # signed indices scipy uses
+    a = np.ascontiguousarray(a)
+    if a.dtype.itemsize * 8 == np.iinfo(itype).bits:
+        return a.view(itype)
+    return a.astype(itype)
 
 
 cdef class sparse_2d_dataview(abstract_dataview):
 
-    def __cinit__(self, rep):
+    def __cinit__(self, rep, explicit_zeros=False, csc_index=None):
         self._rows, self._cols = rep.shape
         validator.validate_positive(self._rows)
         validator.validate_positive(self._cols)
 
+        # tocsr() is a no-op on a csr_matrix, so in the common case we share
+        # the caller's arrays rather than copying them. we copy only when we
+        # have to modify the representation
         csr_rep = rep.tocsr()
-        csc_rep = rep.tocsc()
+        if not csr_rep.has_canonical_format:
+            csr_rep = csr_rep.copy()
+            csr_rep.sum_duplicates()
+        if not explicit_zeros and not csr_rep.data.all():
+            csr_rep = csr_rep.copy()
+            csr_rep.eliminate_zeros()
 
-        if csr_rep.data.dtype != csc_rep.data.dtype:
-            raise RuntimeError("dtypes don't match")
         cdef runtime_type ctype = get_c_type(csr_rep.data.dtype)
 
-        def validate_sparse_rep(rep):
-            if rep.indices.dtype != np.dtype('int32'):
-                raise RuntimeError("expected i32 indices")
-            if rep.indptr.dtype != np.dtype('int32'):
-                raise RuntimeError("expected i32 indptr")
-
-        validate_sparse_rep(csr_rep)
-        validate_sparse_rep(csc_rep)
+        # the C++ side reads the indices as unsigned; a view avoids a copy
+        if csr_rep.indices.dtype == np.dtype('int32'):
+            itype = np.uint32
+        elif csr_rep.indices.dtype == np.dtype('int64'):
+            itype = np.uint64
+        else:
+            raise RuntimeError("expected i32 or i64 indices")
+        if csr_rep.indptr.dtype != csr_rep.indices.dtype:
+            raise RuntimeError("indices and indptr types don't match")
 
         # keep the refcounts live
-        self._csr_data, self._csr_indices, self._csr_indptr = (
-            csr_rep.data, csr_rep.indices, csr_rep.indptr
-        )
-        self._csc_data, self._csc_indices, self._csc_indptr = (
-            csc_rep.data, csc_rep.indices, csc_rep.indptr
-        )
-
-        self._thisptr.reset(
-            new compressed_2darray(
-                <const uint8_t *> self._csr_data.data,
-                <const uint32_t *> self._csr_indices.data,
-                <const uint32_t *> self._csr_indptr.data,
-                <const uint8_t *> self._csc_data.data,
-                <const uint32_t *> self._csc_indices.data,
-                <const uint32_t *> self._csc_indptr.data,
-                self._rows,
-                self._cols,
-                ctype))
+        self._csr_data = np.ascontiguousarray(csr_rep.data)
+        self._csr_indices = np.ascontiguousarray(csr_rep.indices).view(itype)
+        self._csr_indptr = np.ascontiguousarray(csr_rep.indptr).view(itype)
+
+        # the CSC side is only an index over the CSR values
+        nnz = self._csr_indptr[self._rows]
+        if csc_index is not None:
+            # a previously built index (see csc_index()), eg from disk
+            if len(csc_index) != 3:
+                raise ValueError("expected (indices, indptr, perm)")
+            indices, indptr, perm = [
+                _as_index(a, itype) for a in csc_index]
+            if (indices.shape != (nnz,) or
+                    indptr.shape != (self._cols + 1,) or
+                    perm.shape != (nnz,)):
+                raise ValueError("csc_index does not match rep")
+            self._csc_indices, self._csc_indptr, self._csc_perm = (
+                indices, indptr, perm)
+        else:
+            self._csc_indices = np.empty(nnz, dtype=itype)
+            self._csc_indptr = np.empty(self._cols + 1, dtype=itype)
+            self._csc_perm = np.empty(nnz, dtype=itype)
+
+        if itype is np.uint32:
+            if csc_index is None:
+                build_csc_index[uint32_t](
+                    self._rows,
+                    self._cols,
+                    <const uint32_t *> self._csr_indices.data,
+                    <const uint32_t *> self._csr_indptr.data,
+                    <uint32_t *> self._csc_indices.data,
+                    <uint32_t *> self._csc_indptr.data,
+                    <uint32_t *> self._csc_perm.data)
+            self._thisptr.reset(
+                new compressed_2darray_t[uint32_t](
+                    <const uint8_t *> self._csr_data.data,
+                    <const uint32_t *> self._csr_indices.data,
+                    <const uint32_t *> self._csr_indptr.data,
+                    <const uint32_t *> self._csc_indices.data,
+                    <const uint32_t *> self._csc_indptr.data,
+                    <const uint32_t *> self._csc_perm.data,
+                    self._rows,
+                    self._cols,
+                    ctype))
+        else:
+            if csc_index is None:
+                build_csc_index[uint64_t](
+                    self._rows,
+                    self._cols,
+                    <const uint64_t *> self._csr_indices.data,
+                    <const uint64_t *> self._csr_indptr.data,
+                    <uint64_t *> self._csc_indices.data,
+                    <uint64_t *> self._csc_indptr.data,
+                    <uint64_t *> self._csc_perm.data)
+            self._thisptr.reset(
+                new compressed_2darray_t[uint64_t](
+                    <const uint8_t *> self._csr_data.data,
+                    <const uint64_t *> self._csr_indices.data,
+                    <const uint64_t *> self._csr_indptr.data,
+                    <const uint64_t *> self._csc_indices.data,
+                    <const uint64_t *> self._csc_indptr.data,
+                    <const uint64_t *> self._csc_perm.data,
+                    self._rows,
+                    self._cols,
+                    ctype))
 
     def shape(self):
         return (self._rows, self._cols)
 
+    def nnz(self):
+        return self._csr_data.shape[0]
+
+    def _index_dtype(self):
+        # scipy wants signed indices
+        return np.int32 if self._csr_indices.dtype == np.uint32 else np.int64
+
     def tocsr(self):
-        return csr_matrix(
-            (self._csr_data, self._csr_indices, self._csr_indptr),
-            shape=self.shape())
+        """The CSR representation, sharing the arrays of the view and with
+        its index dtype
+        """
+        # csr_matrix((data, indices, indptr)) would downcast (copying) int64
+        # indices which fit in int32, so the arrays are attached directly
+        itype = self._index_dtype()
+        rep = csr_matrix(self.shape(), dtype=self._csr_data.dtype)
+        rep.data = self._csr_data
+        rep.indices = self._csr_indices.view(itype)
+        rep.indptr = self._csr_indptr.view(itype)
+        return rep
+
+    def csc_index(self):
+        """The column-major index over the CSR values, as a tuple
+        (indices, indptr, perm): column j holds the CSR entries
+        perm[indptr[j]:indptr[j+1]], at rows indices[indptr[j]:indptr[j+1]]
+        """
+        itype = self._index_dtype()
+        return (self._csc_indices.view(itype),
+                self._csc_indptr.view(itype),
+                self._csc_perm.view(itype))
 
     def tocsc(self):
+        # materializes the column-major values, which are not stored
+        indices, indptr, perm = self.csc_index()
         return csc_matrix(
-            (self._csc_data, self._csc_indices, self._csc_indptr),
-            shape=self.shape())
+            (self._csr_data[perm], indices, indptr), shape=self.shape())
 
     def tocoo(self):
         return self.tocsr().tocoo()
@@ -144,6 +277,117 @@ cdef class sparse_2d_dataview(abstract_dataview):
         h.update(str(self.shape()))
 
         # digest the CSR representation
-        h.update(self._csr_data.view(np.uint8))
-        h.update(self._csr_indices.view(np.uint8))
-        h.update(self._csr_indptr.view(np.uint8))
+        h.update(digest.tree_digest(
+            digest.array_chunks(self._csr_data) +
+            digest.array_chunks(self._csr_indices) +
+            digest.array_chunks(self._csr_indptr)))
+
+
+cdef class sparse_nd_dataview(abstract_dataview):
+
+    def __cinit__(self, indices, data, shape, index=None, validate=True):
+        validator.validate_not_none(indices, "indices")
+        validator.validate_not_none(data, "data")
+        shape = tuple(int(s) for s in shape)
+        validator.validate_nonempty(shape, "shape")
+        for s in shape:
+            validator.validate_positive(s, "shape")
+        if max(shape) > np.iinfo(np.uint32).max:
+            raise ValueError("dimensions must fit in uint32")
+        self._shape = shape
+
+        indices = np.asarray(indices)
+        data = np.asarray(data)
+        if indices.ndim != 2 or indices.shape[0] != len(shape):
+            raise ValueError(
+                "indices must have shape (ndim, nnz), with ndim={}".format(
+                    len(shape)))
+        if indices.shape[1] and not np.issubdtype(indices.dtype, np.integer):
+            raise ValueError("indices must be integers")
+        if data.ndim != 1 or data.shape[0] != indices.shape[1]:
+            raise ValueError("expected one value per position")
+        cdef runtime_type ctype = get_c_type(data.dtype)
+
+        if validate and indices.shape[1]:
+            if (indices < 0).any() or \
+               (indices >= np.array(shape)[:, np.newaxis]).any():
+                raise ValueError("index out of bounds")
+            flat = np.ravel_multi_index(tuple(indices), shape)
+            if np.unique(flat).shape[0] != flat.shape[0]:
+                raise ValueError("duplicate positions")
+
+        # entry k's position is stored contiguously at _indices[k]; an
+        # entry-major array passed in transposed is not copied
+        self._indices = np.ascontiguousarray(indices.T, dtype=np.uint32)
+        self._data = np.ascontiguousarray(data)
+
+        cdef vector[size_t] cshape
+        for s in shape:
+            cshape.push_back(s)
+        cdef size_t nnz = self._data.shape[0]
+        cdef size_t indptr_size = sparse_nd_indptr_size(cshape)
+        if index is not None:
+            # a previously built index (see slice_index()), eg from disk
+            if len(index) != 2:
+                raise ValueError("expected (order, indptr)")
+            order, indptr = [
+                np.ascontiguousarray(a, dtype=np.uint32) for a in index]
+            if (order.shape != (len(shape), nnz) or
+                    indptr.shape != (indptr_size,)):
+                raise ValueError("index does not match indices")
+            self._order, self._indptr = order, indptr
+        else:
+            self._order = np.empty((len(shape), nnz), dtype=np.uint32)
+            self._indptr = np.empty(indptr_size, dtype=np.uint32)
+            build_sparse_nd_index(
+                <const uint32_t *> self._indices.data,
+                nnz,
+                cshape,
+                <uint32_t *> self._order.data,
+                <uint32_t *> self._indptr.data)
+
+        self._thisptr.reset(new sparse_ndarray(
+            <const uint8_t *> self._data.data,
+            <const uint32_t *> self._indices.data,
+            nnz,
+            <const uint32_t *> self._order.data,
+            <const uint32_t *> self._indptr.data,
+            cshape,
+            ctype))
+
+    def shape(self):
+        return self._shape
+
+    def nnz(self):
+        return self._data.shape[0]
+
+    def indices(self):
+        """The positions of the entries, as an (ndim, nnz) array"""
+        return self._indices.T
+
+    def slice_index(self):
+        """The per dimension index over the entries, as a tuple
+        (order, indptr): along dimension d, the entries with coordinate i
+        are order[d, indptr_d[i]:indptr_d[i+1]], where indptr_d is the
+        slice of indptr starting at sum(shape[:d]) + d
+        """
+        return self._order, self._indptr
+
+    def data(self):
+        return self._data
+
+    def toarray(self):
+        """Dense masked array, with the missing entries masked"""
+        data = np.zeros(self._shape, dtype=self._data.dtype)
+        mask = np.ones(self._shape, dtype=np.bool_)
+        positions = tuple(self._indices.T)
+        data[positions] = self._data
+        mask[positions] = False
+        return ma.array(data, mask=mask)
+
+    def _digest(self, h):
+        h.update(str(self._data.dtype))
+        h.update(str(self.shape()))
+        h.update(digest.tree_digest(
+            digest.array_chunks(self._indices) +
+            digest.array_chunks(self._data)))
@@ -1,6 +1,6 @@
 from libcpp.vector cimport vector
 from libcpp cimport bool as cbool
-from libc.stdint cimport uint8_t, uint32_t
+from libc.stdint cimport uint8_t, uint32_t, uint64_t
 from libc.stddef cimport size_t
 
 from microscopes.common._runtime_type_h cimport runtime_type
@@ -11,14 +11,49 @@ cdef extern from "microscopes/common/relation/dataview.hpp" namespace "microscop
 
     cdef cppclass row_major_dense_dataview(dataview):
         row_major_dense_dataview(uint8_t *, cbool *, const vector[size_t] &, const runtime_type &) except +
+        row_major_dense_dataview(uint8_t *, const vector[size_t] &, const runtime_type &, uint8_t *) except +
 
-    cdef cppclass compressed_2darray(dataview):
-        compressed_2darray(const uint8_t *,
-                           const uint32_t *,
-                           const uint32_t *,
-                           const uint8_t *,
-                           const uint32_t *,
-                           const uint32_t *,
-                           size_t,
-                           size_t,
-                           const runtime_type &) except +
+    cdef cppclass compressed_2darray_t[Index](dataview):
+        compressed_2darray_t(const uint8_t *,
+                             const Index *,
+                             const Index *,
+                             const uint8_t *,
+                             const Index *,
+                             const Index *,
+                             size_t,
+                             size_t,
+                             const runtime_type &) except +
+        compressed_2darray_t(const uint8_t *,
+                             const Index *,
+                             const Index *,
+                             const Index *,
+                             const Index *,
+                             const Index *,
+                             size_t,
+                             size_t,
+                             const runtime_type &) except +
+
+    void build_csc_index[Index](size_t,
+                                size_t,
+                                const Index *,
+                                const Index *,
+                                Index *,
+                                Index *,
+                                Index *) except +
+
+    size_t sparse_nd_indptr_size(const vector[size_t] &)
+
+    void build_sparse_nd_index(const uint32_t *,
+                               size_t,
+                               const vector[size_t] &,
+                               uint32_t *,
+                               uint32_t *) except +
+
+    cdef cppclass sparse_ndarray(dataview):
+        sparse_ndarray(const uint8_t *,
+                       const uint32_t *,
+                       size_t,
+                       const uint32_t *,
+                       const uint32_t *,
+                       const vector[size_t] &,
+                       const runtime_type &) except +
@@ -10,17 +10,22 @@ These are the data inputs for the ``irm`` model.
 from microscopes.common.relation._dataview cimport (
     numpy_dataview as _numpy_dataview,
     sparse_2d_dataview as _sparse_2d_dataview,
+    sparse_nd_dataview as _sparse_nd_dataview,
 )
 
 
 class numpy_dataview(_numpy_dataview):
-    """numpy_dataview(npd)
+    """numpy_dataview(npd, maskbits=None)
 
-    A ``numpy.ndarray`` dataview.
+    A ``numpy.ndarray`` dataview. Supports masked arrays.
 
     Parameters
     ----------
     npd : array
+    maskbits : array of uint8, optional
+        The mask of an unmasked `npd`, packed with ``np.packbits()``, one bit
+        per entry in row-major order. Masks are kept packed in any case; this
+        just avoids building, and then packing, a masked array.
 
     Examples
     --------
@@ -32,17 +37,27 @@ class numpy_dataview(_numpy_dataview):
     """
 
     def __reduce__(self):
-        return (_reconstruct_numpy_dataview, (self.toarray(),))
+        return (_reconstruct_numpy_dataview_packed,
+                (self._data, self._maskbits))
 
 
 class sparse_2d_dataview(_sparse_2d_dataview):
-    """sparse_2d_dataview(rep)
+    """sparse_2d_dataview(rep, explicit_zeros=False, csc_index=None)
 
-    A ``scipy.sparse`` dataview
+    A ``scipy.sparse`` dataview. Entries which are not stored are treated as
+    missing data. The values are kept once, in CSR order; a ``csr_matrix``
+    with sorted indices is used without copying.
 
     Parameters
     ----------
     rep : a ``scipy.sparse`` matrix
+        With int32 or int64 indices
+    explicit_zeros : bool, optional
+        If True, explicitly stored zeros are observations. Otherwise (the
+        default) they are treated as missing, like the unstored entries.
+    csc_index : tuple, optional
+        A column-major index previously returned by ``csc_index()`` for the
+        same CSR representation. It is used as is, rather than rebuilt.
 
     Examples
     --------
@@ -54,12 +69,57 @@ class sparse_2d_dataview(_sparse_2d_dataview):
     """
 
     def __reduce__(self):
-        return (_reconstruct_sparse_2d_dataview, (self.tocsr(),))
+        # any zeros still stored were kept on purpose
+        return (_reconstruct_sparse_2d_dataview, (self.tocsr(), True))
+
+
+class sparse_nd_dataview(_sparse_nd_dataview):
+    """sparse_nd_dataview(indices, data, shape, index=None, validate=True)
+
+    A sparse n-dimensional dataview in coordinate format. Positions which
+    are not given are treated as missing data.
+
+    Parameters
+    ----------
+    indices : (ndim, nnz) array of int
+        The position of each entry, in the same layout as the result of
+        ``numpy.nonzero()``. Positions must be unique. The transpose of a
+        C-contiguous uint32 array is used without copying.
+    data : (nnz,) array
+        The value of each entry
+    shape : tuple of int
+    index : tuple, optional
+        A per dimension index previously returned by ``slice_index()`` for
+        the same indices. It is used as is, rather than rebuilt.
+    validate : bool, optional
+        If False, the positions are trusted to be in bounds and unique,
+        e.g. for data this library wrote, and are not checked.
+
+    Examples
+    --------
+    >>> indices = [[0, 1], [2, 0], [5, 3]]
+    >>> view = sparse_nd_dataview(indices, [True, False], (2, 3, 10))
+    >>> print view.shape()
+    (2, 3, 10)
+
+    """
+
+    def __reduce__(self):
+        return (_reconstruct_sparse_nd_dataview,
+                (self.indices(), self.data(), self.shape()))
 
 
 def _reconstruct_numpy_dataview(npd):
     return numpy_dataview(npd)
 
 
-def _reconstruct_sparse_2d_dataview(rep):
-    return sparse_2d_dataview(rep)
+def _reconstruct_numpy_dataview_packed(data, maskbits):
+    return numpy_dataview(data, maskbits=maskbits)
+
+
+def _reconstruct_sparse_2d_dataview(rep, explicit_zeros=False):
+    return sparse_2d_dataview(rep, explicit_zeros)
+
+
+def _reconstruct_sparse_nd_dataview(indices, data, shape):
+    return sparse_nd_dataview(indices, data, shape)
@@ -0,0 +1,163 @@
+"""On-disk dataviews
+
+A saved dataview is a directory holding a ``header.json`` and one ``.npy``
+file per array (data, packed mask bitmap, sparse indexes, ...).
+``open_dataview()`` maps the arrays with ``numpy.load(mmap_mode='r')`` and
+hands them to the dataview without copying them, so the C++ dataview points
+straight at the mapped pages. Several processes opening the same dataset
+then share one page-cached copy of it, and the dataset need not fit in
+memory.
+
+Examples
+--------
+>>> save_dataview('/data/ratings', sparse_2d_dataview(ratings))
+>>> view = open_dataview('/data/ratings')
+
+"""
+
+import numpy as np
+import json
+import os
+
+from scipy.sparse import csr_matrix
+
+from microscopes.common import validator
+from microscopes.common.recarray.dataview import \
+    numpy_dataview as recarray_numpy_dataview
+from microscopes.common.relation.dataview import (
+    numpy_dataview as relation_numpy_dataview,
+    sparse_2d_dataview,
+    sparse_nd_dataview,
+)
+from microscopes.common.variadic.dataview import \
+    numpy_dataview as variadic_numpy_dataview
+
+FORMAT_VERSION = 1
+
+_HEADER = 'header.json'
+
+
+def _open_masked(cls, arrays):
+    if 'maskbits' in arrays:
+        return cls(arrays['data'], maskbits=arrays['maskbits'])
+    return cls(arrays['data'])
+
+
+def _write_array(path, name, arr):
+    np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(arr))
+
+
+def _read_array(path, name):
+    return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+
+def save_dataview(path, view):
+    """Save a dataview to the directory `path`, which is created if needed.
+
+    Parameters
+    ----------
+    path : str
+    view : a recarray, relation or variadic dataview
+
+    """
+    validator.validate_not_none(view, "view")
+    arrays = {}
+    header = {'version': FORMAT_VERSION}
+
+    if isinstance(view, recarray_numpy_dataview):
+        header['kind'] = 'recarray'
+        arrays['data'] = view._data
+        if view._maskbits is not None:
+            arrays['maskbits'] = view._maskbits
+    elif isinstance(view, relation_numpy_dataview):
+        header['kind'] = 'relation_dense'
+        arrays['data'] = view._data
+        if view._maskbits is not None:
+            arrays['maskbits'] = view._maskbits
+    elif isinstance(view, sparse_2d_dataview):
+        header['kind'] = 'relation_sparse_2d'
+        csr = view.tocsr()
+        arrays['data'] = csr.data
+        arrays['indices'] = csr.indices
+        arrays['indptr'] = csr.indptr
+        arrays['csc_indices'], arrays['csc_indptr'], arrays['csc_perm'] = \
+            view.csc_index()
+    elif isinstance(view, sparse_nd_dataview):
+        header['kind'] = 'relation_sparse_nd'
+        arrays['data'] = view.data()
+        # stored entry-major, the layout the dataview keeps internally
+        arrays['indices'] = view.indices().T
+        arrays['order'], arrays['indptr'] = view.slice_index()
+    elif isinstance(view, variadic_numpy_dataview):
+        header['kind'] = 'variadic'
+        arrays['data'] = view.values()
+        arrays['offsets'] = view.offsets()
+    else:
+        raise ValueError(
+            "cannot save dataview of type {}".format(type(view).__name__))
+
+    if hasattr(view, 'shape'):
+        header['shape'] = list(view.shape())
+    header['dtype'] = str(arrays['data'].dtype)
+    header['arrays'] = sorted(arrays.keys())
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name, arr in arrays.items():
+        _write_array(path, name, arr)
+    # the header goes last, so a partially written directory fails to open
+    with open(os.path.join(path, _HEADER), 'w') as fp:
+        json.dump(header, fp, indent=2, sort_keys=True)
+
+
+def open_dataview(path):
+    """Open a dataview previously written by `save_dataview()`.
+
+    The arrays are memory-mapped read-only and are not copied.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    view : a dataview of the same type as the one saved
+
+    """
+    with open(os.path.join(path, _HEADER)) as fp:
+        header = json.load(fp)
+    if header.get('version') != FORMAT_VERSION:
+        raise ValueError(
+            "unsupported dataview format version {}".format(
+                header.get('version')))
+    arrays = dict(
+        (name, _read_array(path, name)) for name in header['arrays'])
+    kind = header['kind']
+
+    if kind == 'recarray':
+        return _open_masked(recarray_numpy_dataview, arrays)
+    elif kind == 'relation_dense':
+        return _open_masked(relation_numpy_dataview, arrays)
+    elif kind == 'relation_sparse_2d':
+        # the saved representation is canonical with no unwanted zeros, so
+        # neither the CSR arrays nor the CSC index need rebuilding. the
+        # arrays are attached to the matrix directly, since csr_matrix()
+        # would copy int64 indices which fit in int32 into memory
+        rep = csr_matrix(tuple(header['shape']), dtype=arrays['data'].dtype)
+        rep.data = arrays['data']
+        rep.indices = arrays['indices']
+        rep.indptr = arrays['indptr']
+        return sparse_2d_dataview(
+            rep,
+            explicit_zeros=True,
+            csc_index=(arrays['csc_indices'],
+                       arrays['csc_indptr'],
+                       arrays['csc_perm']))
+    elif kind == 'relation_sparse_nd':
+        # the positions were checked before the view was saved
+        return sparse_nd_dataview(
+            arrays['indices'].T, arrays['data'], tuple(header['shape']),
+            index=(arrays['order'], arrays['indptr']), validate=False)
+    elif kind == 'variadic':
+        return variadic_numpy_dataview(arrays['data'], arrays['offsets'])
+    raise ValueError("unknown dataview kind {}".format(kind))
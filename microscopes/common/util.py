@@ -89,6 +89,7 @@ def _logsumexp(a, axis=None, b=None):
     >>> np.log(np.sum(b*np.exp(a)))
     9.9170178533034647
     """
+    from numpy import exp, log, asarray, rollaxis, sum
     a = asarray(a)
     if axis is None:
         a = a.ravel()
@@ -108,15 +109,26 @@ def _logsumexp(a, axis=None, b=None):
     return out
 
 
-# This allows us to avoid having a dependency on scipy>=0.10.x,
-# which speeds up travis builds
-try:
-    from scipy.misc import logsumexp
-except ImportError:
-    from numpy import exp, log, asarray, rollaxis, sum
-    logsumexp = _logsumexp
+_logsumexp_impl = None
+
 
-assert logsumexp
+def logsumexp(a, axis=None, b=None):
+    """``np.log(np.sum(np.exp(a)))``, computed stably; see `_logsumexp()`
+
+    scipy's implementation is used if available. It is only looked up on
+    the first call, since importing scipy is slow.
+
+    """
+    global _logsumexp_impl
+    if _logsumexp_impl is None:
+        # This allows us to avoid having a dependency on scipy>=0.10.x,
+        # which speeds up travis builds
+        try:
+            from scipy.misc import logsumexp as impl
+        except ImportError:
+            impl = _logsumexp
+        _logsumexp_impl = impl
+    return _logsumexp_impl(a, axis=axis, b=b)
 
 
 def random_assignment_vector(n):
@@ -1,8 +1,9 @@
 # cython: embedsignature=True
 
 
+import hashlib
 import numpy as np
-from microscopes.common import validator
+from microscopes.common import digest, validator
 
 
 cdef class abstract_dataview:
@@ -14,48 +15,93 @@ cdef class abstract_dataview:
         fqn = typ.__module__ + '.' + typ.__name__
         h.update(fqn)
 
-        # implementations now fill out the details
-        self._digest(h)
+        # implementations now fill out the details. the (potentially
+        # expensive) digest of the data is computed once and cached, so the
+        # data must not be modified in place afterwards
+        if self._cached_digest is None:
+            inner = hashlib.sha1()
+            self._digest(inner)
+            self._cached_digest = inner.digest()
+        h.update(self._cached_digest)
 
         return h
 
 
 cdef class numpy_dataview(abstract_dataview):
-    def __cinit__(self, data):
+    def __cinit__(self, data, offsets=None, dtype=None):
         validator.validate_not_none(data, "data")
-        self._data = list(data)
-        dtype = self._data[0].dtype
-        for i, d in enumerate(self._data):
-            if len(d.shape) != 1:
-                raise ValueError("1-d arrays only")
-            self._data[i] = np.ascontiguousarray(d)
-            if dtype != d.dtype:
-                # XXX: should co-erce to common type
-                raise ValueError("inconsistent types")
-
-        cdef vector[const uint8_t *] pxs
-        cdef vector[unsigned] ns
-        for d in self._data:
-            pxs.push_back(<const uint8_t *> (<np.ndarray>d).data)
-            ns.push_back(len(d))
-
-        cdef runtime_type ctype = get_c_type(dtype)
-
-        self._thisptr.reset(new row_major_dataview(pxs, ns, ctype))
+        if offsets is None:
+            # a list of rows, which we lay out back to back
+            rows = [np.asarray(d) for d in data]
+            validator.validate_nonempty(rows, "data")
+            for d in rows:
+                if len(d.shape) != 1:
+                    raise ValueError("1-d arrays only")
+            if dtype is None:
+                dtype = np.result_type(*rows)
+            offsets = np.zeros(len(rows) + 1, dtype=np.uint64)
+            offsets[1:] = np.cumsum([d.shape[0] for d in rows])
+            data = np.concatenate(rows).astype(dtype, copy=False)
+        else:
+            offsets = np.asarray(offsets)
+            if len(offsets.shape) != 1 or offsets.shape[0] < 2:
+                raise ValueError("expected at least 2 offsets")
+            if not np.issubdtype(offsets.dtype, np.integer):
+                raise ValueError("offsets must be integers")
+            data = np.asarray(data)
+            if len(data.shape) != 1:
+                raise ValueError("1-d values only")
+            if offsets[0] != 0 or offsets[-1] != data.shape[0] or \
+               (np.diff(offsets) < 0).any():
+                raise ValueError(
+                    "offsets must increase from 0 to the number of values")
+
+        # both are used in place when they are already contiguous and of the
+        # right type
+        self._values = np.ascontiguousarray(data, dtype=dtype)
+        self._offsets = np.ascontiguousarray(offsets, dtype=np.uint64)
+
+        cdef runtime_type ctype = get_c_type(self._values.dtype)
+
+        self._thisptr.reset(new flat_dataview(
+            <const uint8_t *> self._values.data,
+            <const uint64_t *> self._offsets.data,
+            self._offsets.shape[0] - 1,
+            ctype))
+
+    property _data:
+        """The rows, as a list of views"""
+        def __get__(self):
+            return [self.row(i) for i in xrange(self.size())]
 
     def size(self):
-        return len(self._data)
+        return self._offsets.shape[0] - 1
 
     def rowsize(self, i):
-        return len(self._data[i])
+        return len(self.row(i))
+
+    def row(self, i):
+        """The values of row `i`, as a view"""
+        if i < 0 or i >= self.size():
+            raise IndexError("row index out of range")
+        return self._values[self._offsets[i]:self._offsets[i + 1]]
+
+    def values(self):
+        """All the values, the rows back to back"""
+        return self._values
+
+    def offsets(self):
+        """Row i is values()[offsets()[i]:offsets()[i + 1]]"""
+        return self._offsets
 
     def __len__(self):
         return self.size()
 
     def _digest(self, h):
         # use the str repr for dtype
-        h.update(str(self._data[0].dtype))
+        h.update(str(self._values.dtype))
 
-        # XXX(stephentu): this is probably really slow
-        for d in self._data:
-            h.update(d.view(np.uint8))
+        # the offsets, which fix the row lengths, then the values
+        h.update(digest.tree_digest(
+            digest.array_chunks(self._offsets) +
+            digest.array_chunks(self._values)))
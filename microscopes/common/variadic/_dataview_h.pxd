@@ -1,5 +1,5 @@
 from libcpp.vector cimport vector
-from libc.stdint cimport uint8_t
+from libc.stdint cimport uint8_t, uint64_t
 from libc.stddef cimport size_t
 
 from microscopes.common._runtime_type_h cimport runtime_type
@@ -20,3 +20,9 @@ cdef extern from "microscopes/common/variadic/dataview.hpp" namespace "microscop
         row_major_dataview(const vector[const uint8_t *] &,
                            const vector[unsigned] &,
                            const runtime_type &) except +
+
+    cdef cppclass flat_dataview(dataview):
+        flat_dataview(const uint8_t *,
+                      const uint64_t *,
+                      size_t,
+                      const runtime_type &) except +
@@ -13,17 +13,33 @@ from microscopes.common.variadic._dataview cimport (
 
 
 class numpy_dataview(_numpy_dataview):
-    """numpy_dataview(data)
+    """numpy_dataview(data, offsets=None, dtype=None)
+
+    The rows are held back to back in a single values array, with row i
+    being ``values[offsets[i]:offsets[i + 1]]``.
 
     Parameters
     ----------
-    data : list of 1-D array-like objects
+    data : list of 1-D array-like objects, or a 1-D array-like of values
+        A list of rows is laid out in a single array, of their common type.
+        Otherwise, `data` holds the values of all the rows, and `offsets`
+        must be given
+    offsets : 1-D array-like of ints, optional
+        The ``nrows + 1`` row offsets into `data`, starting at 0
+    dtype : numpy dtype, optional
+        Coerce the values to this type
+
+    Notes
+    -----
+    A values array which is already contiguous and of the requested type,
+    and uint64 offsets, are used without copying them (so, for instance, the
+    dataview can be backed by memory-mapped arrays).
 
     """
 
     def __reduce__(self):
-        return (_reconstruct_numpy_dataview, (self._data,))
+        return (_reconstruct_numpy_dataview, (self._values, self._offsets))
 
 
-def _reconstruct_numpy_dataview(data):
-    return numpy_dataview(data)
+def _reconstruct_numpy_dataview(data, offsets=None):
+    return numpy_dataview(data, offsets)
@@ -12,35 +12,6 @@ from microscopes._models cimport (
 # Python includes
 
 import numpy as np
-import itertools as it
-
-from distributions.dbg.models import (
-    bb as dbg_bb,
-    bnb as dbg_bnb,
-    gp as dbg_gp,
-    nich as dbg_nich,
-    dd as dbg_dd,
-    niw as dbg_niw,
-)
-
-from distributions.io.schema_pb2 import (
-    BetaBernoulli as pb_bb,
-    BetaNegativeBinomial as pb_bnb,
-    GammaPoisson as pb_gp,
-    NormalInverseChiSq as pb_nich,
-    DirichletDiscrete as pb_dd,
-    NormalInverseWishart as pb_niw,
-)
-
-from microscopes.dbg.models import (
-    bbnc as dbg_bbnc,
-    dm as dbg_dm,
-)
-
-from microscopes.io.schema_pb2 import (
-    BetaBernoulliNonConj as pb_bbnc,
-    DirichletMultinomial as pb_dm,
-)
 
 from microscopes.common.scalar_functions import (
     log_exponential,
@@ -50,18 +21,58 @@ from microscopes.common.scalar_functions import (
 from microscopes.common import validator
 
 
-class py_model(object):
+def _import(name):
+    # `from <module> import <attr>`, for name = '<module>.<attr>'
+    module, _, attr = name.rpartition('.')
+    return getattr(__import__(module, fromlist=[attr]), attr)
 
-    def __init__(self, model_module, pb_module, dtype=None):
-        self._model_module = model_module
-        self._pb_module = pb_module
-        if dtype is None:
-            self._dtype = np.dtype(self._model_module.Value)
-        else:
+
+class py_model(object):
+    """The python (dbg) implementation of a model, with its protobuf messages
+
+    Importing the dbg models and the protobuf schemas is slow, so both may be
+    given by name (e.g. ``'distributions.dbg.models.bb'``), in which case
+    they are only imported on first use.
+
+    Parameters
+    ----------
+    model_module : module or str
+    pb_module : module or str
+    dtype : np.dtype, optional
+        The type of a value. Defaults to ``model_module.Value``
+    shape : tuple, optional
+        If given (and `dtype` is not), a value is an array of this shape of
+        ``model_module.Value``
+
+    """
+
+    def __init__(self, model_module, pb_module, dtype=None, shape=None):
+        self._model_module_ref = model_module
+        self._pb_module_ref = pb_module
+        if dtype is not None:
             validator.validate_type(dtype, np.dtype, param_name='dtype')
-            self._dtype = dtype
+        self._dtype = dtype
+        self._shape = shape
+
+    @property
+    def _model_module(self):
+        if isinstance(self._model_module_ref, basestring):
+            self._model_module_ref = _import(self._model_module_ref)
+        return self._model_module_ref
+
+    @property
+    def _pb_module(self):
+        if isinstance(self._pb_module_ref, basestring):
+            self._pb_module_ref = _import(self._pb_module_ref)
+        return self._pb_module_ref
 
     def get_np_dtype(self):
+        if self._dtype is None:
+            if self._shape is None:
+                self._dtype = np.dtype(self._model_module.Value)
+            else:
+                self._dtype = np.dtype(
+                    (self._model_module.Value, self._shape))
         return self._dtype
 
     def shared_dict_to_bytes(self, raw):
@@ -101,13 +112,16 @@ class model_descriptor(object):
                  c_descriptor,
                  default_hyperparams,
                  default_hyperpriors,
-                 default_partial_hypergrid):
+                 default_partial_hypergrid,
+                 params=None):
         self._name = name
         self._py_descriptor = py_descriptor
         self._c_descriptor = c_descriptor
         self._default_hyperparams = default_hyperparams
         self._default_hyperpriors = default_hyperpriors
         self._default_partial_hypergrid = default_partial_hypergrid
+        # the arguments the model was created with, for pickling
+        self._params = params
 
     def name(self):
         return self._name
@@ -128,6 +142,8 @@ class model_descriptor(object):
         return self._default_partial_hypergrid
 
     def _param(self):
+        if self._params is not None:
+            return self._params
         name = self.name()
         if name in ('dd', 'dm'):
             return len(self._default_hyperparams['alphas'])
@@ -144,75 +160,174 @@ def _reconstruct_model_descriptor(name, param):
     desc = globals()[name]
     if param is None:
         return desc
+    elif isinstance(param, tuple):
+        return desc(*param)
     else:
         return desc(param)
 
 
+class hypergrid(object):
+    """A grid of hyperparameter settings, one point per row
+
+    The grid is held as a structured array, with one field per
+    hyperparameter, and is only built (by calling `builder`) on first use.
+    For compatibility with grids given as a list of dicts, a hypergrid also
+    reads as a sequence of {name: value} dicts: slices, ``+`` and ``==``
+    give the same results as they would on that list.
+
+    Parameters
+    ----------
+    builder : callable
+        Returns the structured array. It is called at most once, and the
+        array it returns is made read-only, since it is shared by every
+        model with this grid
+
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+        self._array = None
+
+    @property
+    def array(self):
+        if self._array is None:
+            array = self._builder()
+            array.flags.writeable = False
+            self._array = array
+        return self._array
+
+    def names(self):
+        names = self.array.dtype.names
+        return names if names is not None else ()
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        point = self.array[i]
+        return {name: point[name] for name in self.names()}
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __add__(self, other):
+        if not isinstance(other, (list, hypergrid)):
+            return NotImplemented
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        return other + list(self)
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if not isinstance(other, (list, hypergrid)):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    # equal grids must hash equal, which the builder does not allow for
+    __hash__ = None
+
+    def __reduce__(self):
+        return (hypergrid, (self._builder,))
+
+
 # XXX(stephentu): someone should check that the default hyperpriors listed here
 # are sane and useful!
 
 
+def _product_grid(*axes):
+    # the points of it.product() over the axes, each a (name, values) pair, as
+    # a structured array
+    names = [name for name, _ in axes]
+    mesh = np.meshgrid(*[values for _, values in axes], indexing='ij')
+    array = np.empty(mesh[0].size, dtype=[(name, float) for name in names])
+    for name, values in zip(names, mesh):
+        array[name] = values.ravel()
+    return array
+
+
 def _bb_default_partial_hypergrid():
     pts = np.logspace(-1, 1, num=100)
-    return [
-        {'alpha': alpha, 'beta': beta} for alpha, beta in it.product(pts, pts)
-    ]
+    return _product_grid(('alpha', pts), ('beta', pts))
 
 
 def _gp_default_partial_hypergrid():
     pts = np.logspace(-1, 1, num=100)
-    return [
-        {'alpha': alpha, 'inv_beta': beta}
-        for alpha, beta in it.product(pts, pts)
-    ]
+    return _product_grid(('alpha', pts), ('inv_beta', pts))
 
 
 def _nich_default_partial_hypergrid():
     mu_pts = np.linspace(-2., 2., num=100)
     sigmasq_pts = np.logspace(-1, 1, num=100)
-    return [
-        {'mu': mu, 'sigmasq': sigmasq}
-        for mu, sigmasq in it.product(mu_pts, sigmasq_pts)
-    ]
+    return _product_grid(('mu', mu_pts), ('sigmasq', sigmasq_pts))
+
+
+def _empty_hypergrid():
+    return np.empty(0, dtype=[])
+
+
+# built on first use, and shared by every model with the same grid
+_bb_hypergrid = hypergrid(_bb_default_partial_hypergrid)
+_gp_hypergrid = hypergrid(_gp_default_partial_hypergrid)
+_nich_hypergrid = hypergrid(_nich_default_partial_hypergrid)
+_no_hypergrid = hypergrid(_empty_hypergrid)
 
 
 bb = model_descriptor(
     name='bb',
-    py_descriptor=py_model(dbg_bb, pb_bb),
+    py_descriptor=py_model(
+        'distributions.dbg.models.bb',
+        'distributions.io.schema_pb2.BetaBernoulli'),
     c_descriptor=_bb(),
     default_hyperparams={'alpha': 1., 'beta': 1.},
     default_hyperpriors={
         ('alpha', 'beta'): log_noninformative_beta_prior,
     },
-    default_partial_hypergrid=_bb_default_partial_hypergrid())
+    default_partial_hypergrid=_bb_hypergrid)
 
 
 bnb = model_descriptor(
     name='bnb',
-    py_descriptor=py_model(dbg_bnb, pb_bnb),
+    py_descriptor=py_model(
+        'distributions.dbg.models.bnb',
+        'distributions.io.schema_pb2.BetaNegativeBinomial'),
     c_descriptor=_bnb(),
     default_hyperparams={'alpha': 1., 'beta': 1., 'r': 1},
     default_hyperpriors={
         ('alpha', 'beta'): log_noninformative_beta_prior,
     },
-    default_partial_hypergrid=_bb_default_partial_hypergrid())
+    default_partial_hypergrid=_bb_hypergrid)
 
 
 gp = model_descriptor(
     name='gp',
-    py_descriptor=py_model(dbg_gp, pb_gp),
+    py_descriptor=py_model(
+        'distributions.dbg.models.gp',
+        'distributions.io.schema_pb2.GammaPoisson'),
     c_descriptor=_gp(),
     default_hyperparams={'alpha': 1., 'inv_beta': 1.},
     default_hyperpriors={
         'alpha': log_exponential(1.),
         'inv_beta': log_exponential(1.),
     },
-    default_partial_hypergrid=_gp_default_partial_hypergrid())
+    default_partial_hypergrid=_gp_hypergrid)
 
 
 nich = model_descriptor(
     name='nich',
-    py_descriptor=py_model(dbg_nich, pb_nich),
+    py_descriptor=py_model(
+        'distributions.dbg.models.nich',
+        'distributions.io.schema_pb2.NormalInverseChiSq'),
     c_descriptor=_nich(),
     default_hyperparams={'mu': 0., 'kappa': 1., 'sigmasq': 1., 'nu': 1.},
     default_hyperpriors={
@@ -220,28 +335,31 @@ nich = model_descriptor(
         'mu': log_normal(0., 1.),
         'sigmasq': log_exponential(1.),
     },
-    default_partial_hypergrid=_nich_default_partial_hypergrid())
+    default_partial_hypergrid=_nich_hypergrid)
 
 
 def dd(size):
     validator.validate_positive(size, param_name='size')
     desc = model_descriptor(
         name='dd',
-        py_descriptor=py_model(dbg_dd, pb_dd),
+        py_descriptor=py_model(
+            'distributions.dbg.models.dd',
+            'distributions.io.schema_pb2.DirichletDiscrete'),
         c_descriptor=_dd(size),
         default_hyperparams={'alphas': [1.] * size},
         default_hyperpriors={
             # XXX(stephentu): put something sane here
         },
-        default_partial_hypergrid=[
-            # XXX(stephentu): put something sane here
-        ])
+        # XXX(stephentu): put something sane here
+        default_partial_hypergrid=_no_hypergrid)
     return desc
 
 
 bbnc = model_descriptor(
     name='bbnc',
-    py_descriptor=py_model(dbg_bbnc, pb_bbnc),
+    py_descriptor=py_model(
+        'microscopes.dbg.models.bbnc',
+        'microscopes.io.schema_pb2.BetaBernoulliNonConj'),
     c_descriptor=_bbnc(),
     default_hyperparams=bb._default_hyperparams,
     default_hyperpriors=bb._default_hyperpriors,
@@ -253,7 +371,10 @@ def niw(dim):
     dtype = np.dtype((float, (dim,)))
     desc = model_descriptor(
         name='niw',
-        py_descriptor=py_model(dbg_niw, pb_niw, dtype=dtype),
+        py_descriptor=py_model(
+            'distributions.dbg.models.niw',
+            'distributions.io.schema_pb2.NormalInverseWishart',
+            dtype=dtype),
         c_descriptor=_niw(dim),
         default_hyperparams={
             'mu': np.array([0.] * dim),
@@ -264,21 +385,38 @@ def niw(dim):
         default_hyperpriors={
             # XXX(stephentu): put something sane here
         },
-        default_partial_hypergrid=[
-            # XXX(stephentu): put something sane here
-        ])
+        # XXX(stephentu): put something sane here
+        default_partial_hypergrid=_no_hypergrid)
     return desc
 
 
-def dm(categories):
+def dm(categories, sparse=False):
+    """Dirichlet-Multinomial model over `categories` outcomes
+
+    Parameters
+    ----------
+    categories : int
+    sparse : bool, optional
+        By default, a value is a vector of `categories` counts. A sparse
+        value instead lists only its non-zero counts, as (category, count)
+        pairs laid out back to back in a 1-D int array, e.g.
+        ``[3, 1, 17, 2]`` for one of category 3 and two of category 17.
+        Sparse values are held in a variadic dataview, and adding, removing
+        and scoring them takes time proportional to their length
+
+    """
     validator.validate_positive(categories, param_name='categories')
-    dtype = np.dtype((dbg_dm.Value, (categories,)))
-    py_descriptor = py_model(dbg_dm, pb_dm, dtype=dtype)
+    py_descriptor = py_model(
+        'microscopes.dbg.models.dm',
+        'microscopes.io.schema_pb2.DirichletMultinomial',
+        shape=None if sparse else (categories,))
     desc = model_descriptor(
         name='dm',
         py_descriptor=py_descriptor,
-        c_descriptor=_dm(categories),
-        default_hyperparams=dd(categories)._default_hyperparams,
-        default_hyperpriors=dd(categories)._default_hyperpriors,
-        default_partial_hypergrid=dd(categories)._default_partial_hypergrid)
+        c_descriptor=_dm(categories, sparse),
+        # the same defaults as dd(categories)
+        default_hyperparams={'alphas': [1.] * categories},
+        default_hyperpriors={},
+        default_partial_hypergrid=_no_hypergrid,
+        params=(categories, bool(sparse)))
     return desc
@@ -165,6 +165,7 @@ extensions = cythonize([
     make_extension('microscopes._models'),
     make_extension('microscopes.common._dataview'),
     make_extension('microscopes.common._entity_state'),
+    make_extension('microscopes.common.crp_state'),
     make_extension('microscopes.common.recarray.dataview'),
     make_extension('microscopes.common.recarray._dataview'),
     make_extension('microscopes.common.relation.dataview'),
@@ -2,6 +2,8 @@
 #include <microscopes/common/util.hpp>
 
 #include <cassert>
+#include <cstring>
+#include <algorithm>
 #include <sstream>
 #include <iostream>
 
@@ -22,39 +24,22 @@ runtime_type_strings(const vector<runtime_type> &types)
 string
 row_accessor::debug_str() const
 {
-  const auto ret = runtime_type::GetOffsetsAndSize(*types_);
-  vector<string> values_repr;
-  values_repr.reserve(types_->size());
-  for (size_t i = 0; i < types_->size(); i++) {
-    if (!mask_ || !mask_[i]) {
-      const auto &type = (*types_)[i];
-      if (!type.vec()) {
-        values_repr.push_back(
-            primitive_type_traits::ToString(type.t(), data_ + ret.offsets_[i]));
-      } else {
-        const size_t s = type.psize();
-        vector<string> strs;
-        strs.reserve(type.n());
-        for (size_t j = 0; j < type.n(); j++)
-          strs.push_back(
-              primitive_type_traits::ToString(type.t(), data_ + ret.offsets_[i] + j * s));
-        values_repr.push_back(util::to_string(strs));
-      }
-    } else {
-      values_repr.push_back("--");
-    }
+  row_accessor acc(*this);
+  vector<string> values_repr, mask_repr;
+  values_repr.reserve(nfeatures());
+  mask_repr.reserve(nfeatures());
+  for (acc.reset(); !acc.end(); acc.bump()) {
+    const bool masked = acc.anymasked();
+    values_repr.push_back(masked ? "--" : acc.get().debug_str());
+    mask_repr.push_back(masked ? "true" : "false");
   }
   ostringstream oss;
   oss << "{"
       << "types=" << runtime_type_strings(*types_) << ", "
       << "values="<< values_repr << ", ";
-  if (mask_) {
-    vector<string> mask_repr;
-    mask_repr.reserve(types_->size());
-    for (size_t i = 0; i < types_->size(); i++)
-      mask_repr.push_back(mask_[i] ? "true" : "false");
+  if (!clean())
     oss << "mask=" << mask_repr;
-  } else
+  else
     oss << "mask=null";
   oss << "}";
   return oss.str();
@@ -83,24 +68,59 @@ row_major_dataview::row_major_dataview(
     const bool *mask,
     size_t n,
     const vector<runtime_type> &types)
-    : dataview(n, types), data_(data), mask_(mask), pos_()
+    : dataview(n, types), data_(data), mask_(mask), maskbits_(), pos_()
 {
-    //cout << "types:" << endl;
-    //for (auto t : types)
-    //    cout << "  " << t << endl;
-    //cout << "offsets:" << endl;
-    //for (auto off : offsets())
-    //    cout << "  " << off << endl;
-    //cout << "rowsize:" << rowsize() << endl;
+  init_masked_rows();
+}
+
+row_major_dataview::row_major_dataview(
+    const uint8_t *data,
+    size_t n,
+    const vector<runtime_type> &types,
+    const uint8_t *maskbits)
+    : dataview(n, types), data_(data), mask_(), maskbits_(maskbits), pos_()
+{
+  init_masked_rows();
+}
+
+void
+row_major_dataview::init_masked_rows()
+{
+  masked_rows_.clear();
+  if (!mask_ && !maskbits_)
+    return;
+  vector<uint8_t> masked_rows(bitmap::nbytes(size()));
+  bool any = false;
+  const size_t m = maskrowsize();
+  for (size_t i = 0; i < size(); i++) {
+    const bool masked = mask_ ?
+      find(mask_ + i * m, mask_ + (i + 1) * m, true) != mask_ + (i + 1) * m :
+      bitmap::any(maskbits_, i * m, (i + 1) * m);
+    if (masked) {
+      bitmap::set(masked_rows.data(), i);
+      any = true;
+    }
+  }
+  if (any)
+    masked_rows_.swap(masked_rows);
 }
 
 row_accessor
-row_major_dataview::get() const
+row_major_dataview::accessor(size_t actual_pos) const
 {
-  const size_t actual_pos = pi_.empty() ? pos_ : pi_[pos_];
   const uint8_t *cursor = data_ + rowsize() * actual_pos;
-  const bool *mask_cursor = !mask_ ? nullptr : mask_ + maskrowsize() * actual_pos;
-  return row_accessor(cursor, mask_cursor, &types());
+  if (!anymasked(actual_pos))
+    return row_accessor(cursor, nullptr, &types());
+  if (maskbits_)
+    return row_accessor(
+        cursor, maskbits_, maskrowsize() * actual_pos, &types());
+  return row_accessor(cursor, mask_ + maskrowsize() * actual_pos, &types());
+}
+
+row_accessor
+row_major_dataview::get() const
+{
+  return accessor(index());
 }
 
 size_t
@@ -133,9 +153,57 @@ row_accessor
 row_major_dataview::get(size_t actual_pos) const
 {
   MICROSCOPES_DCHECK(actual_pos < size(), "invalid position");
-  const uint8_t *cursor = data_ + rowsize() * actual_pos;
-  const bool *mask_cursor = !mask_ ? nullptr : mask_ + maskrowsize() * actual_pos;
-  return row_accessor(cursor, mask_cursor, &types());
+  return accessor(actual_pos);
+}
+
+bool
+row_major_dataview::copy_rows(
+    size_t begin, size_t n, uint8_t *data, bool *mask) const
+{
+  MICROSCOPES_DCHECK(begin + n <= size(), "invalid range");
+  const size_t m = maskrowsize();
+  if (mask && masked_rows_.empty())
+    memset(mask, 0, m * n);
+  if (pi_.empty()) {
+    memcpy(data, data_ + rowsize() * begin, rowsize() * n);
+    if (masked_rows_.empty())
+      return false;
+    if (!bitmap::any(masked_rows_.data(), begin, begin + n)) {
+      if (mask)
+        memset(mask, 0, m * n);
+      return false;
+    }
+    if (mask) {
+      if (mask_)
+        memcpy(mask, mask_ + m * begin, m * n);
+      else
+        for (size_t i = 0; i < m * n; i++)
+          mask[i] = bitmap::test(maskbits_, m * begin + i);
+    }
+    return true;
+  }
+
+  bool masked = false;
+  for (size_t i = begin; i < begin + n; i++) {
+    const size_t actual_pos = pi_[i];
+    memcpy(data, data_ + rowsize() * actual_pos, rowsize());
+    data += rowsize();
+    if (masked_rows_.empty())
+      continue;
+    const bool row_masked = anymasked(actual_pos);
+    masked |= row_masked;
+    if (!mask)
+      continue;
+    if (!row_masked)
+      memset(mask, 0, m);
+    else if (mask_)
+      memcpy(mask, mask_ + m * actual_pos, m);
+    else
+      for (size_t j = 0; j < m; j++)
+        mask[j] = bitmap::test(maskbits_, m * actual_pos + j);
+    mask += m;
+  }
+  return masked;
 }
 
 void
@@ -143,3 +211,107 @@ row_major_dataview::permute(rng_t &rng)
 {
   util::inplace_permute(pi_, size(), rng);
 }
+
+column_major_dataview::column_major_dataview(
+    const vector<const uint8_t *> &columns,
+    const vector<const uint8_t *> &masks,
+    size_t n,
+    const vector<runtime_type> &types)
+    : dataview(n, types),
+      columns_(columns),
+      masks_(masks),
+      pos_(),
+      row_(new uint8_t[rowsize()]),
+      rowmask_(new bool[maskrowsize()])
+{
+  MICROSCOPES_DCHECK(columns.size() == types.size(), "# columns != # types");
+  MICROSCOPES_DCHECK(
+      masks.empty() || masks.size() == types.size(), "# masks != # types");
+  if (masks_.empty())
+    masks_.resize(types.size(), nullptr);
+  for (auto px : columns_)
+    MICROSCOPES_DCHECK(px, "null column");
+}
+
+bool
+column_major_dataview::gather(
+    size_t actual_pos, uint8_t *row, bool *rowmask) const
+{
+  bool masked = false;
+  size_t maskpos = 0;
+  for (size_t f = 0; f < nfeatures(); f++) {
+    const runtime_type &type = types()[f];
+    const size_t size = type.size();
+    memcpy(row + offsets()[f], columns_[f] + actual_pos * size, size);
+    const uint8_t *mask = masks_[f];
+    for (unsigned i = 0; i < type.n(); i++, maskpos++) {
+      const bool m = mask && bitmap::test(mask, actual_pos * type.n() + i);
+      if (rowmask)
+        rowmask[maskpos] = m;
+      masked |= m;
+    }
+  }
+  return masked;
+}
+
+row_accessor
+column_major_dataview::get() const
+{
+  return get(index());
+}
+
+size_t
+column_major_dataview::index() const
+{
+  const size_t actual_pos = pi_.empty() ? pos_ : pi_[pos_];
+  return actual_pos;
+}
+
+void
+column_major_dataview::next()
+{
+  assert(!end());
+  pos_++;
+}
+
+void
+column_major_dataview::reset()
+{
+  pos_ = 0;
+}
+
+bool
+column_major_dataview::end() const
+{
+  return pos_ == size();
+}
+
+row_accessor
+column_major_dataview::get(size_t actual_pos) const
+{
+  MICROSCOPES_DCHECK(actual_pos < size(), "invalid position");
+  const bool masked = gather(actual_pos, row_.get(), rowmask_.get());
+  return row_accessor(row_.get(), masked ? rowmask_.get() : nullptr, &types());
+}
+
+bool
+column_major_dataview::copy_rows(
+    size_t begin, size_t n, uint8_t *data, bool *mask) const
+{
+  MICROSCOPES_DCHECK(begin + n <= size(), "invalid range");
+  bool masked = false;
+  for (size_t i = begin; i < begin + n; i++) {
+    const size_t actual_pos = pi_.empty() ? i : pi_[i];
+    masked |= gather(actual_pos, data, mask);
+    data += rowsize();
+    if (mask)
+      mask += maskrowsize();
+  }
+  return masked;
+}
+
+void
+column_major_dataview::permute(rng_t &rng)
+{
+  util::inplace_permute(pi_, size(), rng);
+}
@@ -10,6 +10,7 @@ namespace models {
 
 #define DISTRIB_EXPLICIT_INSTANTIATE(x) \
   template class distributions_group< x >; \
+  template class distributions_group_array< x >; \
   template class distributions_hypers< x >; \
   template class distributions_model< x >;
 DISTRIB_FOR_EACH_DISTRIBUTION(DISTRIB_EXPLICIT_INSTANTIATE)
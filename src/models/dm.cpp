@@ -6,32 +6,122 @@ using namespace distributions;
 using namespace microscopes::common;
 using namespace microscopes::models;
 
+void
+dm_hypers::commit()
+{
+  alpha_sum_ = 0.;
+  lgamma_alpha_sum_ = 0.;
+  for (auto alpha : alphas_) {
+    alpha_sum_ += alpha;
+    lgamma_alpha_sum_ += fast_lgamma(alpha);
+  }
+  version_ = next_version();
+}
+
+float
+dm_hypers::alpha_sum() const
+{
+  if (version_)
+    return alpha_sum_;
+  float sum = 0.;
+  for (auto alpha : alphas_)
+    sum += alpha;
+  return sum;
+}
+
+float
+dm_hypers::lgamma_alpha_sum() const
+{
+  if (version_)
+    return lgamma_alpha_sum_;
+  float sum = 0.;
+  for (auto alpha : alphas_)
+    sum += fast_lgamma(alpha);
+  return sum;
+}
+
+bool
+dm_group::refresh(const dm_hypers &h)
+{
+  MICROSCOPES_ASSERT(categories() == h.categories());
+  const uint64_t version = h.version();
+  if (!version) {
+    version_ = 0;
+    return false;
+  }
+  if (version_ == version)
+    return true;
+  for (size_t i = 0; i < categories(); i++)
+    lgammas_[i] = fast_lgamma(h.alphas()[i] + counts_[i]);
+  version_ = version;
+  return true;
+}
+
+float
+dm_group::lgamma_term(const dm_hypers &h, uint64_t version, size_t i) const
+{
+  if (version && version == version_)
+    return lgammas_[i];
+  return fast_lgamma(h.alphas()[i] + counts_[i]);
+}
+
+// calls f(i, xi) for each category i with a non-zero count xi in value
+template <typename F>
+static inline void
+for_each_count(const dm_hypers &h, const value_accessor &value, F f)
+{
+  if (h.sparse()) {
+    MICROSCOPES_ASSERT(!(value.shape() % 2));
+    for (size_t k = 0; k < value.shape(); k += 2) {
+      const unsigned i = value.get<unsigned>(k);
+      const unsigned xi = value.get<unsigned>(k + 1);
+      MICROSCOPES_ASSERT(i < h.categories());
+      if (xi)
+        f(i, xi);
+    }
+  } else {
+    MICROSCOPES_ASSERT(value.shape() == h.categories());
+    for (size_t i = 0; i < h.categories(); i++) {
+      const unsigned xi = value.get<unsigned>(i);
+      if (xi)
+        f(i, xi);
+    }
+  }
+}
+
 void
 dm_group::add_value(const hypers &m, const value_accessor &value, rng_t &rng)
 {
-  MICROSCOPES_ASSERT(value.shape() == categories());
+  const dm_hypers &h = static_cast<const dm_hypers &>(m);
+  const bool cached = refresh(h);
   unsigned count_sum = 0;
-  for (size_t i = 0; i < categories(); i++) {
-    const unsigned ni = value.get<unsigned>(i);
+  for_each_count(h, value, [&](size_t i, unsigned ni) {
     count_sum += ni;
     counts_[i] += ni;
+    if (cached)
+      lgammas_[i] = fast_lgamma(h.alphas()[i] + counts_[i]);
     ratio_ -= fast_lgamma(ni + 1);
-  }
+  });
+  count_sum_ += count_sum;
   ratio_ += fast_lgamma(count_sum + 1);
 }
 
 void
 dm_group::remove_value(const hypers &m, const value_accessor &value, rng_t &rng)
 {
-  MICROSCOPES_ASSERT(value.shape() == categories());
+  const dm_hypers &h = static_cast<const dm_hypers &>(m);
+  const bool cached = refresh(h);
   unsigned count_sum = 0;
-  for (size_t i = 0; i < categories(); i++) {
-    const unsigned ni = value.get<unsigned>(i);
+  for_each_count(h, value, [&](size_t i, unsigned ni) {
     count_sum += ni;
     MICROSCOPES_ASSERT(counts_[i] >= ni);
     counts_[i] -= ni;
+    if (cached)
+      lgammas_[i] = fast_lgamma(h.alphas()[i] + counts_[i]);
     ratio_ += fast_lgamma(ni + 1);
-  }
+  });
+  MICROSCOPES_ASSERT(count_sum_ >= count_sum);
+  count_sum_ -= count_sum;
   ratio_ -= fast_lgamma(count_sum + 1);
 }
 
@@ -40,37 +130,33 @@ dm_group::score_value(const hypers &m, const value_accessor &value, rng_t &rng)
 {
   const dm_hypers &h = static_cast<const dm_hypers &>(m);
   MICROSCOPES_ASSERT(categories() == h.categories());
-  MICROSCOPES_ASSERT(value.shape() == categories());
+  const uint64_t version = h.version();
   // Sec. 3.2:
   // http://www2.math.su.se/matstat/reports/seriec/2014/rep6/report.pdf
+  //
+  // the terms of categories with a zero count in the value cancel out
 
   float score = 0.;
   unsigned x_sum = 0;
-  float a_sum = 0.;
-  unsigned n_sum = 0;
 
-  for (size_t i = 0; i < categories(); i++) {
-    const unsigned xi = value.get<unsigned>(i);
-    const float ai = h.alphas()[i];
-    const unsigned ni = counts_[i];
+  for_each_count(h, value, [&](size_t i, unsigned xi) {
     x_sum += xi;
-    a_sum += ai;
-    n_sum += ni;
 
-    const float effective_ai = ai + ni;
+    const float effective_ai = h.alphas()[i] + counts_[i];
     score += fast_lgamma(effective_ai + xi)
-           - fast_lgamma(effective_ai);
+           - lgamma_term(h, version, i);
 
     // partition denominator
     score -= fast_lgamma(xi + 1);
-  }
+  });
 
   // partition numerator
   score += fast_lgamma(x_sum + 1);
 
   // effective alpha sum
-  score += fast_lgamma(a_sum + n_sum)
-         - fast_lgamma(a_sum + n_sum + x_sum);
+  const float a_sum = h.alpha_sum();
+  score += fast_lgamma(a_sum + count_sum_)
+         - fast_lgamma(a_sum + count_sum_ + x_sum);
 
   return score;
 }
@@ -80,19 +166,13 @@ dm_group::score_data(const hypers &m, rng_t &rng) const
 {
   const dm_hypers &h = static_cast<const dm_hypers &>(m);
   MICROSCOPES_ASSERT(categories() == h.categories());
-  float score = ratio_;
-  float alpha_sum = 0.;
-  unsigned count_sum = 0;
-  for (size_t i = 0; i < categories(); i++) {
-    const float alpha = h.alphas()[i];
-    const unsigned count = counts_[i];
-    alpha_sum += alpha;
-    count_sum += count;
-    score += fast_lgamma(count + alpha)
-           - fast_lgamma(alpha);
-  }
+  const uint64_t version = h.version();
+  float score = ratio_ - h.lgamma_alpha_sum();
+  for (size_t i = 0; i < categories(); i++)
+    score += lgamma_term(h, version, i);
+  const float alpha_sum = h.alpha_sum();
   score += fast_lgamma(alpha_sum)
-         - fast_lgamma(alpha_sum + count_sum);
+         - fast_lgamma(alpha_sum + count_sum_);
   return score;
 }
 
@@ -102,7 +182,6 @@ dm_group::sample_value(const hypers &m, value_mutator &value, rng_t &rng) const
   const dm_hypers &h = static_cast<const dm_hypers &>(m);
   (void)h;
   MICROSCOPES_ASSERT(categories() == h.categories());
-  MICROSCOPES_ASSERT(value.shape() == categories());
   // XXX: we need a way to specify n, the # of samples from a categorical
   // distribution!
   //
@@ -0,0 +1,221 @@
+#include <microscopes/models/dm.hpp>
+#include <microscopes/common/variadic/dataview.hpp>
+#include <microscopes/common/random_fwd.hpp>
+#include <distributions/special.hpp>
+
+#include <random>
+#include <cmath>
+#include <iostream>
+
+using namespace std;
+using namespace distributions;
+using namespace microscopes::common;
+using namespace microscopes::models;
+
+// the scores, computed from scratch
+static float
+reference_score_value(const vector<float> &alphas,
+                      const vector<unsigned> &counts,
+                      const vector<int32_t> &x)
+{
+  float score = 0., a_sum = 0.;
+  unsigned x_sum = 0, n_sum = 0;
+  for (size_t i = 0; i < alphas.size(); i++) {
+    x_sum += x[i];
+    a_sum += alphas[i];
+    n_sum += counts[i];
+    score += fast_lgamma(alphas[i] + counts[i] + x[i])
+           - fast_lgamma(alphas[i] + counts[i])
+           - fast_lgamma(x[i] + 1);
+  }
+  return score + fast_lgamma(x_sum + 1)
+       + fast_lgamma(a_sum + n_sum) - fast_lgamma(a_sum + n_sum + x_sum);
+}
+
+static float
+reference_score_data(const vector<float> &alphas,
+                     const vector<unsigned> &counts,
+                     float ratio)
+{
+  float score = ratio, a_sum = 0.;
+  unsigned n_sum = 0;
+  for (size_t i = 0; i < alphas.size(); i++) {
+    a_sum += alphas[i];
+    n_sum += counts[i];
+    score += fast_lgamma(alphas[i] + counts[i]) - fast_lgamma(alphas[i]);
+  }
+  return score + fast_lgamma(a_sum) - fast_lgamma(a_sum + n_sum);
+}
+
+static inline bool
+close(float a, float b)
+{
+  return fabs(a - b) <= 1e-3 * max(1.f, fabs(a));
+}
+
+int
+main(void)
+{
+  rng_t r(7);
+  const size_t D = 20, N = 30;
+
+  dm_model model(D);
+  auto hp = model.create_hypers();
+  vector<float> alphas(D);
+  {
+    auto mut = hp->get_hp_mutator("alphas");
+    for (size_t i = 0; i < D; i++)
+      mut.set<float>(alphas[i] = 0.2 + 0.1 * i, i);
+  }
+
+  // sparse values: most counts are zero
+  vector<vector<int32_t>> values(N, vector<int32_t>(D));
+  for (auto &x : values)
+    for (size_t j = 0; j < 3; j++)
+      x[uniform_int_distribution<size_t>(0, D - 1)(r)] +=
+        uniform_int_distribution<int32_t>(1, 4)(r);
+
+  const runtime_type type(TYPE_I32, D);
+  auto accessor = [&type](const vector<int32_t> &x) {
+    return value_accessor(
+        reinterpret_cast<const uint8_t *>(x.data()), nullptr, type);
+  };
+
+  auto g = hp->create_group(r);
+  vector<unsigned> counts(D);
+  float ratio = 0.;
+  for (size_t n = 0; n < N; n++) {
+    g->add_value(*hp, accessor(values[n]), r);
+    unsigned x_sum = 0;
+    for (size_t i = 0; i < D; i++) {
+      counts[i] += values[n][i];
+      x_sum += values[n][i];
+      ratio -= fast_lgamma(values[n][i] + 1);
+    }
+    ratio += fast_lgamma(x_sum + 1);
+  }
+  for (size_t n = 0; n < N; n += 3) {
+    g->remove_value(*hp, accessor(values[n]), r);
+    unsigned x_sum = 0;
+    for (size_t i = 0; i < D; i++) {
+      counts[i] -= values[n][i];
+      x_sum += values[n][i];
+      ratio += fast_lgamma(values[n][i] + 1);
+    }
+    ratio -= fast_lgamma(x_sum + 1);
+  }
+
+  auto check = [&](const char *msg) {
+    for (const auto &x : values)
+      MICROSCOPES_CHECK(
+          close(g->score_value(*hp, accessor(x), r),
+                reference_score_value(alphas, counts, x)),
+          msg);
+    MICROSCOPES_CHECK(
+        close(g->score_data(*hp, r),
+              reference_score_data(alphas, counts, ratio)),
+        msg);
+  };
+  check("scores");
+
+  // the cached terms follow changes to the hypers
+  hp->get_hp_mutator("alphas").set<float>(alphas[3] = 5.0, 3);
+  check("scores after mutation");
+
+  // including repeated writes through the same mutator, as a
+  // hyperparameter sampler makes, with groups modified in between
+  {
+    auto mut = hp->get_hp_mutator("alphas");
+    mut.set<float>(alphas[5] = 2.5, 5);
+    check("scores after first write");
+    mut.set<float>(alphas[5] = 0.7, 5);
+    mut.set<float>(alphas[0] = 3.0, 0);
+    check("scores after second write");
+    g->remove_value(*hp, accessor(values[1]), r);
+    g->add_value(*hp, accessor(values[1]), r);
+    mut.set<float>(alphas[1] = 1.5, 1);
+    check("scores after write and group update");
+  }
+
+  auto hp1 = model.create_hypers();
+  {
+    auto mut = hp1->get_hp_mutator("alphas");
+    for (size_t i = 0; i < D; i++)
+      mut.set<float>(alphas[i] = 1.0 + i, i);
+  }
+  hp->set_hp(*hp1);
+  check("scores after set_hp");
+
+  // as do groups which are loaded
+  auto g1 = hp->create_group(r);
+  g1->set_ss(g->get_ss());
+  swap(g, g1);
+  check("scores after set_ss");
+
+  // the same values as (category, count) pairs, one variadic row each
+  dm_model sparse_model(D, true);
+  auto shp = sparse_model.create_hypers();
+  shp->set_hp(hp->get_hp());
+  vector<int32_t> pairs;
+  vector<uint64_t> offsets({0});
+  for (const auto &x : values) {
+    for (size_t i = 0; i < D; i++) {
+      if (!x[i])
+        continue;
+      pairs.push_back(i);
+      pairs.push_back(x[i]);
+    }
+    offsets.push_back(pairs.size());
+  }
+  variadic::flat_dataview view(
+      reinterpret_cast<const uint8_t *>(pairs.data()),
+      offsets.data(), N, runtime_type(TYPE_I32));
+
+  auto sg = shp->create_group(r);
+  for (size_t n = 0; n < N; n++)
+    sg->add_value(*shp, view.get(n).values(), r);
+  for (size_t n = 0; n < N; n += 3)
+    sg->remove_value(*shp, view.get(n).values(), r);
+  MICROSCOPES_CHECK(sg->get_ss() == g->get_ss(), "sparse suffstats");
+  for (size_t n = 0; n < N; n++)
+    MICROSCOPES_CHECK(
+        close(sg->score_value(*shp, view.get(n).values(), r),
+              g->score_value(*hp, accessor(values[n]), r)),
+        "sparse scores");
+
+  // the sparse group's cached terms are refreshed when the hypers are set,
+  // both by the next add_value() and when scored first
+  auto sparse_check = [&](const char *msg) {
+    for (size_t n = 0; n < N; n++)
+      MICROSCOPES_CHECK(
+          close(sg->score_value(*shp, view.get(n).values(), r),
+                reference_score_value(alphas, counts, values[n])),
+          msg);
+    MICROSCOPES_CHECK(
+        close(sg->score_data(*shp, r),
+              reference_score_data(alphas, counts, ratio)),
+        msg);
+  };
+  auto set_alphas = [&]() {
+    dm_hypers::message_type m;
+    for (auto a : alphas)
+      m.add_alphas(a);
+    shp->set_hp(util::protobuf_to_string(m));
+  };
+  for (size_t i = 0; i < D; i++)
+    alphas[i] = 0.5 + 0.25 * (D - i);
+  set_alphas();
+  sparse_check("sparse scores after set_hp");
+  sg->remove_value(*shp, view.get(1).values(), r);
+  sg->add_value(*shp, view.get(1).values(), r);
+  sparse_check("sparse scores after set_hp and group update");
+
+  alphas[7] = 4.0;
+  set_alphas();
+  sg->remove_value(*shp, view.get(1).values(), r);
+  sg->add_value(*shp, view.get(1).values(), r);
+  sparse_check("sparse scores after a second set_hp");
+
+  cout << "test_dm completed" << endl;
+  return 0;
+}
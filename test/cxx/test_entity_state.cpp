@@ -0,0 +1,96 @@
+#include <microscopes/common/crp_state.hpp>
+#include <microscopes/common/random_fwd.hpp>
+#include <distributions/special.hpp>
+
+#include <random>
+#include <cmath>
+#include <iostream>
+
+using namespace std;
+using namespace microscopes::common;
+
+static inline bool
+almost_eq(float a, float b)
+{
+  return fabs(a - b) <= 1e-5;
+}
+
+static void
+test_score_values(rng_t &r)
+{
+  const float alpha = 2.;
+  crp_state s(10, alpha);
+  const size_t g0 = s.create_group(r);
+  const size_t g1 = s.create_group(r);
+  s.create_group(r); // stays empty
+  for (size_t i = 0; i < 7; i++)
+    s.add_value((i % 3) ? g0 : g1, i, r);
+
+  // entities 7, 8 and 9 are unassigned
+  const vector<size_t> eids({9, 7, 8, 7});
+  const size_t ngroups = s.ngroups();
+  MICROSCOPES_CHECK(ngroups == 3, "ngroups");
+
+  for (size_t stride : {ngroups, ngroups + 2}) {
+    const float sentinel = -12345.;
+    vector<float> scores((eids.size() - 1) * stride + ngroups, sentinel);
+    vector<size_t> gids;
+    s.inplace_score_values(
+        eids.data(), eids.size(), gids, scores.data(), stride, r);
+    MICROSCOPES_CHECK(gids == s.groups(), "gids");
+    for (size_t i = 0; i < eids.size(); i++) {
+      const auto expected = s.score_value(eids[i], r);
+      MICROSCOPES_CHECK(expected.first == gids, "group order");
+      for (size_t j = 0; j < ngroups; j++)
+        MICROSCOPES_CHECK(
+            almost_eq(scores[i * stride + j], expected.second[j]), "score");
+      // the padding between rows is left alone
+      if (i + 1 < eids.size())
+        for (size_t j = ngroups; j < stride; j++)
+          MICROSCOPES_CHECK(scores[i * stride + j] == sentinel, "padding");
+    }
+  }
+
+  // the CRP pseudocounts
+  const auto p = s.score_value(7, r);
+  MICROSCOPES_CHECK(almost_eq(p.second[0], distributions::fast_log(4.)), "g0");
+  MICROSCOPES_CHECK(almost_eq(p.second[1], distributions::fast_log(3.)), "g1");
+  MICROSCOPES_CHECK(almost_eq(p.second[2], distributions::fast_log(alpha)), "g2");
+}
+
+static void
+test_assignments(rng_t &r)
+{
+  crp_state s(5, 1.);
+  const ssize_t *px = s.assignments_data();
+  MICROSCOPES_CHECK(px, "assignments_data");
+  for (size_t i = 0; i < s.nentities(); i++)
+    MICROSCOPES_CHECK(px[i] == -1, "unassigned");
+
+  const size_t g0 = s.create_group(r);
+  const size_t g1 = s.create_group(r);
+  s.add_value(g0, 0, r);
+  s.add_value(g1, 3, r);
+  s.add_value(g1, 4, r);
+  MICROSCOPES_CHECK(s.assignments_data() == px, "moved");
+  MICROSCOPES_CHECK(
+      vector<ssize_t>(px, px + s.nentities()) == s.assignments(), "view");
+  MICROSCOPES_CHECK(s.remove_value(3, r) == g1, "remove_value");
+  MICROSCOPES_CHECK(px[3] == -1, "view after remove");
+
+  vector<size_t> gids(s.ngroups()), sizes(s.ngroups());
+  s.inplace_groups(gids.data(), sizes.data());
+  MICROSCOPES_CHECK(gids == s.groups(), "inplace_groups gids");
+  for (size_t i = 0; i < gids.size(); i++)
+    MICROSCOPES_CHECK(sizes[i] == s.groupsize(gids[i]), "inplace_groups sizes");
+}
+
+int
+main(void)
+{
+  rng_t r(63);
+  test_score_values(r);
+  test_assignments(r);
+  cout << "test_entity_state completed" << endl;
+  return 0;
+}
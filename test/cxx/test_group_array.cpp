@@ -0,0 +1,144 @@
+#include <microscopes/models/dm.hpp>
+#include <microscopes/models/distributions.hpp>
+#include <microscopes/common/random_fwd.hpp>
+
+#include <random>
+#include <iostream>
+
+using namespace std;
+using namespace microscopes::common;
+using namespace microscopes::models;
+
+static void
+test_default_array(rng_t &r)
+{
+  const size_t K = 5, D = 4;
+
+  dm_model model(D);
+  auto hp = model.create_hypers();
+  auto alphas = hp->get_hp_mutator("alphas");
+  for (size_t i = 0; i < D; i++)
+    alphas.set<float>(0.5 + i, i);
+
+  // the default array holds groups made by create_group()
+  auto array = hp->create_group_array();
+  vector<shared_ptr<group>> groups;
+  for (size_t k = 0; k < K; k++) {
+    MICROSCOPES_CHECK(array->create_group(*hp, r) == k, "group index");
+    groups.emplace_back(hp->create_group(r));
+  }
+  MICROSCOPES_CHECK(array->size() == K, "size");
+
+  const runtime_type type(TYPE_I32, D);
+  vector<int32_t> values(K * D);
+  for (size_t k = 0; k < K; k++) {
+    for (size_t i = 0; i < D; i++)
+      values[k * D + i] = (k + i) % 3;
+    const value_accessor value(
+        reinterpret_cast<const uint8_t *>(&values[k * D]), nullptr, type);
+    array->add_value(*hp, k, value, r);
+    groups[k]->add_value(*hp, value, r);
+  }
+
+  const int32_t x[D] = {1, 0, 2, 1};
+  const value_accessor value(
+      reinterpret_cast<const uint8_t *>(x), nullptr, type);
+  vector<float> scores(K);
+  array->score_value(*hp, value, scores.data(), r);
+  for (size_t k = 0; k < K; k++) {
+    const float expected = groups[k]->score_value(*hp, value, r);
+    MICROSCOPES_CHECK(scores[k] == expected, "batched score_value");
+    MICROSCOPES_CHECK(array->score_value(*hp, k, value, r) == expected,
+        "score_value");
+    MICROSCOPES_CHECK(array->get_ss(k) == groups[k]->get_ss(), "get_ss");
+  }
+
+  // the last group takes the removed group's index
+  array->remove_group(1);
+  MICROSCOPES_CHECK(array->size() == K - 1, "size after remove");
+  MICROSCOPES_CHECK(array->get_ss(1) == groups[K - 1]->get_ss(),
+      "remove_group");
+}
+
+// distributions models get the specialized by-value array
+static void
+test_distributions_array(rng_t &r)
+{
+  const size_t K = 6, N = 40;
+
+  distributions_model<distributions::NormalInverseChiSq> model;
+  auto hp = model.create_hypers();
+  hp->get_hp_mutator("mu").set<float>(0.5);
+  hp->get_hp_mutator("kappa").set<float>(2.0);
+  hp->get_hp_mutator("sigmasq").set<float>(1.5);
+  hp->get_hp_mutator("nu").set<float>(3.0);
+
+  auto array = hp->create_group_array();
+  MICROSCOPES_CHECK(
+      dynamic_cast<distributions_group_array<
+        distributions::NormalInverseChiSq> *>(array.get()),
+      "expected a distributions_group_array");
+
+  // each group of the array is mirrored by a standalone group
+  vector<shared_ptr<group>> groups;
+  for (size_t k = 0; k < K; k++) {
+    MICROSCOPES_CHECK(array->create_group(*hp, r) == k, "group index");
+    groups.emplace_back(hp->create_group(r));
+  }
+
+  normal_distribution<float> norm(0., 2.);
+  vector<float> values(N);
+  for (size_t n = 0; n < N; n++) {
+    values[n] = norm(r);
+    const value_accessor value(&values[n]);
+    array->add_value(*hp, n % K, value, r);
+    groups[n % K]->add_value(*hp, value, r);
+  }
+  for (size_t n = 0; n < N; n += 4) {
+    const value_accessor value(&values[n]);
+    array->remove_value(*hp, n % K, value, r);
+    groups[n % K]->remove_value(*hp, value, r);
+  }
+
+  // the last group takes the removed group's index
+  array->remove_group(2);
+  groups[2] = groups.back();
+  groups.pop_back();
+  MICROSCOPES_CHECK(array->size() == K - 1, "size after remove");
+
+  for (const float x : {-3.f, 0.f, 0.25f, 4.f}) {
+    const value_accessor value(&x);
+    vector<float> scores(array->size());
+    array->score_value(*hp, value, scores.data(), r);
+    for (size_t k = 0; k < array->size(); k++) {
+      MICROSCOPES_CHECK(
+          scores[k] == array->score_value(*hp, k, value, r),
+          "batched score_value");
+      MICROSCOPES_CHECK(
+          scores[k] == groups[k]->score_value(*hp, value, r),
+          "score_value of the standalone group");
+    }
+  }
+  for (size_t k = 0; k < array->size(); k++) {
+    MICROSCOPES_CHECK(array->get_ss(k) == groups[k]->get_ss(), "get_ss");
+    MICROSCOPES_CHECK(
+        array->score_data(*hp, k, r) == groups[k]->score_data(*hp, r),
+        "score_data");
+  }
+
+  // suffstats round trip through another array
+  auto array1 = hp->create_group_array();
+  array1->create_group(*hp, r);
+  array1->set_ss(0, array->get_ss(1));
+  MICROSCOPES_CHECK(array1->get_ss(0) == array->get_ss(1), "set_ss");
+}
+
+int
+main(void)
+{
+  rng_t r(12);
+  test_default_array(r);
+  test_distributions_array(r);
+  cout << "test_group_array completed" << endl;
+  return 0;
+}
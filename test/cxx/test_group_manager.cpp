@@ -1,9 +1,12 @@
 #include <microscopes/common/group_manager.hpp>
 
+#include <random>
+
 using namespace std;
 using namespace microscopes::common;
 
 typedef group_manager<size_t> group;
+typedef flat_group_manager<size_t> flat_group;
 
 static inline bool
 almost_eq(float a, float b)
@@ -19,12 +22,13 @@ static void assert_vectors_equal(const vector<T> &as, const vector<T> &bs)
     MICROSCOPES_CHECK(as[i] == bs[i], "element");
 }
 
+template <typename Group>
 static void
 test_serialization()
 {
-  group g(10);
+  Group g(10);
 
-  g.get_hp_mutator("alpha").set<float>(2.0, 0);
+  g.get_hp_mutator("alpha").template set<float>(2.0, 0);
 
   const vector<ssize_t> assignment_vec({
       -1, 2, 1, 0, 6, 1, 2, -1, -1, 5
@@ -42,14 +46,14 @@ test_serialization()
     return to_string(i);
   });
 
-  group g1(serialized, [](const string &s) {
+  Group g1(serialized, [](const string &s) {
       return strtoul(s.c_str(), nullptr, 10);
   });
 
   MICROSCOPES_CHECK(
       almost_eq(
-        g.get_hp_mutator("alpha").accessor().get<float>(0),
-        g1.get_hp_mutator("alpha").accessor().get<float>(0)),
+        g.get_hp_mutator("alpha").accessor().template get<float>(0),
+        g1.get_hp_mutator("alpha").accessor().template get<float>(0)),
     "did not save alpha properly");
 
   assert_vectors_equal(g.assignments(), g1.assignments());
@@ -58,9 +62,149 @@ test_serialization()
     MICROSCOPES_CHECK(g.group(gid) == g1.group(gid), "group count/data");
 }
 
+static void
+test_flat_gid_reuse()
+{
+  flat_group g(4);
+  g.get_hp_mutator("alpha").set<float>(1.0, 0);
+  for (size_t i = 0; i < 4; i++)
+    MICROSCOPES_CHECK(g.create_group().first == i, "gids should be dense");
+  g.add_value(3, 0) = 30;
+  g.delete_group(1);
+  g.delete_group(0);
+  MICROSCOPES_CHECK(g.ngroups() == 2, "ngroups");
+  MICROSCOPES_CHECK(!g.isactivegroup(0) && !g.isactivegroup(1), "active");
+  MICROSCOPES_CHECK(g.group(3).data_ == 30, "data moved with its group");
+
+  // most recently deleted gid is handed out first
+  MICROSCOPES_CHECK(g.create_group().first == 0, "reuse gid 0");
+  MICROSCOPES_CHECK(g.create_group().first == 1, "reuse gid 1");
+  MICROSCOPES_CHECK(g.create_group().first == 4, "fresh gid");
+  MICROSCOPES_CHECK(g.group(3).data_ == 30, "data preserved");
+  // empty groups are kept in increasing gid order, as groups come and go
+  assert_vectors_equal(g.empty_groups(), vector<size_t>({0, 1, 2, 4}));
+  g.add_value(1, 1);
+  g.remove_value(0);
+  assert_vectors_equal(g.empty_groups(), vector<size_t>({0, 2, 3, 4}));
+  g.add_value(3, 0);
+  g.remove_value(1);
+
+  size_t n = 0;
+  for (auto &p : g) {
+    MICROSCOPES_CHECK(g.isactivegroup(p.first), "iterated inactive group");
+    n++;
+  }
+  MICROSCOPES_CHECK(n == g.ngroups(), "iteration");
+
+  vector<size_t> gids(g.ngroups()), sizes(g.ngroups());
+  g.inplace_groups(gids.data(), sizes.data());
+  assert_vectors_equal(gids, g.groups());
+  for (size_t i = 0; i < gids.size(); i++)
+    MICROSCOPES_CHECK(sizes[i] == g.groupsize(gids[i]), "sizes");
+
+  // holes left by deserialization are reused
+  g.delete_group(1);
+  const auto serialized = g.serialize([](size_t i) {
+    return to_string(i);
+  });
+  flat_group g1(serialized, [](const string &s) {
+      return strtoul(s.c_str(), nullptr, 10);
+  });
+  MICROSCOPES_CHECK(g1.ngroups() == 4, "ngroups");
+  MICROSCOPES_CHECK(g1.create_group().first == 1, "reuse hole");
+  MICROSCOPES_CHECK(g1.create_group().first == 5, "fresh gid");
+}
+
+// the two stores should be indistinguishable without gid reuse
+static void
+test_flat_matches_map()
+{
+  const size_t n = 100;
+  group g0(n);
+  flat_group g1(n);
+  g0.get_hp_mutator("alpha").set<float>(2.0, 0);
+  g1.get_hp_mutator("alpha").set<float>(2.0, 0);
+  for (size_t i = 0; i < 10; i++) {
+    MICROSCOPES_CHECK(
+        g0.create_group().first == g1.create_group().first, "gid");
+  }
+  for (size_t i = 0; i < n; i++) {
+    g0.add_value((i * 7) % 10, i) += i;
+    g1.add_value((i * 7) % 10, i) += i;
+  }
+  for (size_t i = 0; i < n; i += 3) {
+    MICROSCOPES_CHECK(g0.remove_value(i).first == g1.remove_value(i).first,
+        "remove_value");
+    g0.add_value((i * 3) % 10, i);
+    g1.add_value((i * 3) % 10, i);
+  }
+  assert_vectors_equal(g0.assignments(), g1.assignments());
+  MICROSCOPES_CHECK(g0.ngroups() == g1.ngroups(), "ngroups");
+  for (auto gid : g0.groups())
+    MICROSCOPES_CHECK(g0.group(gid) == g1.group(gid), "group count/data");
+  MICROSCOPES_CHECK(
+      almost_eq(g0.score_assignment(), g1.score_assignment()), "score");
+}
+
+template <typename Group>
+static void
+test_score_assignment()
+{
+  const size_t n = 200;
+  mt19937 r(543);
+  Group g(n);
+  g.get_hp_mutator("alpha").template set<float>(1.5, 0);
+  for (size_t i = 0; i < 5; i++)
+    g.create_group();
+  for (size_t i = 0; i < n; i++)
+    g.add_value(r() % 5, i);
+
+  for (size_t it = 0; it < 5; it++) {
+    MICROSCOPES_CHECK(
+        almost_eq(
+          g.score_assignment() / g.score_assignment_from_scratch(), 1.),
+        "score");
+    // reassign, opening and closing groups along the way
+    for (size_t i = 0; i < n; i++) {
+      const size_t gid = g.remove_value(i).first;
+      if (!g.groupsize(gid))
+        g.delete_group(gid);
+      if (!(r() % 10))
+        g.create_group();
+      const auto gids = g.groups();
+      g.add_value(gids[r() % gids.size()], i);
+    }
+    for (auto gid : g.groups())
+      if (!g.groupsize(gid))
+        g.delete_group(gid);
+  }
+
+  // alpha is only needed at query time
+  g.get_hp_mutator("alpha").template set<float>(0.3, 0);
+  MICROSCOPES_CHECK(
+      almost_eq(
+        g.score_assignment() / g.score_assignment_from_scratch(), 1.),
+      "score after alpha update");
+
+  const auto serialized = g.serialize([](size_t i) {
+    return to_string(i);
+  });
+  Group g1(serialized, [](const string &s) {
+      return strtoul(s.c_str(), nullptr, 10);
+  });
+  MICROSCOPES_CHECK(
+      almost_eq(g.score_assignment(), g1.score_assignment()),
+      "score after deserialization");
+}
+
 int
 main(void)
 {
-  test_serialization();
+  test_serialization<group>();
+  test_serialization<flat_group>();
+  test_flat_gid_reuse();
+  test_flat_matches_map();
+  test_score_assignment<group>();
+  test_score_assignment<flat_group>();
   return 0;
 }
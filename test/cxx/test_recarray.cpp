@@ -0,0 +1,267 @@
+#include <microscopes/common/recarray/dataview.hpp>
+#include <microscopes/common/random_fwd.hpp>
+
+#include <random>
+#include <algorithm>
+#include <cstring>
+#include <iostream>
+
+using namespace std;
+using namespace microscopes::common;
+using namespace microscopes::common::recarray;
+
+static void
+test_bitmap()
+{
+  // np.packbits([1, 0, 0, 0, 0, 0, 0, 1, 0, 1]) == [129, 64]
+  const uint8_t bits[] = {129, 64};
+  const bool expected[] = {1, 0, 0, 0, 0, 0, 0, 1, 0, 1};
+  for (size_t i = 0; i < 10; i++)
+    MICROSCOPES_CHECK(bitmap::test(bits, i) == expected[i], "bit order");
+  MICROSCOPES_CHECK(bitmap::any(bits, 0, 10), "any");
+  MICROSCOPES_CHECK(!bitmap::any(bits, 1, 7), "any partial");
+  MICROSCOPES_CHECK(bitmap::any(bits, 3, 10), "any straddle");
+  MICROSCOPES_CHECK(!bitmap::any(bits, 10, 16), "any tail");
+
+  uint8_t out[2] = {0, 0};
+  for (size_t i = 0; i < 10; i++)
+    bitmap::set(out, i, expected[i]);
+  MICROSCOPES_CHECK(out[0] == bits[0] && out[1] == bits[1], "set");
+  MICROSCOPES_CHECK(bitmap::nbytes(16) == 2 && bitmap::nbytes(17) == 3,
+      "nbytes");
+
+  // long ranges go a word at a time
+  for (size_t bit : {0, 5, 63, 64, 130, 199}) {
+    vector<uint8_t> big(bitmap::nbytes(200));
+    bitmap::set(big.data(), bit);
+    for (size_t begin : {0, 3, 64, 100})
+      for (size_t end : {150, 200})
+        MICROSCOPES_CHECK(
+            bitmap::any(big.data(), begin, end) == (begin <= bit && bit < end),
+            "any long");
+  }
+}
+
+static void
+test_column_major()
+{
+  const size_t n = 13;
+  const vector<runtime_type> types({
+    runtime_type(TYPE_I32),
+    runtime_type(TYPE_F32, 3),
+    runtime_type(TYPE_B),
+  });
+
+  vector<int32_t> c0(n);
+  vector<float> c1(3 * n);
+  unique_ptr<bool[]> c2(new bool[n]);
+  for (size_t i = 0; i < n; i++) {
+    c0[i] = int32_t(i) * 7 - 20;
+    for (size_t j = 0; j < 3; j++)
+      c1[i * 3 + j] = float(i) + 0.25f * j;
+    c2[i] = i % 3;
+  }
+
+  // mask out the 2nd element of every 4th entity's vector
+  vector<uint8_t> m1(bitmap::nbytes(3 * n));
+  for (size_t i = 0; i < n; i += 4)
+    bitmap::set(m1.data(), i * 3 + 1);
+
+  column_major_dataview view(
+      {
+        reinterpret_cast<const uint8_t *>(c0.data()),
+        reinterpret_cast<const uint8_t *>(c1.data()),
+        reinterpret_cast<const uint8_t *>(c2.get()),
+      },
+      {nullptr, m1.data(), nullptr},
+      n, types);
+
+  MICROSCOPES_CHECK(view.size() == n, "size");
+  MICROSCOPES_CHECK(view.nfeatures() == 3, "nfeatures");
+
+  const auto s0 = view.column<int32_t>(0);
+  const auto s1 = view.column<float>(1);
+  MICROSCOPES_CHECK(!s0.anymasked() && s1.anymasked(), "anymasked");
+  MICROSCOPES_CHECK(s1.shape() == 3, "shape");
+  for (size_t i = 0; i < n; i++) {
+    MICROSCOPES_CHECK(s0[i] == c0[i], "column 0");
+    for (unsigned j = 0; j < 3; j++) {
+      MICROSCOPES_CHECK(s1.at(i, j) == c1[i * 3 + j], "column 1");
+      MICROSCOPES_CHECK(s1.ismasked(i, j) == (!(i % 4) && j == 1), "mask");
+    }
+  }
+
+  // the compatibility row interface sees the same values
+  rng_t r(32);
+  view.permute(r);
+  vector<size_t> seen;
+  for (view.reset(); !view.end(); view.next()) {
+    const size_t i = view.index();
+    seen.push_back(i);
+    row_accessor acc = view.get();
+    MICROSCOPES_CHECK(acc.nfeatures() == 3, "row nfeatures");
+    MICROSCOPES_CHECK(acc.get().get<int32_t>() == c0[i], "row value 0");
+    MICROSCOPES_CHECK(!acc.anymasked(), "row mask 0");
+    acc.bump();
+    for (unsigned j = 0; j < 3; j++) {
+      MICROSCOPES_CHECK(acc.get().get<float>(j) == c1[i * 3 + j],
+          "row value 1");
+      MICROSCOPES_CHECK(acc.ismasked(j) == (!(i % 4) && j == 1), "row mask 1");
+    }
+    acc.bump();
+    MICROSCOPES_CHECK(acc.get().get<bool>() == c2[i], "row value 2");
+    acc.bump();
+    MICROSCOPES_CHECK(acc.end(), "row end");
+  }
+  const vector<size_t> seen_order(seen);
+  sort(seen.begin(), seen.end());
+  for (size_t i = 0; i < n; i++)
+    MICROSCOPES_CHECK(seen[i] == i, "permutation");
+
+  // bulk copies follow the permutation too
+  const auto offsets = runtime_type::GetOffsetsAndSize(types);
+  vector<uint8_t> rows(offsets.rowsize_ * 4);
+  vector<uint8_t> masks(offsets.maskrowsize_ * 4);
+  bool anymasked = false;
+  for (size_t i = 0; i < 4; i++)
+    anymasked |= !(seen_order[3 + i] % 4);
+  MICROSCOPES_CHECK(
+      view.copy_rows(3, 4, rows.data(),
+        reinterpret_cast<bool *>(masks.data())) == anymasked,
+      "copy_rows masked");
+  for (size_t i = 0; i < 4; i++) {
+    const size_t idx = seen_order[3 + i];
+    row_accessor acc(
+        rows.data() + i * offsets.rowsize_,
+        reinterpret_cast<const bool *>(masks.data()) + i * offsets.maskrowsize_,
+        &types);
+    MICROSCOPES_CHECK(acc.get().get<int32_t>() == c0[idx], "copy value 0");
+    acc.bump();
+    MICROSCOPES_CHECK(acc.get().get<float>(2) == c1[idx * 3 + 2],
+        "copy value 1");
+    MICROSCOPES_CHECK(acc.ismasked(1) == !(idx % 4), "copy mask 1");
+  }
+
+  view.reset_permutation();
+  view.reset();
+  MICROSCOPES_CHECK(view.index() == 0, "reset_permutation");
+  MICROSCOPES_CHECK(
+      view.get(5).get().get<int32_t>() == c0[5], "random access");
+}
+
+static void
+test_row_major_copy_rows()
+{
+  const size_t n = 10;
+  const vector<runtime_type> types({
+    runtime_type(TYPE_I32),
+    runtime_type(TYPE_B),
+  });
+  // packed rows of (int32, bool)
+  vector<uint8_t> data(n * 5);
+  unique_ptr<bool[]> mask(new bool[n * 2]);
+  for (size_t i = 0; i < n; i++) {
+    const int32_t v = int32_t(i) * 3;
+    memcpy(&data[i * 5], &v, 4);
+    data[i * 5 + 4] = i % 2;
+    mask[i * 2] = false;
+    mask[i * 2 + 1] = (i == 7);
+  }
+
+  row_major_dataview view(data.data(), mask.get(), n, types);
+  vector<uint8_t> rows(n * 5);
+  unique_ptr<bool[]> masks(new bool[n * 2]);
+  MICROSCOPES_CHECK(!view.copy_rows(0, 7, rows.data(), masks.get()),
+      "nothing masked in first 7");
+  MICROSCOPES_CHECK(view.copy_rows(5, 5, rows.data(), masks.get()),
+      "row 7 masked");
+  MICROSCOPES_CHECK(!memcmp(rows.data(), &data[25], 25), "contiguous copy");
+
+  rng_t r(5);
+  view.permute(r);
+  MICROSCOPES_CHECK(view.copy_rows(0, n, rows.data(), nullptr), "masked");
+  size_t i = 0;
+  for (view.reset(); !view.end(); view.next(), i++)
+    MICROSCOPES_CHECK(
+        !memcmp(&rows[i * 5], &data[view.index() * 5], 5), "permuted copy");
+}
+
+static void
+test_row_major_packed_mask()
+{
+  const size_t n = 21;
+  const vector<runtime_type> types({
+    runtime_type(TYPE_I32),
+    runtime_type(TYPE_F32, 3),
+  });
+  const auto offsets = runtime_type::GetOffsetsAndSize(types);
+  const size_t m = offsets.maskrowsize_;
+  vector<uint8_t> data(offsets.rowsize_ * n);
+  for (size_t i = 0; i < data.size(); i++)
+    data[i] = i * 7;
+
+  // mask one value in every 5th row
+  unique_ptr<bool[]> mask(new bool[n * m]);
+  vector<uint8_t> maskbits(bitmap::nbytes(n * m));
+  for (size_t i = 0; i < n * m; i++) {
+    mask[i] = !((i / m) % 5) && (i % m) == 2;
+    bitmap::set(maskbits.data(), i, mask[i]);
+  }
+
+  row_major_dataview bools(data.data(), mask.get(), n, types);
+  row_major_dataview bits(data.data(), n, types, maskbits.data());
+  for (size_t i = 0; i < n; i++) {
+    MICROSCOPES_CHECK(bools.anymasked(i) == !(i % 5), "anymasked bools");
+    MICROSCOPES_CHECK(bits.anymasked(i) == !(i % 5), "anymasked bits");
+    auto a0 = bools.get(i), a1 = bits.get(i);
+    MICROSCOPES_CHECK(a0.clean() == bool(i % 5), "clean bools");
+    MICROSCOPES_CHECK(a1.clean() == bool(i % 5), "clean bits");
+    for (; !a0.end(); a0.bump(), a1.bump()) {
+      MICROSCOPES_CHECK(a0.anymasked() == a1.anymasked(), "value anymasked");
+      for (unsigned j = 0; j < a0.curshape(); j++)
+        MICROSCOPES_CHECK(a0.ismasked(j) == a1.ismasked(j), "value ismasked");
+    }
+  }
+
+  // an unmasked view hands out clean accessors
+  row_major_dataview plain(data.data(), nullptr, n, types);
+  MICROSCOPES_CHECK(plain.get(0).clean() && !plain.anymasked(0), "plain");
+
+  rng_t r(7);
+  for (auto *view : {&bools, &bits}) {
+    vector<uint8_t> rows(offsets.rowsize_ * 4);
+    unique_ptr<bool[]> masks(new bool[m * 4]);
+    MICROSCOPES_CHECK(!view->copy_rows(1, 4, rows.data(), masks.get()),
+        "rows 1-4 unmasked");
+    MICROSCOPES_CHECK(
+        find(masks.get(), masks.get() + m * 4, true) == masks.get() + m * 4,
+        "rows 1-4 masks cleared");
+    MICROSCOPES_CHECK(view->copy_rows(3, 4, rows.data(), masks.get()),
+        "row 5 masked");
+    MICROSCOPES_CHECK(
+        equal(masks.get(), masks.get() + m * 4, mask.get() + m * 3),
+        "contiguous masks");
+
+    view->permute(r);
+    vector<uint8_t> allrows(offsets.rowsize_ * n);
+    unique_ptr<bool[]> allmasks(new bool[m * n]);
+    MICROSCOPES_CHECK(view->copy_rows(0, n, allrows.data(), allmasks.get()),
+        "permuted masked");
+    size_t i = 0;
+    for (view->reset(); !view->end(); view->next(), i++)
+      MICROSCOPES_CHECK(
+          equal(&allmasks[m * i], &allmasks[m * (i + 1)],
+                mask.get() + m * view->index()),
+          "permuted masks");
+  }
+}
+
+int
+main(void)
+{
+  test_bitmap();
+  test_column_major();
+  test_row_major_copy_rows();
+  test_row_major_packed_mask();
+  return 0;
+}
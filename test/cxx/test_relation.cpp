@@ -11,6 +11,8 @@
 #include <vector>
 #include <set>
 #include <memory>
+#include <cstring>
+#include <algorithm>
 
 using namespace std;
 using namespace Eigen;
@@ -68,6 +70,30 @@ CheckDataview2DArray(
   }
 }
 
+// slice_into() should give exactly the entries, in order, of slice()
+static void
+CheckSliceInto(const dataview &d)
+{
+  dataview::slice_buffer buf;
+  for (size_t dim = 0; dim < d.dims(); dim++) {
+    for (size_t idx = 0; idx < d.shape()[dim]; idx++) {
+      d.slice_into(dim, idx, buf);
+      MICROSCOPES_CHECK(buf.dims() == d.dims(), "buffer dims");
+      size_t k = 0;
+      for (const auto &p : d.slice(dim, idx)) {
+        MICROSCOPES_CHECK(k < buf.size(), "too few entries");
+        for (size_t i = 0; i < d.dims(); i++)
+          MICROSCOPES_CHECK(buf.position(k)[i] == p.first[i], "position");
+        MICROSCOPES_CHECK(
+            !memcmp(buf.raw_value(k), p.second.data(), d.type().size()),
+            "value");
+        k++;
+      }
+      MICROSCOPES_CHECK(k == buf.size(), "too many entries");
+    }
+  }
+}
+
 static void
 test1()
 {
@@ -97,6 +123,16 @@ test1()
         reinterpret_cast<const uint8_t *>(data.get()), masks.get(),
         {A, B}, runtime_type(TYPE_B)));
   CheckDataview2DArray(data.get(), masks.get(), A, B, *view);
+  CheckSliceInto(*view);
+
+  vector<uint8_t> maskbits(bitmap::nbytes(A*B));
+  for (size_t i = 0; i < A*B; i++)
+    bitmap::set(maskbits.data(), i, masks[i]);
+  row_major_dense_dataview packed(
+      reinterpret_cast<const uint8_t *>(data.get()),
+      {A, B}, runtime_type(TYPE_B), maskbits.data());
+  CheckDataview2DArray(data.get(), masks.get(), A, B, packed);
+  CheckSliceInto(packed);
 
   unique_ptr<bool []> data1(new bool[A*B]);
   unique_ptr<bool []> masks1(new bool[A*B]);
@@ -116,6 +152,7 @@ test1()
         reinterpret_cast<const uint8_t *>(data1.get()), masks1.get(),
         {A, B}, runtime_type(TYPE_B)));
   CheckDataview2DArray(data1.get(), masks1.get(), A, B, *view1);
+  CheckSliceInto(*view1);
 
   cout << "test1 completed" << endl;
 }
@@ -270,12 +307,69 @@ sparse_dataview_from_eigen(container &c, const ArrayXXi &data)
   return move(sparseview);
 }
 
+template <typename Index>
+static void
+CheckPermutedSparse(const CSRI32Matrix &csr, const ArrayXXi &data)
+{
+  const size_t rows = data.rows();
+  const size_t cols = data.cols();
+  const size_t nnz = csr.nonZeros();
+  const vector<Index> indices(
+      csr.innerIndexPtr(), csr.innerIndexPtr() + nnz);
+  const vector<Index> indptr(
+      csr.outerIndexPtr(), csr.outerIndexPtr() + rows + 1);
+  vector<Index> csc_indices(nnz), csc_indptr(cols + 1), csc_perm(nnz);
+  build_csc_index<Index>(rows, cols, indices.data(), indptr.data(),
+      csc_indices.data(), csc_indptr.data(), csc_perm.data());
+
+  compressed_2darray_t<Index> view(
+      reinterpret_cast<const uint8_t *>(csr.valuePtr()),
+      indices.data(), indptr.data(),
+      csc_indices.data(), csc_indptr.data(), csc_perm.data(),
+      rows, cols, runtime_type(TYPE_I32));
+  MICROSCOPES_CHECK(view.nnz() == nnz, "nnz");
+  Check2D_I32RelationsEqual(data, view, true);
+  CheckSliceInto(view);
+
+  // absent entries are masked, present ones (including any explicit
+  // zeros) are not
+  for (size_t i = 0; i < rows; i++)
+    for (size_t j = 0; j < cols; j++) {
+      const auto acc = view.get({i, j});
+      MICROSCOPES_CHECK(acc.ismasked(0) == !data(i, j), "get mask");
+      if (data(i, j))
+        MICROSCOPES_CHECK(
+            acc.template get<int32_t>() == data(i, j), "get value");
+    }
+}
+
 static void
 Check2D_Sparse(const ArrayXXi &data)
 {
   container c;
   auto sparseview = sparse_dataview_from_eigen(c, data);
   Check2D_I32RelationsEqual(data, *sparseview, true);
+  CheckSliceInto(*sparseview);
+
+  // the spans agree with the data
+  const auto &view = static_cast<const compressed_2darray &>(*sparseview);
+  for (size_t i = 0; i < view.rows(); i++) {
+    const auto sp = view.row(i);
+    for (size_t k = 0; k < sp.size_; k++)
+      MICROSCOPES_CHECK(
+          *reinterpret_cast<const int32_t *>(sp.value(k)) ==
+            data(i, sp.indices_[k]), "row span");
+  }
+  for (size_t j = 0; j < view.cols(); j++) {
+    const auto sp = view.col(j);
+    MICROSCOPES_CHECK(sp.size_ == size_t((data.col(j) != 0).count()),
+        "col span size");
+  }
+
+  // the same relation, with the CSC side as a permutation over the CSR
+  // values, in both index widths
+  CheckPermutedSparse<uint32_t>(c.csr_, data);
+  CheckPermutedSparse<uint64_t>(c.csr_, data);
 }
 
 static void
@@ -306,6 +400,138 @@ test2()
         {A, B}, runtime_type(TYPE_I32)));
 
   Check2D_I32RelationsEqual(truth, *view, false);
+  CheckSliceInto(*view);
+
+  // 3D, including masked entries
+  const size_t C = 5;
+  unique_ptr<int32_t []> data3(new int32_t[A*B*C]);
+  unique_ptr<bool []> masks3(new bool[A*B*C]);
+  for (size_t i = 0; i < A*B*C; i++) {
+    data3[i] = i;
+    masks3[i] = bernoulli_distribution(0.3)(r);
+  }
+  row_major_dense_dataview view3(
+      reinterpret_cast<const uint8_t *>(data3.get()), masks3.get(),
+      {A, B, C}, runtime_type(TYPE_I32));
+  CheckSliceInto(view3);
+
+  // the same masks, packed
+  vector<uint8_t> maskbits3(bitmap::nbytes(A*B*C));
+  for (size_t i = 0; i < A*B*C; i++)
+    bitmap::set(maskbits3.data(), i, masks3[i]);
+  row_major_dense_dataview packed3(
+      reinterpret_cast<const uint8_t *>(data3.get()),
+      {A, B, C}, runtime_type(TYPE_I32), maskbits3.data());
+  CheckSliceInto(packed3);
+  {
+    dataview::slice_buffer buf0, buf1;
+    for (size_t dim = 0; dim < 3; dim++)
+      for (size_t idx = 0; idx < view3.shape()[dim]; idx++) {
+        view3.slice_into(dim, idx, buf0);
+        packed3.slice_into(dim, idx, buf1);
+        MICROSCOPES_CHECK(buf0.size() == buf1.size(), "packed slice size");
+        for (size_t n = 0; n < buf0.size(); n++)
+          MICROSCOPES_CHECK(buf0.raw_value(n) == buf1.raw_value(n),
+              "packed slice value");
+        MICROSCOPES_CHECK(
+            view3.slice_anymasked(dim, idx) ==
+              packed3.slice_anymasked(dim, idx),
+            "packed slice_anymasked");
+      }
+  }
+
+  // only entry (1, 2, 3) masked: just the three slices through it are not
+  // clean
+  fill(masks3.get(), masks3.get() + A*B*C, false);
+  masks3[(1*B + 2)*C + 3] = true;
+  fill(maskbits3.begin(), maskbits3.end(), 0);
+  bitmap::set(maskbits3.data(), (1*B + 2)*C + 3);
+  const row_major_dense_dataview onemasked(
+      reinterpret_cast<const uint8_t *>(data3.get()), masks3.get(),
+      {A, B, C}, runtime_type(TYPE_I32));
+  const row_major_dense_dataview onemasked_packed(
+      reinterpret_cast<const uint8_t *>(data3.get()),
+      {A, B, C}, runtime_type(TYPE_I32), maskbits3.data());
+  const size_t masked_at[] = {1, 2, 3};
+  for (const dataview *d : {
+        static_cast<const dataview *>(&onemasked),
+        static_cast<const dataview *>(&onemasked_packed)}) {
+    CheckSliceInto(*d);
+    for (size_t dim = 0; dim < 3; dim++)
+      for (size_t idx = 0; idx < d->shape()[dim]; idx++)
+        MICROSCOPES_CHECK(
+            d->slice_anymasked(dim, idx) == (idx == masked_at[dim]),
+            "slice_anymasked");
+    MICROSCOPES_CHECK(d->get({1, 2, 3}).anymasked(), "get masked");
+    MICROSCOPES_CHECK(!d->get({1, 2, 2}).anymasked(), "get unmasked");
+  }
+
+  // the same 3D relation as a sparse_ndarray, with the entries given in
+  // row-major order so that slices come out in the same order as view3
+  vector<uint32_t> coo_indices;
+  vector<int32_t> coo_data;
+  for (size_t i = 0; i < A; i++)
+    for (size_t j = 0; j < B; j++)
+      for (size_t k = 0; k < C; k++) {
+        const size_t idx = (i*B + j)*C + k;
+        if (masks3[idx])
+          continue;
+        coo_indices.insert(
+            coo_indices.end(), {uint32_t(i), uint32_t(j), uint32_t(k)});
+        coo_data.push_back(data3[idx]);
+      }
+  sparse_ndarray sparse3(
+      reinterpret_cast<const uint8_t *>(coo_data.data()), coo_indices.data(),
+      coo_data.size(), {A, B, C}, runtime_type(TYPE_I32));
+  MICROSCOPES_CHECK(sparse3.nnz() == coo_data.size(), "nnz");
+  CheckSliceInto(sparse3);
+  dataview::slice_buffer buf0, buf1;
+  for (size_t dim = 0; dim < 3; dim++)
+    for (size_t idx = 0; idx < sparse3.shape()[dim]; idx++) {
+      view3.slice_into(dim, idx, buf0);
+      sparse3.slice_into(dim, idx, buf1);
+      MICROSCOPES_CHECK(buf0.size() == buf1.size(), "slice size");
+      for (size_t n = 0; n < buf0.size(); n++) {
+        MICROSCOPES_CHECK(
+            equal(buf0.position(n), buf0.position(n) + 3, buf1.position(n)),
+            "slice position");
+        MICROSCOPES_CHECK(
+            buf0.value(n).get<int32_t>() == buf1.value(n).get<int32_t>(),
+            "slice value");
+      }
+    }
+  // and again over a prebuilt index, as when opened from disk
+  const vector<size_t> shape3({A, B, C});
+  vector<uint32_t> order(3 * coo_data.size());
+  vector<uint32_t> indptr(sparse_nd_indptr_size(shape3));
+  MICROSCOPES_CHECK(indptr.size() == A + B + C + 3, "indptr size");
+  build_sparse_nd_index(
+      coo_indices.data(), coo_data.size(), shape3,
+      order.data(), indptr.data());
+  sparse_ndarray sparse3_indexed(
+      reinterpret_cast<const uint8_t *>(coo_data.data()), coo_indices.data(),
+      coo_data.size(), order.data(), indptr.data(), shape3,
+      runtime_type(TYPE_I32));
+  for (size_t dim = 0; dim < 3; dim++)
+    for (size_t idx = 0; idx < shape3[dim]; idx++) {
+      sparse3.slice_into(dim, idx, buf0);
+      sparse3_indexed.slice_into(dim, idx, buf1);
+      MICROSCOPES_CHECK(buf0.size() == buf1.size(), "indexed slice size");
+      for (size_t n = 0; n < buf0.size(); n++)
+        MICROSCOPES_CHECK(
+            equal(buf0.position(n), buf0.position(n) + 3, buf1.position(n)),
+            "indexed slice position");
+    }
+  for (size_t idx = 0; idx < A*B*C; idx++) {
+    const vector<size_t> pos({idx / (B*C), (idx / C) % B, idx % C});
+    const auto acc = sparse3.get(pos);
+    MICROSCOPES_CHECK(
+        acc.ismasked(0) == sparse3_indexed.get(pos).ismasked(0),
+        "indexed get");
+    MICROSCOPES_CHECK(acc.ismasked(0) == masks3[idx], "get mask");
+    if (!masks3[idx])
+      MICROSCOPES_CHECK(acc.get<int32_t>() == data3[idx], "get value");
+  }
 
   Check2D_Sparse(truth);
 
@@ -4,6 +4,7 @@ from microscopes.common.recarray.dataview import (
 from microscopes.common.relation.dataview import (
     numpy_dataview as relation_numpy_dataview,
     sparse_2d_dataview,
+    sparse_nd_dataview,
 )
 from microscopes.common.variadic.dataview import (
     numpy_dataview as variadic_numpy_dataview,
@@ -24,6 +25,7 @@ from nose.tools import (
     assert_list_equal,
     assert_is_not_none,
     assert_true,
+    assert_raises,
 )
 from microscopes.common.testutil import assert_1d_lists_almost_equals
 
@@ -76,6 +78,25 @@ def test_recarray_numpy_dataview_masked():
             assert_equals(aval, bval)
 
 
+def test_recarray_numpy_dataview_maskbits():
+    x = np.array([(i, (i * 2., -i)) for i in xrange(10)],
+                 dtype=[('', np.int32), ('', np.float32, (2,))])
+    mask = np.zeros(10, dtype=ma.make_mask_descr(x.dtype))
+    mask[3] = (False, (True, False))
+    mask[8] = (True, (False, False))
+    view = recarray_numpy_dataview(ma.array(x, mask=mask))
+    assert_true((view._mask == mask).all())
+    view1 = recarray_numpy_dataview(
+        x, maskbits=np.packbits(mask.view(np.bool_)))
+    assert_equals(repr(list(view)), repr(list(view1)))
+    assert_raises(
+        ValueError, recarray_numpy_dataview, x, maskbits=np.zeros(2))
+
+    # a masked array with no mask is not masked
+    view = recarray_numpy_dataview(ma.array(x))
+    assert_true(view._mask is None)
+
+
 def test_recarray_numpy_dataview_pickle():
     # not masked, int32
     y = np.array([(1, 2, 3, 4, 5), (5, 4, 3, 2, 1)],
@@ -122,6 +143,39 @@ def test_recarray_numpy_dataview_pickle():
         list(v.data for v in view1))
 
 
+def test_recarray_numpy_dataview_iter_batches():
+    x = np.array([(i, (i * 2., -i)) for i in xrange(10)],
+                 dtype=[('', np.int32), ('', np.float32, (2,))])
+    view = recarray_numpy_dataview(x)
+    batches = list(view.iter_batches(4))
+    assert_list_equal([len(b) for b in batches], [4, 4, 2])
+    assert_true(all(not hasattr(b, 'mask') for b in batches))
+    batch = np.concatenate(batches)
+    assert_true((batch['f0'] == x['f0']).all())
+    assert_true((batch['f1'] == x['f1']).all())
+
+    # honors the permutation, in the same order as plain iteration
+    from microscopes.common.rng import rng
+    view.permute(rng(2))
+    order = [int(r[0]) for r in view]
+    assert_list_equal(sorted(order), range(10))
+    assert_list_equal(
+        [int(y) for b in view.iter_batches(3) for y in b['f0']], order)
+    view.reset_permutation()
+    assert_list_equal([int(r[0]) for r in view], range(10))
+
+    # only batches with masked values are masked arrays
+    y = ma.array(x, mask=[(i == 5, (False, i == 6)) for i in xrange(10)])
+    view = recarray_numpy_dataview(y)
+    batches = list(view.iter_batches(5))
+    assert_true(not hasattr(batches[0], 'mask'))
+    assert_true(hasattr(batches[1], 'mask'))
+    assert_true(batches[1].mask[0]['f0'])
+    assert_list_equal(list(batches[1].mask[1]['f1']), [False, True])
+    assert_equals(
+        sum(m['f0'] + m['f1'].sum() for m in batches[1].mask), 2)
+
+
 def _hexdigest(obj):
     h = hashlib.sha1()
     obj.digest(h)
@@ -150,6 +204,22 @@ def test_recarray_numpy_dataview_digest():
     assert_not_equals(_hexdigest(view), _hexdigest(view1))
 
 
+def test_recarray_numpy_dataview_digest_masked():
+    x = np.array([(1, (2., 3.)), (4, (5., 6.))],
+                 dtype=[('', np.int32), ('', np.float32, (2,))])
+    y = x.copy()
+    y[1][1][0] = 100.
+    mask = np.zeros(2, dtype=ma.make_mask_descr(x.dtype))
+    mask[1] = (False, (True, False))
+    view = recarray_numpy_dataview(ma.array(x, mask=mask))
+    view1 = recarray_numpy_dataview(ma.array(y, mask=mask))
+    assert_equals(_hexdigest(view), _hexdigest(view1))
+    assert_equals(y[1][1][0], 100.)
+
+    view1 = recarray_numpy_dataview(x)
+    assert_not_equals(_hexdigest(view), _hexdigest(view1))
+
+
 def test_relation_numpy_dataview():
     x = np.zeros((2, 3, 4), dtype=np.bool)
     view = relation_numpy_dataview(x)
@@ -165,6 +235,18 @@ def test_relation_numpy_dataview_masked():
     assert_equals(view.shape(), (2, 3, 4))
 
 
+def test_relation_numpy_dataview_maskbits():
+    x = np.random.randint(-10, 10, size=(3, 4, 5))
+    mask = np.random.uniform(size=x.shape) < 0.2
+    view = relation_numpy_dataview(ma.array(x, mask=mask))
+    view1 = relation_numpy_dataview(x, maskbits=np.packbits(mask))
+    for v in (view, view1):
+        y = v.toarray()
+        assert_true((y.mask == mask).all())
+        assert_true((y.data == x).all())
+    assert_equals(_hexdigest(view), _hexdigest(view1))
+
+
 def test_relation_numpy_dataview_pickle():
     # not masked, int32
     y = np.random.randint(-10, 10, size=(10, 10))
@@ -203,6 +285,8 @@ def test_relation_numpy_dataview_digest_masked():
     view = relation_numpy_dataview(ma_x)
     view1 = relation_numpy_dataview(ma_y)
     assert_equals(_hexdigest(view), _hexdigest(view1))
+    # the masked values are left alone
+    assert_true(view1.toarray().data[0, 0])
 
 
 def test_relation_sparse_2d_dataview_build_from_csr():
@@ -270,6 +354,121 @@ def test_relation_sparse_2d_dataview_digest():
     assert_not_equals(_hexdigest(view), _hexdigest(view1))
 
 
+def test_relation_sparse_2d_dataview_explicit_zeros():
+    row = np.array([0, 3, 1, 0, 2])
+    col = np.array([0, 3, 1, 2, 2])
+    data = np.array([4, 5, 7, 9, 0], dtype=np.int32)
+    m = coo_matrix((data, (row, col)), shape=(4, 5))
+
+    view = sparse_2d_dataview(m)
+    assert_equals(view.nnz(), 4)
+    view = sparse_2d_dataview(m, explicit_zeros=True)
+    assert_equals(view.nnz(), 5)
+    assert_equals((view.tocsc() != m.tocsc()).nnz, 0)
+    assert_equals(view.tocsc().nnz, 5)
+
+    view1 = pickle.loads(pickle.dumps(view))
+    assert_equals(view1.nnz(), 5)
+    assert_equals(_hexdigest(view), _hexdigest(view1))
+
+    # the caller's matrix is left alone
+    csr = m.tocsr()
+    sparse_2d_dataview(csr)
+    assert_equals(csr.nnz, 5)
+
+
+def test_relation_sparse_2d_dataview_int64_indices():
+    y = np.random.randint(-2, 3, size=(6, 7))
+    csr = csr_matrix(y)
+    # scipy's constructor downcasts small indices, so set them directly
+    csr64 = csr.copy()
+    csr64.indices = csr.indices.astype(np.int64)
+    csr64.indptr = csr.indptr.astype(np.int64)
+    assert_equals(csr64.indices.dtype, np.int64)
+    view = sparse_2d_dataview(csr)
+    view64 = sparse_2d_dataview(csr64)
+    assert_equals(view64.tocsr().indices.dtype, np.int64)
+    assert_equals(view64.tocsr().indptr.dtype, np.int64)
+    assert_equals((view.tocsc() != view64.tocsc()).nnz, 0)
+    assert_equals((view64.tocsc() != csr.tocsc()).nnz, 0)
+    assert_equals(_hexdigest(view), _hexdigest(
+        sparse_2d_dataview(csr_matrix(y))))
+
+
+def test_relation_sparse_nd_dataview():
+    x = np.random.randint(-5, 5, size=(3, 4, 5)).astype(np.int32)
+    mask = np.random.uniform(size=x.shape) < 0.7
+    indices = np.nonzero(~mask)
+    view = sparse_nd_dataview(indices, x[indices], x.shape)
+    assert_equals(view.shape(), (3, 4, 5))
+    assert_equals(view.nnz(), (~mask).sum())
+    y = view.toarray()
+    assert_true((y.mask == mask).all())
+    assert_true((y.data[~mask] == x[~mask]).all())
+
+    view1 = pickle.loads(pickle.dumps(view))
+    assert_equals(view1.shape(), view.shape())
+    assert_true((view1.indices() == view.indices()).all())
+    assert_true((view1.data() == view.data()).all())
+    assert_equals(_hexdigest(view), _hexdigest(view1))
+
+    # empty relations are fine
+    view = sparse_nd_dataview(np.zeros((2, 0), dtype=int), [], (2, 2))
+    assert_true(view.toarray().mask.all())
+
+    assert_raises(
+        ValueError, sparse_nd_dataview, [[0, 0], [1, 1]], [1, 2], (2, 2))
+    assert_raises(
+        ValueError, sparse_nd_dataview, [[0, 2], [1, 1]], [1, 2], (2, 2))
+    assert_raises(
+        ValueError, sparse_nd_dataview, [[0, 1]], [1, 2], (2, 2))
+
+
+def test_relation_sparse_nd_dataview_index():
+    x = np.random.randint(-5, 5, size=(3, 4, 5)).astype(np.int32)
+    indices = np.nonzero(np.random.uniform(size=x.shape) < 0.3)
+    view = sparse_nd_dataview(indices, x[indices], x.shape)
+    order, indptr = view.slice_index()
+    assert_equals(order.shape, (3, view.nnz()))
+    assert_equals(indptr.shape, (3 + 4 + 5 + 3,))
+
+    # order[d] lists the entries by their coordinate along d
+    offset = 0
+    for d, n in enumerate(x.shape):
+        ptr = indptr[offset:offset + n + 1]
+        for i in xrange(n):
+            entries = order[d, ptr[i]:ptr[i + 1]]
+            assert_true((indices[d][entries] == i).all())
+            assert_equals(len(entries), (indices[d] == i).sum())
+        offset += n + 1
+
+    # a prebuilt index is used without copying
+    view1 = sparse_nd_dataview(
+        indices, x[indices], x.shape, index=(order, indptr))
+    assert_true(view1.slice_index()[0] is order)
+    assert_true(view1.slice_index()[1] is indptr)
+    assert_true((view1.toarray() == view.toarray()).all())
+    assert_equals(_hexdigest(view1), _hexdigest(view))
+
+    # as are entry-major uint32 positions
+    entries = np.ascontiguousarray(view.indices().T)
+    view1 = sparse_nd_dataview(entries.T, x[indices], x.shape)
+    assert_true(np.may_share_memory(view1.indices(), entries))
+
+    assert_raises(
+        ValueError, sparse_nd_dataview,
+        indices, x[indices], x.shape, index=(order,))
+    assert_raises(
+        ValueError, sparse_nd_dataview,
+        indices, x[indices], x.shape, index=(order[:2], indptr))
+    assert_raises(
+        ValueError, sparse_nd_dataview,
+        indices, x[indices], x.shape, index=(order, indptr[1:]))
+
+    # validate=False skips the checks on the positions
+    sparse_nd_dataview([[0, 0], [1, 1]], [1, 2], (2, 2), validate=False)
+
+
 def test_variadic_dataview_simple():
     data = [
         np.array([1, 2, 3]),
@@ -280,3 +479,42 @@ def test_variadic_dataview_simple():
     view1 = variadic_numpy_dataview(data)
     assert_equals(len(view), len(data))
     assert_equals(_hexdigest(view), _hexdigest(view1))
+
+    # the same values split into different rows
+    view1 = variadic_numpy_dataview([np.array([1, 2, 3, 1]),
+                                     np.array([2, 3, 4]),
+                                     np.array([1, 2, 3, 5])])
+    assert_not_equals(_hexdigest(view), _hexdigest(view1))
+
+
+def test_variadic_dataview_flat():
+    values = np.arange(10, dtype=np.int32)
+    offsets = np.array([0, 3, 3, 10], dtype=np.uint64)
+    view = variadic_numpy_dataview(values, offsets)
+    assert_equals(len(view), 3)
+    assert_equals([view.rowsize(i) for i in xrange(3)], [3, 0, 7])
+    assert_equals(list(view.row(2)), range(3, 10))
+    # no copies are made
+    assert_true(view.values() is values)
+    assert_true(view.offsets() is offsets)
+    assert_true(np.may_share_memory(view.row(0), values))
+
+    # the same rows given as a list
+    view1 = variadic_numpy_dataview([values[:3], values[3:3], values[3:]])
+    assert_equals(_hexdigest(view), _hexdigest(view1))
+
+    view1 = pickle.loads(pickle.dumps(view))
+    assert_true((view1.values() == values).all())
+    assert_true((view1.offsets() == offsets).all())
+
+    # rows of different types are coerced to a common type
+    view = variadic_numpy_dataview([np.array([1, 2], dtype=np.int32),
+                                    np.array([0.5])])
+    assert_equals(view.values().dtype, np.float64)
+    view = variadic_numpy_dataview(values, offsets, dtype=np.float32)
+    assert_equals(view.values().dtype, np.float32)
+
+    assert_raises(ValueError, variadic_numpy_dataview, values, [0, 3, 9])
+    assert_raises(ValueError, variadic_numpy_dataview, values, [1, 10])
+    assert_raises(ValueError, variadic_numpy_dataview, values, [0, 4, 3, 10])
+    assert_raises(IndexError, view.row, 3)
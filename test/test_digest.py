@@ -0,0 +1,69 @@
+from microscopes.common import digest
+from microscopes.common.digest import (
+    array_chunks,
+    tree_digest,
+    value_of_byte,
+)
+
+import numpy as np
+
+from nose.tools import (
+    assert_equals,
+    assert_not_equals,
+    assert_true,
+)
+
+
+def test_value_of_byte():
+    assert_equals(list(value_of_byte(np.int16)), [0, 0])
+    dtype = [('', np.int8), ('', np.int16, (2,))]
+    assert_equals(list(value_of_byte(dtype)), [0, 1, 1, 2, 2])
+
+
+def test_array_chunks():
+    x = np.arange(100, dtype=np.int32)
+    chunks = array_chunks(x, chunk_size=64)
+    assert_equals(len(chunks), 7)
+    assert_equals(np.concatenate([c() for c in chunks]).tobytes(),
+                  x.tobytes())
+    assert_equals(array_chunks(x[:0]), [])
+
+    # the digest does not depend on the number of threads
+    assert_equals(tree_digest(chunks, nthreads=1),
+                  tree_digest(chunks, nthreads=4))
+
+
+def test_tree_digest_pool():
+    digest._pools.pop(3, None)
+    x = np.arange(100, dtype=np.int32)
+
+    # one chunk is hashed inline
+    tree_digest(array_chunks(x), nthreads=3)
+    assert_true(3 not in digest._pools)
+
+    # the pool is created once, and reused
+    chunks = array_chunks(x, chunk_size=64)
+    h = tree_digest(chunks, nthreads=3)
+    pool = digest._pools[3][1]
+    assert_equals(tree_digest(chunks, nthreads=3), h)
+    assert_true(digest._pools[3][1] is pool)
+
+
+def test_array_chunks_masked():
+    x = np.arange(100, dtype=np.int32)
+    mask = np.zeros(100, dtype=np.bool_)
+    mask[[3, 50, 99]] = True
+    maskbits = np.packbits(mask)
+    byte_values = value_of_byte(x.dtype)
+
+    chunks = array_chunks(x, maskbits, byte_values, chunk_size=64)
+    y = np.concatenate([c() for c in chunks]).view(np.int32).ravel()
+    assert_true((y == np.where(mask, 0, x)).all())
+    assert_equals(x[50], 50)
+
+    x1 = x.copy()
+    x1[mask] = -1
+    chunks1 = array_chunks(x1, maskbits, byte_values, chunk_size=64)
+    assert_equals(tree_digest(chunks), tree_digest(chunks1))
+    x1[4] = -1
+    assert_not_equals(tree_digest(chunks), tree_digest(chunks1))
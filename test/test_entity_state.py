@@ -0,0 +1,154 @@
+from microscopes.common.rng import rng
+from microscopes.common.crp_state import state
+
+from nose.tools import assert_equals, assert_raises
+
+import numpy as np
+
+
+def _make_state(r, alpha=2.):
+    # 3 groups, the last one empty; entities 7, 8 and 9 unassigned
+    s = state(10, alpha)
+    g0, g1, _ = [s.create_group(r) for _ in xrange(3)]
+    for i in xrange(7):
+        s.add_value(g0 if i % 3 else g1, i, r)
+    return s
+
+
+def _reference_scores(s, eids, r):
+    gids, rows = None, []
+    for eid in eids:
+        g, scores = s.score_value(eid, r)
+        if gids is None:
+            gids = g
+        assert_equals(g, gids)
+        rows.append(scores)
+    return gids, np.array(rows)
+
+
+def test_score_value():
+    r = rng(54)
+    s = _make_state(r)
+    gids, scores = s.score_value(7, r)
+    assert_equals(len(gids), 3)
+    assert np.allclose(scores, np.log([4., 3., 2.]))
+
+
+def test_score_values():
+    r = rng(54)
+    s = _make_state(r)
+    eids = [9, 7, 8, 7]
+    expected_gids, expected = _reference_scores(s, eids, r)
+
+    gids, scores = s.score_values(eids, r)
+    assert_equals(list(gids), expected_gids)
+    assert_equals(scores.dtype, np.float32)
+    assert_equals(scores.shape, (4, 3))
+    assert np.allclose(scores, expected)
+
+    # numpy eids, and a single entity
+    gids, scores = s.score_values(np.array(eids, dtype=np.int32), r)
+    assert np.allclose(scores, expected)
+    gids, scores = s.score_values([8], r)
+    assert np.allclose(scores, expected[2:3])
+
+    # no entities
+    gids, scores = s.score_values([], r)
+    assert_equals(list(gids), expected_gids)
+    assert_equals(scores.shape, (0, 3))
+
+
+def test_score_values_out():
+    r = rng(54)
+    s = _make_state(r)
+    eids = [9, 7, 8]
+    _, expected = _reference_scores(s, eids, r)
+
+    out = np.zeros((3, 3), dtype=np.float32)
+    gids, scores = s.score_values(eids, r, out=out)
+    assert scores is out
+    assert np.allclose(out, expected)
+
+    # strided rows, e.g. the leading columns of a larger buffer
+    buf = np.full((3, 5), -1., dtype=np.float32)
+    gids, scores = s.score_values(eids, r, out=buf[:, :3])
+    assert np.allclose(buf[:, :3], expected)
+    assert (buf[:, 3:] == -1.).all()
+
+    # every other row
+    buf = np.full((6, 3), -1., dtype=np.float32)
+    s.score_values(eids, r, out=buf[::2])
+    assert np.allclose(buf[::2], expected)
+    assert (buf[1::2] == -1.).all()
+
+
+def test_score_values_errors():
+    r = rng(54)
+    s = _make_state(r)
+    eids = [9, 7, 8]
+
+    # out
+    assert_raises(ValueError, s.score_values, eids, r,
+                  out=np.zeros((3, 3), dtype=np.float64))
+    assert_raises(ValueError, s.score_values, eids, r,
+                  out=np.zeros((3, 4), dtype=np.float32))
+    assert_raises(ValueError, s.score_values, eids, r,
+                  out=np.zeros((2, 3), dtype=np.float32))
+    assert_raises(ValueError, s.score_values, eids, r,
+                  out=np.zeros(9, dtype=np.float32))
+    assert_raises(ValueError, s.score_values, eids, r,
+                  out=np.zeros((3, 6), dtype=np.float32)[:, ::2])
+    assert_raises(ValueError, s.score_values, eids, r,
+                  out=np.zeros((3, 3), dtype=np.float32).tolist())
+    out = np.zeros((3, 3), dtype=np.float32)
+    out.flags.writeable = False
+    assert_raises(ValueError, s.score_values, eids, r, out=out)
+
+    # eids
+    assert_raises(ValueError, s.score_values, [7, -1], r)
+    assert_raises(ValueError, s.score_values, [7, 10], r)
+    assert_raises(ValueError, s.score_values, [[7, 8]], r)
+    assert_raises(ValueError, s.score_values, [7., 8.], r)
+
+
+def test_assignments_view():
+    r = rng(54)
+    s = state(5)
+    view = s.assignments_view()
+    assert_equals(view.dtype, np.intp)
+    assert_equals(list(view), [-1] * 5)
+    assert not view.flags.writeable
+
+    g0, g1 = s.create_group(r), s.create_group(r)
+    s.add_value(g0, 0, r)
+    s.add_value(g1, 3, r)
+    s.add_value(g1, 4, r)
+    assert_equals(list(view), [g0, -1, -1, g1, g1])
+    assert_equals(list(view), s.assignments())
+    assert_equals(s.remove_value(3, r), g1)
+    assert_equals(list(view), [g0, -1, -1, -1, g1])
+
+    # the view keeps the state alive
+    del s
+    assert_equals(list(view), [g0, -1, -1, -1, g1])
+
+
+def test_groupsizes():
+    r = rng(54)
+    s = _make_state(r)
+    gids, sizes = s.groupsizes()
+    assert_equals(gids.dtype, np.intp)
+    assert_equals(sizes.dtype, np.intp)
+    assert_equals(list(gids), s.groups())
+    assert_equals(list(sizes), [s.groupsize(gid) for gid in gids])
+    assert_equals(list(sizes), [4, 3, 0])
+
+    s.remove_value(0, r)
+    s.add_value(gids[2], 0, r)
+    _, sizes = s.groupsizes()
+    assert_equals(list(sizes), [s.groupsize(gid) for gid in gids])
+    assert_equals(list(sizes), [4, 2, 1])
+
+    s = state(3)
+    gids, sizes = s.groupsizes()
+    assert_equals((gids.shape, sizes.shape), ((0,), (0,)))
@@ -1,9 +1,12 @@
 # a sanity test, see if we can import
 
-from nose.tools import assert_almost_equals
+from nose.tools import assert_almost_equals, assert_raises
 import numpy as np
 import pickle
 import copy
+import json
+import subprocess
+import sys
 
 
 def test_import_models():
@@ -68,3 +71,61 @@ def test_log_noninformative_beta_prior():
     assert log_noninformative_beta_prior.input_dim() == 2
     val = log_noninformative_beta_prior(alpha, beta)
     assert_almost_equals(val, -2.5 * np.log(alpha + beta), places=5)
+
+
+def test_scalar_function_eval():
+    from microscopes.common.scalar_functions import (
+        log_exponential,
+        log_normal,
+        log_noninformative_beta_prior,
+    )
+    xs = np.linspace(-1., 10., num=50)
+    for fn in (log_exponential(2.), log_normal(1.5, 3.2)):
+        for f in (fn, pickle.loads(pickle.dumps(fn))):
+            ys = f.eval(xs)
+            assert ys.dtype == np.float32
+            assert ys.shape == xs.shape
+            for x, y in zip(xs, ys):
+                assert_almost_equals(f(x), y, places=5)
+            assert np.array_equal(ys, f.eval(xs.reshape(-1, 1)))
+
+    pts = np.array([[0.8, 0.2], [1.0, 3.0], [-1.0, 2.0]])
+    ys = log_noninformative_beta_prior.eval(pts)
+    assert ys.shape == (3,)
+    for (alpha, beta), y in zip(pts, ys):
+        assert_almost_equals(
+            log_noninformative_beta_prior(alpha, beta), y, places=5)
+    assert np.isinf(ys[2])
+    assert log_noninformative_beta_prior.eval(np.zeros((0, 2))).shape == (0,)
+
+    assert_raises(ValueError, log_noninformative_beta_prior.eval, xs)
+    assert_raises(ValueError, log_normal(0., 1.).eval, pts)
+
+
+_IMPORT_TIME_SCRIPT = """
+import json, sys
+import microscopes.models
+import microscopes.common.query
+import microscopes.common.random
+import microscopes.common.util
+print(json.dumps({'modules': list(sys.modules.keys())}))
+"""
+
+# only needed by some functions of the modules above, so not imported with
+# them
+_LAZY_MODULE_PREFIXES = (
+    'scipy',
+    'distributions.dbg',
+    'distributions.io',
+    'microscopes.dbg',
+    'microscopes.io',
+)
+
+
+def test_import_time():
+    # a fresh interpreter, so nothing is already imported
+    out = subprocess.check_output([sys.executable, '-c', _IMPORT_TIME_SCRIPT])
+    result = json.loads(out.decode().strip().splitlines()[-1])
+    eager = sorted(m for m in result['modules']
+                   if m.startswith(_LAZY_MODULE_PREFIXES))
+    assert not eager, "imported eagerly: {}".format(', '.join(eager))
@@ -7,10 +7,13 @@ from microscopes.models import (
     bbnc,
     niw,
     dm,
+    hypergrid,
 )
 
-from nose.tools import assert_equals
+from nose.tools import assert_equals, assert_raises
 
+import numpy as np
+import itertools as it
 import pickle
 
 
@@ -29,6 +32,7 @@ def test_models_pickle():
         bbnc,
         niw(3),
         dm(5),
+        dm(5, sparse=True),
     )
 
     for model in models:
@@ -45,3 +49,86 @@ def test_models_pickle():
         elif model.name() == 'dm':
             assert_equals(model.py_desc().get_np_dtype().shape,
                           model1.py_desc().get_np_dtype().shape)
+            assert_equals(len(model.default_hyperparams()['alphas']),
+                          len(model1.default_hyperparams()['alphas']))
+
+
+def test_models_dm_sparse():
+    assert_equals(dm(5).py_desc().get_np_dtype().shape, (5,))
+    assert_equals(dm(5, sparse=True).py_desc().get_np_dtype().shape, ())
+
+
+def test_models_hypergrid():
+    pts = np.logspace(-1, 1, num=100)
+    expected = [
+        {'alpha': alpha, 'beta': beta} for alpha, beta in it.product(pts, pts)
+    ]
+    grid = bb.default_partial_hypergrid()
+    assert_equals(grid.names(), ('alpha', 'beta'))
+    assert_equals(len(grid), len(expected))
+    assert_equals(list(grid), expected)
+    assert_equals(grid[17], expected[17])
+    assert not grid.array.flags.writeable
+
+    # the grid is built once, and shared by the models which use it
+    assert grid.array is bnb.default_partial_hypergrid().array
+    assert grid.array is bbnc.default_partial_hypergrid().array
+
+    grid1 = pickle.loads(pickle.dumps(grid))
+    assert np.array_equal(grid.array, grid1.array)
+
+    for model in (dd(5), niw(3), dm(5)):
+        assert_equals(len(model.default_partial_hypergrid()), 0)
+        assert_equals(list(model.default_partial_hypergrid()), [])
+
+    assert_equals(
+        list(nich.default_partial_hypergrid())[0]['sigmasq'], 0.1)
+    assert_equals(dm(5).default_hyperparams(), dd(5).default_hyperparams())
+
+
+def test_models_hypergrid_lazy():
+    calls = []
+
+    def builder():
+        calls.append(None)
+        return np.zeros(3, dtype=[('alpha', float)])
+
+    grid = hypergrid(builder)
+    assert_equals(calls, [])
+    assert_equals(len(grid), 3)
+    assert_equals(list(grid), [{'alpha': 0.}] * 3)
+    assert_equals(len(calls), 1)
+
+
+def test_models_hypergrid_as_list():
+    expected = [
+        {'alpha': alpha, 'beta': beta}
+        for alpha, beta in it.product([1., 2., 3.], [4., 5.])
+    ]
+
+    def builder():
+        array = np.empty(6, dtype=[('alpha', float), ('beta', float)])
+        for i, point in enumerate(expected):
+            array[i] = (point['alpha'], point['beta'])
+        return array
+
+    grid = hypergrid(builder)
+
+    # slices are lists of points
+    assert_equals(grid[1:3], expected[1:3])
+    assert_equals(grid[::-2], expected[::-2])
+    assert_equals(grid[10:], [])
+    assert_equals(grid[-1], expected[-1])
+
+    assert_equals(grid + [{'alpha': 0.}], expected + [{'alpha': 0.}])
+    assert_equals([{'alpha': 0.}] + grid, [{'alpha': 0.}] + expected)
+    assert_equals(grid + grid, expected + expected)
+    assert_raises(TypeError, lambda: grid + 1)
+
+    assert grid == expected
+    assert expected == grid
+    assert grid == hypergrid(builder)
+    assert not grid != expected
+    assert grid != expected[1:]
+    assert grid != hypergrid(lambda: np.empty(0, dtype=[]))
+    assert grid != 1
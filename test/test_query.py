@@ -2,7 +2,10 @@
 # than actual unit tests
 
 import numpy as np
+import itertools as it
+import pickle
 from microscopes.common import query
+from microscopes.common.testutil import permutation_canonical
 
 from nose.tools import (
     assert_equals,
@@ -24,6 +27,59 @@ def test_groups():
                   sorted(map(len, truth_clustering), reverse=True))
 
 
+def test_groups_csr():
+    avec = np.array([34, 34, 5, 11, 5, 5433])
+    offsets, members = query.groups_csr(avec)
+    assert_equals(list(offsets), [0, 2, 3, 5, 6])
+    assert_equals(list(members), [2, 4, 3, 0, 1, 5])
+
+    offsets, members = query.groups_csr(avec, sort=True)
+    sizes = np.diff(offsets)
+    assert_equals(list(sizes), sorted(sizes, reverse=True))
+    for beg, end in zip(offsets[:-1], offsets[1:]):
+        assert_equals(len(np.unique(avec[members[beg:end]])), 1)
+    assert_equals(sorted(members), range(avec.shape[0]))
+
+
+def test_canonicalize():
+    assignments = np.random.randint(0, 6, size=(20, 15))
+    canonical = query.canonicalize(assignments)
+    assert_equals(canonical.shape, assignments.shape)
+    for avec, cavec in zip(assignments, canonical):
+        assert_equals(list(permutation_canonical(avec)), list(cavec))
+    assert_equals(list(query.canonicalize(assignments[0])),
+                  list(canonical[0]))
+
+
+def test_map_and_consensus_assignment():
+    truth = np.array([0] * 5 + [1] * 4 + [2] * 6)
+    noise = [np.random.randint(0, 3, size=truth.shape) for _ in xrange(3)]
+    # relabelings of the same clustering should be counted together
+    assignments = [truth] * 3 + [truth + 7] * 3 + noise
+
+    assert_equals(list(query.map_assignment(assignments)), list(truth))
+    assert_equals(list(query.consensus_assignment(assignments)), list(truth))
+
+    scores = np.zeros(len(assignments))
+    scores[-1] = 1.
+    assert_equals(list(query.map_assignment(assignments, scores)),
+                  list(query.canonicalize(noise[-1])))
+
+
+def test_consensus_assignment_blocks():
+    assignments = np.random.RandomState(27).randint(0, 4, size=(25, 30))
+    expected = query.consensus_assignment(assignments, chunksize=7)
+    block_size = query._CONSENSUS_BLOCK_SIZE
+    try:
+        # blocks smaller than a chunk, and than the non-zeros
+        for query._CONSENSUS_BLOCK_SIZE in (1, 50, 1000):
+            assert_equals(
+                list(query.consensus_assignment(assignments, chunksize=7)),
+                list(expected))
+    finally:
+        query._CONSENSUS_BLOCK_SIZE = block_size
+
+
 def test_zmatrix():
     assignments = [
         [2, 345, 2, 2],
@@ -34,6 +90,97 @@ def test_zmatrix():
     assert_true(query._is_square_ndarray(zmat))
 
 
+def _zmatrix_slow(assignments):
+    # the original (quadratic, pure python) z-matrix implementation
+    n = len(assignments[0])
+    zmat = np.zeros((n, n), dtype=np.float32)
+    for avec in assignments:
+        for cluster in query.groups(avec):
+            for i, j in it.product(cluster, repeat=2):
+                zmat[i, j] += 1
+    zmat /= float(len(assignments))
+    return zmat
+
+
+def test_zmatrix_matches_slow():
+    assignments = np.random.randint(-1, 5, size=(30, 20))
+    truth = _zmatrix_slow(assignments)
+    assert_almost_equals(np.abs(query.zmatrix(assignments) - truth).max(), 0.)
+    assert_almost_equals(
+        np.abs(query.zmatrix(assignments, chunksize=7) - truth).max(), 0.)
+
+    # chunked mode should accept any iterable of avecs
+    zmat = query.zmatrix(iter(assignments.tolist()), chunksize=4)
+    assert_almost_equals(np.abs(zmat - truth).max(), 0.)
+
+
+def test_zmatrix_sparse():
+    assignments = np.random.randint(0, 3, size=(25, 15))
+    truth = _zmatrix_slow(assignments)
+
+    zmat = query.zmatrix(assignments, sparse=True)
+    assert_equals(zmat.shape, truth.shape)
+    assert_almost_equals(np.abs(zmat.toarray() - truth).max(), 0., places=5)
+
+    threshold = 0.45
+    zmat = query.zmatrix(
+        assignments, sparse=True, threshold=threshold, chunksize=6)
+    truth[truth < threshold] = 0.
+    assert_equals(zmat.nnz, np.count_nonzero(truth))
+    assert_almost_equals(np.abs(zmat.toarray() - truth).max(), 0., places=5)
+
+
+def test_zmatrix_accumulator():
+    assignments = np.random.randint(0, 4, size=(40, 12))
+    truth = _zmatrix_slow(assignments)
+
+    for sparse in (False, True):
+        acc = query.ZMatrixAccumulator(12, sparse=sparse, chunksize=7)
+        for avec in assignments[:25]:
+            acc.update(avec)
+
+        # checkpoint/resume
+        acc = pickle.loads(pickle.dumps(acc))
+        assert_equals(acc.nsamples(), 25)
+
+        # a second "chain"
+        acc1 = query.ZMatrixAccumulator(12, sparse=sparse, chunksize=3)
+        for avec in assignments[25:]:
+            acc1.update(list(avec))
+
+        acc.merge(acc1)
+        assert_equals(acc.nsamples(), assignments.shape[0])
+        zmat = acc.zmatrix()
+        if sparse:
+            zmat = zmat.toarray()
+        assert_almost_equals(np.abs(zmat - truth).max(), 0., places=5)
+
+
+def test_zmatrix_accumulator_merge_mixed():
+    import scipy.sparse
+    assignments = np.random.randint(0, 4, size=(20, 12))
+    truth = _zmatrix_slow(assignments)
+
+    for sparse in (False, True):
+        acc = query.ZMatrixAccumulator(12, sparse=sparse)
+        acc1 = query.ZMatrixAccumulator(12, sparse=not sparse)
+        for avec in assignments[:8]:
+            acc.update(avec)
+        for avec in assignments[8:]:
+            acc1.update(avec)
+
+        # the result keeps the representation of the accumulator merged into
+        acc.merge(acc1)
+        zmat = acc.zmatrix()
+        if sparse:
+            assert_true(scipy.sparse.isspmatrix_csr(zmat))
+            zmat = zmat.toarray()
+        else:
+            assert_equals(type(zmat), np.ndarray)
+        assert_equals(zmat.dtype, np.float32)
+        assert_almost_equals(np.abs(zmat - truth).max(), 0., places=5)
+
+
 def test_zmatrix_reorder():
     assignments = [
         [2, 345, 2, 2],
@@ -54,3 +201,26 @@ def test_zmatrix_heuristic_block_reordering():
     zmat = query.zmatrix(assignments)
     order = query.zmatrix_heuristic_block_ordering(zmat)
     assert_true(query._is_permutation(order, zmat.shape[0]))
+
+
+def test_zmatrix_block_ordering():
+    truth = np.array([0] * 5 + [1] * 3 + [2] * 7)
+    pi = np.random.permutation(truth.shape[0])
+    truth = truth[pi]
+    assignments = [truth] * 10 + [np.random.randint(0, 3, size=truth.shape)]
+
+    zmat = query.zmatrix(assignments)
+    order, blocks = query.zmatrix_block_ordering(zmat, return_blocks=True)
+    assert_true(query._is_permutation(order, zmat.shape[0]))
+    assert_equals(list(blocks), [0, 7, 12, 15])
+    for beg, end in zip(blocks[:-1], blocks[1:]):
+        assert_equals(len(np.unique(truth[order[beg:end]])), 1)
+
+    order1 = query.zmatrix_block_ordering(query.zmatrix(assignments,
+                                                        sparse=True))
+    assert_true(query._is_permutation(order1, zmat.shape[0]))
+
+    order2, blocks2 = query.assignments_block_ordering(
+        assignments, return_blocks=True, chunksize=4)
+    assert_true(query._is_permutation(order2, zmat.shape[0]))
+    assert_equals(list(blocks), list(blocks2))
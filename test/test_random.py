@@ -0,0 +1,94 @@
+from microscopes.common.rng import rng
+from microscopes.common.random import (
+    sample_multivariate_normal,
+    sample_wishart,
+    sample_inverse_wishart,
+    sample_normal_inverse_wishart,
+)
+
+from nose.tools import assert_equals, assert_raises
+
+import numpy as np
+
+
+def _random_cov(dim, prng):
+    A = prng.normal(size=(dim, dim))
+    return np.dot(A, A.T) + dim * np.eye(dim)
+
+
+def test_sample_multivariate_normal():
+    prng = np.random.RandomState(3487)
+    dim = 5
+    mu = prng.normal(size=dim)
+    cov = _random_cov(dim, prng)
+
+    x = sample_multivariate_normal(mu, cov, rng(12))
+    assert_equals(x.shape, (dim,))
+    assert_equals(x.dtype, np.float64)
+
+    # a batch starts with the draw made on its own
+    X = sample_multivariate_normal(mu, cov, rng(12), size=3)
+    assert_equals(X.shape, (3, dim))
+    assert np.allclose(X[0], x, atol=1e-4)
+
+    X = sample_multivariate_normal(mu, cov, rng(5), size=100000)
+    assert np.allclose(X.mean(axis=0), mu, atol=0.1)
+    assert np.allclose(np.cov(X.T), cov, rtol=0.05, atol=0.1)
+
+    # float32 and non-contiguous inputs are accepted
+    x = sample_multivariate_normal(
+        mu.astype(np.float32), np.asfortranarray(cov), rng(12))
+    assert_equals(x.shape, (dim,))
+
+    assert_raises(ValueError, sample_multivariate_normal, mu, cov[:-1], rng())
+    assert_raises(ValueError, sample_multivariate_normal, cov, cov, rng())
+
+
+def test_sample_wisharts():
+    prng = np.random.RandomState(9231)
+    dim = 4
+    psi = _random_cov(dim, prng)
+    nu = dim + 2.
+
+    for fn in (sample_wishart, sample_inverse_wishart):
+        S = fn(nu, psi, rng(7))
+        assert_equals(S.shape, (dim, dim))
+        assert_equals(S.dtype, np.float64)
+        assert np.allclose(S, S.T, rtol=1e-4)
+        assert (np.linalg.eigvalsh(S) > 0.).all()
+
+    mu, cov = sample_normal_inverse_wishart(
+        np.zeros(dim), 1., psi, nu, rng(7))
+    assert_equals(mu.shape, (dim,))
+    assert_equals(cov.shape, (dim, dim))
+    assert (np.linalg.eigvalsh(cov) > 0.).all()
+
+
+def test_sample_inverse_wishart_mean():
+    prng = np.random.RandomState(1293)
+    dim = 3
+    psi = _random_cov(dim, prng)
+    nu = dim + 6.
+    r = rng(44)
+    mean = sum(sample_inverse_wishart(nu, psi, r)
+               for _ in xrange(20000)) / 20000.
+    expected = psi / (nu - dim - 1.)
+    assert np.allclose(mean, expected, rtol=0.05, atol=0.05)
+
+
+def test_sample_normal_inverse_wishart_chol():
+    prng = np.random.RandomState(512)
+    dim = 6
+    psi = _random_cov(dim, prng)
+    mu, cov, chol = sample_normal_inverse_wishart(
+        np.ones(dim), 2., psi, dim + 3., rng(9), return_chol=True)
+    assert_equals(chol.shape, (dim, dim))
+    assert np.allclose(np.triu(chol, k=1), 0.)
+    assert np.allclose(np.dot(chol, chol.T), cov, rtol=1e-4, atol=1e-5)
+    assert np.allclose(np.linalg.cholesky(cov), chol, rtol=1e-3, atol=1e-4)
+
+    # the same draw as without the factor
+    mu1, cov1 = sample_normal_inverse_wishart(
+        np.ones(dim), 2., psi, dim + 3., rng(9))
+    assert np.array_equal(mu, mu1)
+    assert np.array_equal(cov, cov1)
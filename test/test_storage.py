@@ -0,0 +1,145 @@
+from microscopes.common.recarray.dataview import (
+    numpy_dataview as recarray_numpy_dataview,
+)
+from microscopes.common.relation.dataview import (
+    numpy_dataview as relation_numpy_dataview,
+    sparse_2d_dataview,
+    sparse_nd_dataview,
+)
+from microscopes.common.variadic.dataview import (
+    numpy_dataview as variadic_numpy_dataview,
+)
+from microscopes.common.storage import save_dataview, open_dataview
+
+import numpy as np
+import numpy.ma as ma
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from scipy.sparse import csr_matrix
+
+from nose.tools import (
+    assert_equals,
+    assert_true,
+    assert_raises,
+)
+
+
+def _hexdigest(obj):
+    h = hashlib.sha1()
+    obj.digest(h)
+    return h.hexdigest()
+
+
+def _is_mapped(arr):
+    while isinstance(arr, np.ndarray):
+        if isinstance(arr, np.memmap):
+            return True
+        arr = arr.base
+    return False
+
+
+def _roundtrip(view):
+    path = tempfile.mkdtemp()
+    try:
+        save_dataview(path, view)
+        view1 = open_dataview(path)
+        assert_equals(type(view1), type(view))
+        assert_equals(_hexdigest(view1), _hexdigest(view))
+        return view1
+    finally:
+        shutil.rmtree(path)
+
+
+def test_recarray():
+    dtype = [('a', np.int32), ('b', np.float32, (3,))]
+    x = np.zeros(10, dtype=dtype)
+    x['a'] = np.arange(10)
+    x['b'] = np.random.uniform(size=(10, 3))
+    view = _roundtrip(recarray_numpy_dataview(x))
+    assert_true((view._data == x).all())
+    assert_true(isinstance(view._data.base, np.memmap))
+
+    mask = np.zeros(10, dtype=[('a', np.bool_), ('b', np.bool_, (3,))])
+    mask['b'][::3, 1] = True
+    view = _roundtrip(recarray_numpy_dataview(ma.array(x, mask=mask)))
+    assert_true((view._data == x).all())
+    assert_true((view._mask == mask).all())
+    assert_true(isinstance(view._maskbits.base, np.memmap))
+
+
+def test_relation_dense():
+    x = np.random.randint(-5, 5, size=(3, 4, 5)).astype(np.int32)
+    view = _roundtrip(relation_numpy_dataview(x))
+    assert_true((view.toarray() == x).all())
+
+    mask = np.random.uniform(size=x.shape) < 0.3
+    view = _roundtrip(relation_numpy_dataview(ma.array(x, mask=mask)))
+    assert_true((view.toarray().data == x).all())
+    assert_true((view.toarray().mask == mask).all())
+
+
+def test_relation_sparse():
+    y = np.random.randint(-2, 3, size=(20, 15)).astype(np.float32)
+    view = sparse_2d_dataview(csr_matrix(y))
+    view1 = _roundtrip(view)
+    assert_equals((view1.tocsr() != view.tocsr()).nnz, 0)
+    assert_equals((view1.tocsc() != view.tocsc()).nnz, 0)
+
+    # explicit zeros survive the round trip
+    view = sparse_2d_dataview(csr_matrix(y), explicit_zeros=True)
+    assert_equals(_roundtrip(view).nnz(), view.nnz())
+
+    # int64 indices are neither downcast nor copied when reopened
+    for itype in (np.int32, np.int64):
+        csr = csr_matrix(y)
+        csr.indices = csr.indices.astype(itype)
+        csr.indptr = csr.indptr.astype(itype)
+        view1 = _roundtrip(sparse_2d_dataview(csr))
+        rep = view1.tocsr()
+        assert_equals(rep.indices.dtype, itype)
+        assert_equals((rep != csr).nnz, 0)
+        for arr in (rep.data, rep.indices, rep.indptr) + view1.csc_index():
+            assert_true(_is_mapped(arr))
+
+    x = np.random.randint(-5, 5, size=(3, 4, 5)).astype(np.int32)
+    indices = np.nonzero(np.random.uniform(size=x.shape) < 0.5)
+    view = sparse_nd_dataview(indices, x[indices], x.shape)
+    view1 = _roundtrip(view)
+    assert_true((view1.indices() == view.indices()).all())
+    assert_true((view1.toarray() == view.toarray()).all())
+    # neither the positions nor the index are copied or rebuilt
+    for arr in (view1.indices(),) + view1.slice_index():
+        assert_true(_is_mapped(arr))
+    for arr, arr1 in zip(view.slice_index(), view1.slice_index()):
+        assert_true((arr == arr1).all())
+
+
+def test_variadic():
+    data = [np.random.randint(10, size=n) for n in (3, 0, 7, 1)]
+    view = _roundtrip(variadic_numpy_dataview(data))
+    assert_equals(len(view), len(data))
+    for row, row1 in zip(data, view._data):
+        assert_true((row == row1).all())
+    assert_true(isinstance(view.values().base, np.memmap))
+
+
+def test_bad_header():
+    path = tempfile.mkdtemp()
+    try:
+        assert_raises(IOError, open_dataview, path)
+        assert_raises(ValueError, save_dataview, path, np.zeros(3))
+
+        # other format versions are refused
+        save_dataview(path, relation_numpy_dataview(np.zeros((2, 2))))
+        header_path = os.path.join(path, 'header.json')
+        with open(header_path) as fp:
+            header = json.load(fp)
+        header['version'] += 1
+        with open(header_path, 'w') as fp:
+            json.dump(header, fp)
+        assert_raises(ValueError, open_dataview, path)
+    finally:
+        shutil.rmtree(path)